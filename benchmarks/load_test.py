@@ -0,0 +1,365 @@
+"""
+Prueba de carga de /api/stations/search con clientes concurrentes.
+
+Levanta un upstream sintético y la app con uvicorn en un proceso aparte (o usa
+una URL ya desplegada con --url), y la recorre con N clientes concurrentes
+durante un tiempo fijo, con una mezcla configurable de los modos de búsqueda y
+orígenes distribuidos sobre Chile. Informa histograma de latencias, percentiles,
+throughput y tasa de error, total y por modo.
+
+Uso:
+    python -m benchmarks.load_test --concurrency 50 --duration 30
+    python -m benchmarks.load_test --handlers sync --threadpool 40 --concurrency 200
+    python -m benchmarks.load_test --url http://mi-servidor:8000 --concurrency 100
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.mock_upstream import MockUpstream
+from benchmarks.synthetic import generate_payload, random_origins
+
+# Modo -> parámetros de la query (los cuatro modos de la API más los de límite y costo)
+QUERY_MODES: Dict[str, Dict[str, str]] = {
+    "nearest": {"nearest": "true"},
+    "cheapest": {"cheapest": "true"},
+    "store": {"nearest": "true", "store": "true"},
+    "nearest_cheapest": {"nearest": "true", "cheapest": "true"},
+    "cheapest_radius": {"cheapest": "true", "radius_km": "10", "limit": "5"},
+    "cost": {"alpha": "10", "limit": "5"},
+}
+DEFAULT_MIX = "nearest=50,cheapest=15,store=15,nearest_cheapest=20"
+PRODUCTS = [("93", 50), ("95", 10), ("97", 15), ("diesel", 20), ("kerosene", 5)]
+
+# Límites superiores de los buckets del histograma, en ms
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf"))
+
+APPS = {"async": "main:app", "sync": "benchmarks.sync_app:app"}
+
+
+def parse_mix(texto: str) -> Dict[str, float]:
+    """
+    Interpreta una mezcla `modo=peso,...` de modos de búsqueda.
+
+    Args:
+        texto: Mezcla, p. ej. "nearest=50,cheapest=50"
+
+    Returns:
+        Dict modo -> peso
+    """
+    mezcla = {}
+    for parte in texto.split(","):
+        modo, _, peso = parte.partition("=")
+        modo = modo.strip()
+        if modo not in QUERY_MODES:
+            raise ValueError(f"Modo desconocido: {modo}. Use: {', '.join(QUERY_MODES)}")
+        mezcla[modo] = float(peso or 1)
+    return mezcla
+
+
+def build_requests(n: int, mix: Dict[str, float], seed: int, distribution: str) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    Genera la secuencia de búsquedas que recorre cada cliente.
+
+    Args:
+        n: Cantidad de búsquedas
+        mix: Pesos por modo
+        seed: Semilla
+        distribution: "population" (como la población) o "uniform" (sobre todo Chile continental)
+
+    Returns:
+        Lista de (modo, parámetros de la query)
+    """
+    rng = random.Random(seed)
+    modos = rng.choices(list(mix), weights=list(mix.values()), k=n)
+    productos = rng.choices([p for p, _ in PRODUCTS], weights=[w for _, w in PRODUCTS], k=n)
+    if distribution == "uniform":
+        origenes = [(rng.uniform(-53.0, -18.5), rng.uniform(-73.5, -69.5)) for _ in range(n)]
+    else:
+        origenes = random_origins(n, seed)
+    return [
+        (modo, {"lat": f"{lat:.5f}", "lng": f"{lng:.5f}", "product": product, **QUERY_MODES[modo]})
+        for modo, product, (lat, lng) in zip(modos, productos, origenes)
+    ]
+
+
+async def _drive(url: str, concurrency: int, duration: float, requests: List[Tuple[str, Dict[str, str]]],
+                 timeout: float) -> Dict[str, Any]:
+    """Ejecuta `concurrency` clientes durante `duration` segundos y junta latencias por modo."""
+    latencias: Dict[str, List[float]] = {modo: [] for modo, _ in requests}
+    errores: Dict[str, int] = {}
+    errores_por_modo: Dict[str, int] = {}
+    siguiente = 0
+    fin = time.perf_counter() + duration
+    limites = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limites) as client:
+        async def cliente():
+            nonlocal siguiente
+            while time.perf_counter() < fin:
+                modo, params = requests[siguiente % len(requests)]
+                siguiente += 1
+                inicio = time.perf_counter()
+                try:
+                    response = await client.get("/api/stations/search", params=params)
+                    ok = response.status_code == 200 and response.json().get("success", False)
+                    motivo = f"status_{response.status_code}" if response.status_code != 200 else "sin_resultado"
+                except httpx.HTTPError as e:
+                    ok, motivo = False, type(e).__name__
+                latencias[modo].append(time.perf_counter() - inicio)
+                if not ok:
+                    errores[motivo] = errores.get(motivo, 0) + 1
+                    errores_por_modo[modo] = errores_por_modo.get(modo, 0) + 1
+
+        inicio_total = time.perf_counter()
+        await asyncio.gather(*(cliente() for _ in range(concurrency)))
+        transcurrido = time.perf_counter() - inicio_total
+    return {"latencies": latencias, "errors": errores, "errors_by_mode": errores_por_modo,
+            "elapsed": transcurrido}
+
+
+def _drive_process(url: str, concurrency: int, duration: float, requests, timeout: float) -> Dict[str, Any]:
+    return asyncio.run(_drive(url, concurrency, duration, requests, timeout))
+
+
+def run_load(url: str, concurrency: int, duration: float, mix: Dict[str, float], seed: int = 0,
+             distribution: str = "population", processes: int = 1, timeout: float = 30.0,
+             warmup: float = 2.0) -> Dict[str, Any]:
+    """
+    Genera carga contra una instancia de la API ya levantada.
+
+    Args:
+        url: URL base de la API
+        concurrency: Clientes concurrentes en total
+        duration: Segundos de medición
+        mix: Pesos por modo de búsqueda
+        seed: Semilla de las búsquedas
+        distribution: Distribución de orígenes ("population" o "uniform")
+        processes: Procesos generadores (para que el cliente no sea el cuello de botella)
+        timeout: Timeout por solicitud en segundos
+        warmup: Segundos de calentamiento que no se miden
+
+    Returns:
+        Reporte con latencias, histograma, throughput y errores
+    """
+    por_proceso = [concurrency // processes + (1 if i < concurrency % processes else 0) for i in range(processes)]
+    requests = [build_requests(5000, mix, seed + i, distribution) for i in range(processes)]
+    if warmup > 0:
+        asyncio.run(_drive(url, min(concurrency, 8), warmup, requests[0], timeout))
+
+    if processes == 1:
+        partes = [asyncio.run(_drive(url, concurrency, duration, requests[0], timeout))]
+    else:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=get_context("spawn")) as pool:
+            futuros = [pool.submit(_drive_process, url, n, duration, requests[i], timeout)
+                       for i, n in enumerate(por_proceso) if n > 0]
+            partes = [futuro.result() for futuro in futuros]
+
+    latencias: Dict[str, List[float]] = {}
+    errores: Dict[str, int] = {}
+    errores_por_modo: Dict[str, int] = {}
+    for parte in partes:
+        for modo, valores in parte["latencies"].items():
+            latencias.setdefault(modo, []).extend(valores)
+        for motivo, cantidad in parte["errors"].items():
+            errores[motivo] = errores.get(motivo, 0) + cantidad
+        for modo, cantidad in parte["errors_by_mode"].items():
+            errores_por_modo[modo] = errores_por_modo.get(modo, 0) + cantidad
+    transcurrido = max(parte["elapsed"] for parte in partes)
+
+    todas = [valor for valores in latencias.values() for valor in valores]
+    por_modo = {
+        modo: {**_summary(valores, transcurrido), "errors": errores_por_modo.get(modo, 0)}
+        for modo, valores in latencias.items() if valores
+    }
+    total_errores = sum(errores.values())
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(transcurrido, 2),
+        "mix": mix,
+        "distribution": distribution,
+        "total": {**_summary(todas, transcurrido), "errors": total_errores,
+                  "error_rate": round(total_errores / len(todas), 4) if todas else 0.0},
+        "errors_by_reason": errores,
+        "by_mode": por_modo,
+        "histogram_ms": _histogram(todas),
+    }
+
+
+def _summary(valores: List[float], transcurrido: float) -> Dict[str, Any]:
+    if not valores:
+        return {"requests": 0}
+    ordenados = sorted(valores)
+
+    def percentil(p):
+        return round(ordenados[min(len(ordenados) - 1, round(p / 100 * (len(ordenados) - 1)))] * 1000, 3)
+
+    return {
+        "requests": len(valores),
+        "throughput_rps": round(len(valores) / transcurrido, 1),
+        "p50_ms": percentil(50),
+        "p90_ms": percentil(90),
+        "p99_ms": percentil(99),
+        "max_ms": round(ordenados[-1] * 1000, 3),
+    }
+
+
+def _histogram(valores: List[float]) -> List[Dict[str, Any]]:
+    conteos = [0] * len(HISTOGRAM_BUCKETS_MS)
+    for valor in valores:
+        ms = valor * 1000
+        for i, limite in enumerate(HISTOGRAM_BUCKETS_MS):
+            if ms <= limite:
+                conteos[i] += 1
+                break
+    return [{"le_ms": "+Inf" if limite == float("inf") else limite, "count": conteo}
+            for limite, conteo in zip(HISTOGRAM_BUCKETS_MS, conteos)]
+
+
+def print_report(reporte: Dict[str, Any]) -> None:
+    """Imprime el reporte en texto: totales, histograma y tabla por modo."""
+    total = reporte["total"]
+    print(f"\n{reporte['concurrency']} clientes, {reporte['duration_s']} s: {total.get('requests', 0)} solicitudes, "
+          f"{total.get('throughput_rps', 0)} req/s, errores {total['errors']} ({total['error_rate']:.2%})")
+    if total.get("requests"):
+        print(f"latencia p50={total['p50_ms']} ms p90={total['p90_ms']} ms p99={total['p99_ms']} ms "
+              f"max={total['max_ms']} ms\n")
+        maximo = max(bucket["count"] for bucket in reporte["histogram_ms"]) or 1
+        for bucket in reporte["histogram_ms"]:
+            barra = "#" * round(40 * bucket["count"] / maximo)
+            print(f"  <= {str(bucket['le_ms']):>5} ms {bucket['count']:>8}  {barra}")
+    print(f"\n  {'modo':<17} {'req':>8} {'req/s':>9} {'p50':>9} {'p99':>9} {'errores':>8}")
+    for modo, datos in sorted(reporte["by_mode"].items()):
+        print(f"  {modo:<17} {datos['requests']:>8} {datos['throughput_rps']:>9} {datos['p50_ms']:>9} "
+              f"{datos['p99_ms']:>9} {datos['errors']:>8}")
+    if reporte["errors_by_reason"]:
+        print(f"\n  errores: {reporte['errors_by_reason']}")
+
+
+class LocalDeployment:
+    """Upstream sintético más la app servida por uvicorn en un proceso aparte."""
+
+    def __init__(self, stations: int, handlers: str = "async", workers: int = 1,
+                 threadpool: Optional[int] = None, upstream_latency: float = 0.0, seed: int = 0):
+        """
+        Args:
+            stations: Estaciones del listado sintético
+            handlers: "async" (main.py) o "sync" (benchmarks/sync_app.py)
+            workers: Workers de uvicorn
+            threadpool: Hilos del pool para handlers síncronos (None = el de Starlette)
+            upstream_latency: Latencia simulada del upstream en segundos
+            seed: Semilla del listado
+        """
+        self.upstream = MockUpstream(generate_payload(stations, seed), latency=upstream_latency)
+        self.handlers = handlers
+        self.workers = workers
+        self.threadpool = threadpool
+        self.port = _free_port()
+        self._process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "LocalDeployment":
+        self.upstream.start()
+        env = {**os.environ, "API_BASE_URL": self.upstream.url, "SNAPSHOT_DIR": "", "MAPPINGS_CONFIG": "",
+               "HEALTH_PROBE_SECONDS": "0"}
+        if self.threadpool:
+            env["LOAD_THREADPOOL_SIZE"] = str(self.threadpool)
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", APPS[self.handlers], "--host", "127.0.0.1",
+             "--port", str(self.port), "--workers", str(self.workers), "--log-level", "warning",
+             "--no-access-log"],
+            env=env
+        )
+        self._wait_ready()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+        self.upstream.stop()
+
+    def _wait_ready(self, timeout: float = 120.0) -> None:
+        limite = time.monotonic() + timeout
+        while time.monotonic() < limite:
+            if self._process.poll() is not None:
+                raise RuntimeError("uvicorn terminó antes de quedar listo")
+            try:
+                if httpx.get(f"{self.url}/health/ready", timeout=2).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("La app no quedó lista a tiempo")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Prueba de carga de /api/stations/search")
+    parser.add_argument("--url", default=None, help="API ya levantada (si no, se levanta una local)")
+    parser.add_argument("--concurrency", type=int, default=50, help="Clientes concurrentes")
+    parser.add_argument("--duration", type=float, default=20.0, help="Segundos de medición")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Segundos de calentamiento")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Mezcla de modos (por defecto {DEFAULT_MIX})")
+    parser.add_argument("--distribution", choices=["population", "uniform"], default="population",
+                        help="Distribución de los orígenes sobre Chile")
+    parser.add_argument("--processes", type=int, default=1, help="Procesos generadores de carga")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Timeout por solicitud")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stations", type=int, default=20000, help="Estaciones del upstream sintético")
+    parser.add_argument("--handlers", choices=sorted(APPS), default="async",
+                        help="Handlers de la app local: async (main.py) o sync (pool de hilos)")
+    parser.add_argument("--workers", type=int, default=1, help="Workers de uvicorn de la app local")
+    parser.add_argument("--threadpool", type=int, default=None, help="Hilos del pool con --handlers sync")
+    parser.add_argument("--upstream-latency", type=float, default=0.0, help="Latencia del upstream sintético")
+    parser.add_argument("--output", default=None, help="Archivo JSON con el reporte")
+    args = parser.parse_args(argv)
+
+    mezcla = parse_mix(args.mix)
+
+    def ejecutar(url):
+        return run_load(url, args.concurrency, args.duration, mezcla, args.seed, args.distribution,
+                        args.processes, args.timeout, args.warmup)
+
+    if args.url:
+        reporte = ejecutar(args.url)
+        reporte["target"] = {"url": args.url}
+    else:
+        with LocalDeployment(args.stations, args.handlers, args.workers, args.threadpool,
+                             args.upstream_latency, args.seed) as despliegue:
+            reporte = ejecutar(despliegue.url)
+        reporte["target"] = {"handlers": args.handlers, "workers": args.workers, "threadpool": args.threadpool,
+                             "stations": args.stations}
+
+    print_report(reporte)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
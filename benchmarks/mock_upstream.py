@@ -0,0 +1,224 @@
+"""
+Upstream local que reemplaza a la API de Bencina en Línea en benchmarks y pruebas de carga.
+Sirve busqueda_estacion_filtro y combustible_ciudadano desde memoria con ETag,
+así se puede medir el servicio sin depender de la red ni de la API real.
+
+También inyecta fallas, programadas por solicitud con `inject()` o al azar con
+`set_fault_rates()`:
+
+- "status:503": responde ese status sin cuerpo
+- "delay:2.5": espera esos segundos antes de responder
+- "stall:2.5": envía los encabezados y espera esos segundos antes del cuerpo
+- "truncate": envía la mitad del cuerpo y cierra la conexión
+- "reset": cierra la conexión con RST sin responder
+
+Uso independiente:
+    python -m benchmarks.mock_upstream --stations 20000 --port 8081
+    python -m benchmarks.mock_upstream --error-rate 0.2 --slow-rate 0.1 --slow-seconds 5
+"""
+
+import argparse
+import hashlib
+import random
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, Optional
+
+from benchmarks.synthetic import generate_fuels, generate_payload
+
+
+class MockUpstream:
+    """Servidor HTTP en un hilo aparte con los endpoints del upstream."""
+
+    def __init__(self, payload: bytes, fuels: Optional[bytes] = None, latency: float = 0.0,
+                 host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            payload: Cuerpo JSON de busqueda_estacion_filtro
+            fuels: Cuerpo JSON de combustible_ciudadano (por defecto el sintético)
+            latency: Segundos de espera antes de cada respuesta
+            host: Interfaz donde escuchar
+            port: Puerto (0 = uno libre)
+        """
+        self.latency = latency
+        self.requests: Dict[str, int] = {}
+        self._faults: Dict[str, Deque[str]] = {}
+        self._fault_rates: Dict[str, float] = {}
+        self._rng = random.Random(0)
+        self._bodies: Dict[str, bytes] = {}
+        self._etags: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.set_body("busqueda_estacion_filtro", payload)
+        self.set_body("combustible_ciudadano", fuels if fuels is not None else generate_fuels())
+        self._server = ThreadingHTTPServer((host, port), _handler_for(self))
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """URL base equivalente a API_BASE_URL."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def set_body(self, endpoint: str, body: bytes) -> None:
+        """Reemplaza el cuerpo de un endpoint (p. ej. para simular un cambio de precios)."""
+        with self._lock:
+            self._bodies[endpoint] = body
+            self._etags[endpoint] = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+
+    def inject(self, endpoint: str, *faults: str) -> None:
+        """
+        Programa fallas para las próximas solicitudes a un endpoint, una por solicitud
+        y en orden ("ok" deja pasar una solicitud sin falla).
+
+        Args:
+            endpoint: Endpoint afectado (p. ej. "combustible_ciudadano")
+            faults: Fallas como "status:503", "delay:2", "stall:2", "truncate", "reset" u "ok"
+        """
+        with self._lock:
+            self._faults.setdefault(endpoint, deque()).extend(faults)
+
+    def set_fault_rates(self, error: float = 0.0, reset: float = 0.0, slow: float = 0.0,
+                        slow_seconds: float = 5.0, seed: int = 0) -> None:
+        """
+        Fallas al azar para todas las solicitudes sin falla programada.
+
+        Args:
+            error: Probabilidad de responder 503
+            reset: Probabilidad de cortar la conexión
+            slow: Probabilidad de demorar la respuesta `slow_seconds`
+            slow_seconds: Demora de las respuestas lentas
+            seed: Semilla del sorteo
+        """
+        with self._lock:
+            self._fault_rates = {"status:503": error, "reset": reset, f"delay:{slow_seconds}": slow}
+            self._rng = random.Random(seed)
+
+    def count(self, endpoint: str) -> int:
+        """Solicitudes recibidas por un endpoint."""
+        return self.requests.get(endpoint, 0)
+
+    def start(self) -> "MockUpstream":
+        """Empieza a atender solicitudes en segundo plano."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-upstream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Detiene el servidor."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockUpstream":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _respond(self, handler: BaseHTTPRequestHandler) -> None:
+        endpoint = handler.path.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1]
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            body = self._bodies.get(endpoint)
+            etag = self._etags.get(endpoint)
+            fault = self._next_fault(endpoint)
+        if self.latency:
+            time.sleep(self.latency)
+
+        tipo, _, valor = fault.partition(":")
+        if tipo == "delay":
+            time.sleep(float(valor))
+        elif tipo == "status":
+            handler.send_response(int(valor))
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+        elif tipo == "reset":
+            # SO_LINGER en 0: al cerrar se envía RST en lugar de FIN
+            handler.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            handler.close_connection = True
+            return
+
+        if body is None:
+            handler.send_response(404)
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+        if handler.headers.get("If-None-Match") == etag:
+            handler.send_response(304)
+            handler.send_header("ETag", etag)
+            handler.end_headers()
+            return
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.send_header("ETag", etag)
+        handler.end_headers()
+        if tipo == "stall":
+            handler.wfile.flush()
+            time.sleep(float(valor))
+        if tipo == "truncate":
+            handler.wfile.write(body[:len(body) // 2])
+            handler.close_connection = True
+            return
+        handler.wfile.write(body)
+
+    def _next_fault(self, endpoint: str) -> str:
+        """Falla para la solicitud actual: la próxima programada o una al azar (con el lock tomado)."""
+        programadas = self._faults.get(endpoint)
+        if programadas:
+            return programadas.popleft()
+        sorteo = self._rng.random()
+        for fault, probabilidad in self._fault_rates.items():
+            if sorteo < probabilidad:
+                return fault
+            sorteo -= probabilidad
+        return "ok"
+
+
+def _handler_for(upstream: MockUpstream):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            try:
+                upstream._respond(self)
+            except (BrokenPipeError, ConnectionResetError):
+                # El cliente cortó antes (p. ej. por timeout ante una falla inyectada)
+                self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Upstream sintético de Bencina en Línea")
+    parser.add_argument("--stations", type=int, default=20000, help="Cantidad de estaciones")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla del generador")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latencia por respuesta en segundos")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de respuestas 503")
+    parser.add_argument("--reset-rate", type=float, default=0.0, help="Fracción de conexiones cortadas")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fracción de respuestas lentas")
+    parser.add_argument("--slow-seconds", type=float, default=5.0, help="Demora de las respuestas lentas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    upstream = MockUpstream(generate_payload(args.stations, args.seed), latency=args.latency,
+                            host=args.host, port=args.port)
+    upstream.set_fault_rates(args.error_rate, args.reset_rate, args.slow_rate, args.slow_seconds, args.seed)
+    print(f"Upstream sintético con {args.stations} estaciones en {upstream.url}")
+    try:
+        upstream._server.serve_forever()
+    except KeyboardInterrupt:
+        upstream.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Benchmarks de búsqueda y refresco contra un upstream sintético local.
+
+Para cada tamaño de listado y cada modo de búsqueda se levanta un proceso nuevo
+(así el pico de RSS es el de ese modo) que descarga el snapshot desde el upstream
+sintético y ejecuta búsquedas con orígenes distribuidos como la población. Los
+resultados se guardan en JSON y se pueden comparar con una corrida anterior.
+
+Uso:
+    python -m benchmarks.run_benchmarks --sizes 2000 20000 200000 --queries 2000
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/anterior.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional
+
+from benchmarks.mock_upstream import MockUpstream
+from benchmarks.synthetic import generate_payload, random_origins, reprice
+
+# Modo -> parámetros de search_stations
+SEARCH_MODES: Dict[str, Dict[str, Any]] = {
+    "nearest": {"nearest": True},
+    "cheapest": {"cheapest": True},
+    "store": {"nearest": True, "store": True},
+    "nearest_cheapest": {"nearest": True, "cheapest": True},
+    "cheapest_radius": {"cheapest": True, "radius_km": 10.0, "limit": 5},
+    "cost": {"alpha": 10.0, "limit": 5},
+}
+
+# Productos consultados, con su peso en la mezcla de búsquedas
+PRODUCT_MIX = [("93", 50), ("95", 10), ("97", 15), ("diesel", 20), ("kerosene", 5)]
+
+# Métricas donde un valor mayor es una regresión
+COMPARED_METRICS = ("p50_ms", "p99_ms", "refresh_s", "peak_rss_mb")
+
+
+def run_mode(url: str, mode: str, queries: int, seed: int, search_cache: bool) -> Dict[str, Any]:
+    """
+    Mide un modo de búsqueda en el proceso actual (se ejecuta en un proceso hijo).
+
+    Args:
+        url: URL base del upstream sintético
+        mode: Clave de SEARCH_MODES
+        queries: Cantidad de búsquedas
+        seed: Semilla de los orígenes
+        search_cache: Si se deja activa la caché de búsquedas
+
+    Returns:
+        Dict con tiempos de refresco, percentiles de latencia, throughput y pico de RSS
+    """
+    os.environ["API_BASE_URL"] = url
+    os.environ["SNAPSHOT_DIR"] = ""
+    os.environ["MAPPINGS_CONFIG"] = ""
+    os.environ["HEALTH_PROBE_SECONDS"] = "0"
+    os.environ["SEARCH_CACHE_SIZE"] = "10000" if search_cache else "0"
+    from services.fuel_service import FuelService
+
+    servicio = FuelService()
+    inicio = time.perf_counter()
+    snapshot = servicio.cache.refresh()
+    refresh_s = time.perf_counter() - inicio
+    if snapshot is None:
+        raise RuntimeError(f"No se pudo descargar el snapshot: {servicio.cache.last_error}")
+    # Segunda descarga: el upstream responde 304 por ETag
+    inicio = time.perf_counter()
+    servicio.cache.refresh()
+    revalidate_s = time.perf_counter() - inicio
+
+    rng = random.Random(seed)
+    productos = rng.choices([p for p, _ in PRODUCT_MIX], weights=[w for _, w in PRODUCT_MIX], k=queries)
+    parametros = SEARCH_MODES[mode]
+    latencias = []
+    errores = 0
+    inicio_total = time.perf_counter()
+    for (lat, lng), product in zip(random_origins(queries, seed), productos):
+        inicio = time.perf_counter()
+        resultado = servicio.search_stations(lat, lng, product, **parametros)
+        latencias.append(time.perf_counter() - inicio)
+        if isinstance(resultado, dict) and "error" in resultado:
+            errores += 1
+    total_s = time.perf_counter() - inicio_total
+
+    latencias.sort()
+    return {
+        "stations": len(snapshot.store),
+        "queries": queries,
+        "errors": errores,
+        "refresh_s": round(refresh_s, 4),
+        "revalidate_s": round(revalidate_s, 4),
+        "p50_ms": round(_percentile(latencias, 50) * 1000, 4),
+        "p90_ms": round(_percentile(latencias, 90) * 1000, 4),
+        "p99_ms": round(_percentile(latencias, 99) * 1000, 4),
+        "max_ms": round(latencias[-1] * 1000, 4),
+        "mean_ms": round(statistics.fmean(latencias) * 1000, 4),
+        "throughput_qps": round(queries / total_s, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def peak_rss_mb() -> float:
+    """Pico de memoria residente del proceso en MB."""
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KB; macOS, bytes
+    return maximo / (1024 * 1024) if sys.platform == "darwin" else maximo / 1024
+
+
+def run_benchmarks(sizes: List[int], modes: List[str], queries: int, seed: int = 0,
+                   search_cache: bool = False) -> Dict[str, Any]:
+    """
+    Ejecuta todos los benchmarks.
+
+    Args:
+        sizes: Cantidades de estaciones del listado sintético
+        modes: Modos de búsqueda a medir
+        queries: Búsquedas por modo
+        seed: Semilla del listado y de los orígenes
+        search_cache: Si se deja activa la caché de búsquedas
+
+    Returns:
+        Dict con metadatos de la corrida y un resultado por (tamaño, modo)
+    """
+    resultados = []
+    contexto = get_context("spawn")
+    for size in sizes:
+        payload = generate_payload(size, seed)
+        with MockUpstream(payload) as upstream:
+            for mode in modes:
+                with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as pool:
+                    medicion = pool.submit(run_mode, upstream.url, mode, queries, seed, search_cache).result()
+                resultado = {"size": size, "mode": mode, "payload_mb": round(len(payload) / 1e6, 2), **medicion}
+                resultados.append(resultado)
+                print(f"{size:>7} {mode:<17} p50={resultado['p50_ms']:.3f} ms p99={resultado['p99_ms']:.3f} ms "
+                      f"{resultado['throughput_qps']:>9.0f} q/s refresh={resultado['refresh_s']:.2f} s "
+                      f"rss={resultado['peak_rss_mb']:.0f} MB", flush=True)
+
+            # Refresco incremental: el proceso ya tiene el snapshot y el upstream cambia precios
+            resultado = {"size": size, "mode": "refresh_incremental",
+                         **_incremental_refresh(upstream, payload, contexto)}
+            resultados.append(resultado)
+            print(f"{size:>7} {'refresh_incremental':<17} refresh={resultado['refresh_s']:.2f} s "
+                  f"rss={resultado['peak_rss_mb']:.0f} MB", flush=True)
+    return {"meta": _metadata(queries, seed, search_cache), "results": resultados}
+
+
+def _incremental_refresh(upstream: MockUpstream, payload: bytes, contexto) -> Dict[str, Any]:
+    with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as pool:
+        return pool.submit(_measure_incremental, upstream.url, reprice(payload)).result()
+
+
+def _measure_incremental(url: str, nuevo_payload: bytes) -> Dict[str, Any]:
+    """Carga el snapshot y mide el refresco contra un upstream con precios cambiados (proceso hijo)."""
+    os.environ["API_BASE_URL"] = url
+    os.environ["SNAPSHOT_DIR"] = ""
+    os.environ["HEALTH_PROBE_SECONDS"] = "0"
+    from services.fuel_service import FuelService
+
+    servicio = FuelService()
+    servicio.cache.refresh()
+    with MockUpstream(nuevo_payload) as cambiado:
+        servicio.client.base_url = cambiado.url
+        inicio = time.perf_counter()
+        servicio.cache.refresh()
+        refresh_s = time.perf_counter() - inicio
+    return {"refresh_s": round(refresh_s, 4), "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+def compare(actual: Dict[str, Any], anterior: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Compara dos corridas y lista las métricas que empeoraron más que `threshold`.
+
+    Args:
+        actual: Resultados de esta corrida
+        anterior: Resultados de la corrida de referencia
+        threshold: Empeoramiento relativo tolerado (0.2 = 20 %)
+
+    Returns:
+        Lista de descripciones de regresiones
+    """
+    referencia = {(r["size"], r["mode"]): r for r in anterior["results"]}
+    regresiones = []
+    for resultado in actual["results"]:
+        base = referencia.get((resultado["size"], resultado["mode"]))
+        if base is None:
+            continue
+        for metrica in COMPARED_METRICS:
+            if metrica in resultado and base.get(metrica):
+                cambio = resultado[metrica] / base[metrica] - 1
+                if cambio > threshold:
+                    regresiones.append(f"{resultado['size']} {resultado['mode']} {metrica}: "
+                                       f"{base[metrica]} -> {resultado[metrica]} (+{cambio:.0%})")
+    return regresiones
+
+
+def _percentile(valores: List[float], percentil: float) -> float:
+    posicion = min(len(valores) - 1, max(0, round(percentil / 100 * (len(valores) - 1))))
+    return valores[posicion]
+
+
+def _metadata(queries: int, seed: int, search_cache: bool) -> Dict[str, Any]:
+    import numpy
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "queries_per_mode": queries,
+        "seed": seed,
+        "search_cache": search_cache,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks de búsqueda contra un upstream sintético")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2000, 20000, 200000],
+                        help="Cantidades de estaciones del listado sintético")
+    parser.add_argument("--modes", nargs="+", choices=sorted(SEARCH_MODES), default=list(SEARCH_MODES),
+                        help="Modos de búsqueda a medir")
+    parser.add_argument("--queries", type=int, default=2000, help="Búsquedas por modo")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--search-cache", action="store_true", help="Medir con la caché de búsquedas activa")
+    parser.add_argument("--output", default=None, help="Archivo JSON de resultados")
+    parser.add_argument("--compare", default=None, help="Resultados anteriores con los que comparar")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Empeoramiento tolerado al comparar")
+    args = parser.parse_args(argv)
+
+    resultados = run_benchmarks(args.sizes, args.modes, args.queries, args.seed, args.search_cache)
+
+    salida = args.output or os.path.join("benchmarks", "results",
+                                         f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(salida) or ".", exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(resultados, f, indent=2)
+    print(f"Resultados guardados en {salida}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regresiones = compare(resultados, json.load(f), args.threshold)
+        for regresion in regresiones:
+            print(f"REGRESIÓN {regresion}")
+        return 1 if regresiones else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+Variante de la app con el endpoint de búsqueda síncrono (`def`), para comparar en
+pruebas de carga el pool de hilos de Starlette contra los handlers `async def`.
+
+Usa el mismo ciclo de vida y servicio que `main.py`. LOAD_THREADPOOL_SIZE fija la
+cantidad de hilos del pool (40 por defecto en Starlette).
+"""
+
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import anyio.to_thread
+from fastapi import Depends, FastAPI, Query
+
+from main import get_fuel_service, lifespan as main_lifespan, search_response
+from services.fuel_service import FuelService, MAX_SEARCH_LIMIT
+from utils.json_response import FastJSONResponse
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tamano = os.getenv("LOAD_THREADPOOL_SIZE")
+    if tamano:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = int(tamano)
+    async with main_lifespan(app):
+        yield
+
+
+app = FastAPI(title="API de Estaciones de Combustible Chile (handlers síncronos)", lifespan=lifespan,
+              default_response_class=FastJSONResponse)
+
+
+@app.get("/health/ready")
+def chequeo_listo(service: FuelService = Depends(get_fuel_service)):
+    listo, motivo = service.readiness()
+    return FastJSONResponse({"status": "ready" if listo else "not_ready", "motivo": motivo},
+                            status_code=200 if listo else 503)
+
+
+@app.get("/api/stations/search")
+def search_stations(
+    lat: float,
+    lng: float,
+    product: str,
+    nearest: bool = False,
+    store: bool = False,
+    cheapest: bool = False,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_SEARCH_LIMIT),
+    offset: int = Query(0, ge=0),
+    radius_km: Optional[float] = Query(None, gt=0),
+    alpha: Optional[float] = Query(None, ge=0),
+    service: FuelService = Depends(get_fuel_service)
+):
+    result = service.search_stations(lat, lng, product, nearest, store, cheapest, limit, offset, radius_km, alpha)
+    return FastJSONResponse({**search_response(result), "snapshot": service.snapshot_info()})
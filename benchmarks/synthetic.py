@@ -0,0 +1,154 @@
+"""
+Generador de payloads sintéticos de busqueda_estacion_filtro.
+Las estaciones se concentran alrededor de las ciudades de Chile según su
+población, con marcas, combustibles y precios distribuidos como en el listado
+real (COPEC y Shell dominan, casi todas venden 93 y diesel, pocas kerosene,
+los precios suben hacia los extremos del país).
+"""
+
+import json
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+# (nombre, región, lat, lng, peso, dispersión en grados)
+CITIES = [
+    ("Santiago", "Metropolitana de Santiago", -33.45, -70.65, 40, 0.25),
+    ("Valparaíso", "Valparaíso", -33.05, -71.55, 9, 0.20),
+    ("Concepción", "Biobío", -36.82, -73.05, 8, 0.25),
+    ("Antofagasta", "Antofagasta", -23.65, -70.40, 4, 0.15),
+    ("La Serena", "Coquimbo", -29.90, -71.25, 4, 0.20),
+    ("Rancagua", "Libertador General Bernardo O'Higgins", -34.17, -70.74, 4, 0.25),
+    ("Talca", "Maule", -35.43, -71.66, 4, 0.30),
+    ("Temuco", "La Araucanía", -38.74, -72.60, 4, 0.30),
+    ("Puerto Montt", "Los Lagos", -41.47, -72.94, 3, 0.30),
+    ("Iquique", "Tarapacá", -20.21, -70.15, 2, 0.10),
+    ("Arica", "Arica y Parinacota", -18.48, -70.31, 2, 0.10),
+    ("Calama", "Antofagasta", -22.46, -68.93, 1, 0.10),
+    ("Copiapó", "Atacama", -27.37, -70.33, 2, 0.15),
+    ("Chillán", "Ñuble", -36.61, -72.10, 2, 0.25),
+    ("Valdivia", "Los Ríos", -39.81, -73.25, 2, 0.20),
+    ("Osorno", "Los Lagos", -40.57, -73.13, 1, 0.20),
+    ("Coyhaique", "Aysén del General Carlos Ibáñez del Campo", -45.57, -72.07, 1, 0.20),
+    ("Punta Arenas", "Magallanes y de la Antártica Chilena", -53.16, -70.91, 1, 0.15),
+]
+
+# (id de marca, peso)
+BRANDS = [(5, 36), (4, 22), (151, 12), (3, 6), (88, 6), (2, 4), (118, 5), (10, 3), (122, 2),
+          (25, 1), (15, 1), (27, 1), (37, 1)]
+
+# (id de combustible, nombre corto, probabilidad de que la estación lo venda, recargo sobre la 93)
+FUELS = [(1, "93", 0.99, 0), (2, "97", 0.85, 130), (7, "95", 0.40, 70), (3, "DI", 0.95, -300),
+         (4, "KE", 0.25, -150)]
+
+SERVICES = ["Tienda", "Baño", "Cajero automático", "Aire", "Agua", "Lavado", "Farmacia"]
+
+
+def generate_stations(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Genera estaciones con el formato raw de busqueda_estacion_filtro.
+
+    Args:
+        n: Cantidad de estaciones
+        seed: Semilla del generador (mismo seed, mismas estaciones)
+
+    Returns:
+        Lista de estaciones raw
+    """
+    rng = random.Random(seed)
+    ciudades = rng.choices(CITIES, weights=[ciudad[4] for ciudad in CITIES], k=n)
+    marcas = rng.choices([marca for marca, _ in BRANDS], weights=[peso for _, peso in BRANDS], k=n)
+
+    estaciones = []
+    for i, ((nombre, region, lat, lng, _, dispersion), marca) in enumerate(zip(ciudades, marcas)):
+        lat_estacion = lat + rng.gauss(0, dispersion)
+        lng_estacion = lng + rng.gauss(0, dispersion * 0.6)
+        # Precio base de la 93: más caro lejos de la zona central y en estaciones sin bandera
+        base = 1230 + abs(lat - -33.45) * 4 + rng.gauss(0, 25) + (20 if marca in (10, 118) else 0)
+
+        combustibles = [
+            {
+                "id": id_combustible,
+                "nombre_corto": corto,
+                "precio": f"{base + recargo + rng.gauss(0, 10):.1f}",
+                "unidad_cobro": "$/L",
+                "fecha_hora_actualizacion": "2024-01-01 08:00:00"
+            }
+            for id_combustible, corto, probabilidad, recargo in FUELS
+            if rng.random() < probabilidad
+        ]
+        estaciones.append({
+            "id": i + 1,
+            "marca": marca,
+            "razon_social": f"Distribuidora {i + 1} SpA",
+            "direccion": f"Avenida {rng.randint(1, 500)} #{rng.randint(1, 9999)}",
+            "comuna": nombre,
+            "region": region,
+            "latitud": f"{lat_estacion:.6f}",
+            "longitud": f"{lng_estacion:.6f}",
+            "horario_atencion": "24 horas" if rng.random() < 0.6 else "07:00 - 23:00",
+            "servicios": [{"nombre": servicio} for servicio in rng.sample(SERVICES, rng.randint(0, 4))],
+            "combustibles": combustibles
+        })
+    return estaciones
+
+
+def generate_payload(n: int, seed: int = 0) -> bytes:
+    """
+    Cuerpo JSON completo de busqueda_estacion_filtro con `n` estaciones.
+
+    Args:
+        n: Cantidad de estaciones
+        seed: Semilla del generador
+
+    Returns:
+        bytes con el JSON
+    """
+    return json.dumps({"data": generate_stations(n, seed)}, ensure_ascii=False).encode("utf-8")
+
+
+def generate_fuels() -> bytes:
+    """Cuerpo JSON de combustible_ciudadano."""
+    return json.dumps({"data": [{"id": id_combustible, "nombre_corto": corto}
+                                for id_combustible, corto, _, _ in FUELS]}).encode("utf-8")
+
+
+def reprice(payload: bytes, fraction: float = 0.05, seed: int = 1) -> bytes:
+    """
+    Copia del payload con el precio de una fracción de las estaciones modificado,
+    para medir refrescos incrementales.
+
+    Args:
+        payload: Cuerpo JSON de busqueda_estacion_filtro
+        fraction: Fracción de estaciones a modificar
+        seed: Semilla del generador
+
+    Returns:
+        bytes con el JSON modificado
+    """
+    rng = random.Random(seed)
+    data = json.loads(payload)
+    for estacion in rng.sample(data["data"], int(len(data["data"]) * fraction)):
+        for combustible in estacion["combustibles"]:
+            combustible["precio"] = f"{float(combustible['precio']) + rng.choice((-10, 10)):.1f}"
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def random_origins(n: int, seed: int = 0, spread: Optional[float] = None) -> List[Tuple[float, float]]:
+    """
+    Orígenes de búsqueda distribuidos como la población (y por lo tanto como las estaciones).
+
+    Args:
+        n: Cantidad de orígenes
+        seed: Semilla del generador
+        spread: Dispersión en grados alrededor de cada ciudad (None = la de la ciudad)
+
+    Returns:
+        Lista de (lat, lng)
+    """
+    rng = random.Random(seed)
+    ciudades = rng.choices(CITIES, weights=[ciudad[4] for ciudad in CITIES], k=n)
+    return [
+        (lat + rng.gauss(0, spread if spread is not None else dispersion),
+         lng + rng.gauss(0, (spread if spread is not None else dispersion) * 0.6))
+        for _, _, lat, lng, _, dispersion in ciudades
+    ]
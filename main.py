@@ -1,73 +1,171 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import Depends, FastAPI, Query, Request
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
 from datetime import datetime
-from services.fuel_service import FuelService
+from services.fuel_service import FuelService, MAX_SEARCH_LIMIT
+from utils.json_response import FastJSONResponse, RawJSON, RawJSONResponse, RawJSONStreamResponse, dumps_object
+from utils.metrics import CONTENT_TYPE, REGISTRY, MetricsMiddleware
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Un único servicio por proceso: cliente HTTP, snapshot e índices se crean al iniciar
+    service = FuelService()
+    app.state.fuel_service = service
+    await service.warm_up()
+    yield
+    await service.close()
 
 app = FastAPI(
     title="API de Estaciones de Combustible Chile",
     description="Mi API para buscar estaciones de combustible",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
+app.add_middleware(MetricsMiddleware)
+
+def get_fuel_service(request: Request) -> FuelService:
+    """Servicio compartido de la app (se crea aquí si la app corre sin lifespan)"""
+    service = getattr(request.app.state, "fuel_service", None)
+    if service is None:
+        service = request.app.state.fuel_service = FuelService()
+    return service
 
 @app.get("/")
-def inicio():
-    service = FuelService()
+async def inicio(service: FuelService = Depends(get_fuel_service)):
     return {
         "mensaje": "Esta ready",
         "autor": "Ignacio Torres González",
-        "test": service.test_connection()
+        "test": service.upstream_status()
     }
 
 @app.get("/test")
-def prueba():
+async def prueba():
     return {"status": "OK", "info": "Conexión ready"}
 
 @app.get("/health")
-def chequeo_salud():
-    """Endpoint de monitoreo del estado de la aplicación"""
-    service = FuelService()
-    api_status = service.test_connection()
+async def chequeo_salud(service: FuelService = Depends(get_fuel_service)):
+    """Endpoint de monitoreo del estado de la aplicación (se responde desde memoria)"""
+    reporte = service.health_report()
     
     return {
-        "status": "healthy" if "ready" in api_status else "degraded",
+        "status": reporte["status"],
         "timestamp": datetime.now().isoformat(),
-        "api_externa": api_status,
+        "api_externa": reporte["api_externa"],
+        "upstream": reporte["upstream"],
+        "listo": reporte["listo"],
+        "snapshot": service.snapshot_info(),
+        "rol_snapshot": service.snapshot_role,
+        "cache_busquedas": service.search_cache.stats(),
         "version": "1.0.0",
-        "uptime": "running"
+        "uptime": reporte["uptime_segundos"]
     }
 
+@app.get("/health/live")
+async def chequeo_vida():
+    """Liveness: el proceso atiende solicitudes"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def chequeo_listo(service: FuelService = Depends(get_fuel_service)):
+    """Readiness: hay un snapshot de estaciones suficientemente reciente"""
+    listo, motivo = service.readiness()
+    return FastJSONResponse({"status": "ready" if listo else "not_ready", "motivo": motivo,
+                             "snapshot": service.snapshot_info()},
+                            status_code=200 if listo else 503)
+
+@app.get("/metrics")
+async def metricas(service: FuelService = Depends(get_fuel_service)):
+    """Métricas de este proceso en formato de texto de Prometheus"""
+    service.update_metrics()
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 @app.get("/combustibles")
-def obtener_combustibles():
-    service = FuelService()
-    data = service.get_combustibles()
-    return {"datos": data, "fuente": "API real Bencina en Línea"}
+async def obtener_combustibles(service: FuelService = Depends(get_fuel_service)):
+    datos = await service.get_combustibles_json_async()
+    return RawJSONResponse(dumps_object({"datos": RawJSON(datos), "fuente": "API real Bencina en Línea"}))
 
 @app.get("/estaciones")
-def obtener_estaciones():
-    service = FuelService()
-    data = service.buscar_estaciones()
-    return {"total_estaciones": len(data.get('data', [])), "muestra": data}
+async def obtener_estaciones(service: FuelService = Depends(get_fuel_service)):
+    # El payload se envía por partes desde el cuerpo raw (mmap en snapshots restaurados) sin
+    # copiarlo; sólo el resumen se arma en cada request
+    snapshot = await service.get_snapshot_async()
+    if snapshot is None:
+        return {"total_estaciones": 0, "muestra": service.snapshot_error(), "snapshot": service.snapshot_info()}
+    return RawJSONStreamResponse({
+        "total_estaciones": len(snapshot.stations),
+        "muestra": RawJSON(snapshot.payload_json()),
+        "snapshot": service.snapshot_info()
+    })
+
+@app.get("/api/stations/aggregates")
+async def station_aggregates(
+    by: str = "region",
+    product: Optional[str] = None,
+    service: FuelService = Depends(get_fuel_service)
+):
+    """Precio mínimo, promedio y máximo por producto y por región, comuna o compañía"""
+    result = await service.get_aggregates_async(by, product)
+    if isinstance(result, dict):
+        return FastJSONResponse({"success": False, "error": result["error"], "snapshot": service.snapshot_info()})
+    return RawJSONResponse(dumps_object({"success": True, "agrupacion": by, "data": RawJSON(result),
+                                         "snapshot": service.snapshot_info()}))
+
+def search_response(result):
+    if isinstance(result, dict) and 'error' in result:
+        return {"success": False, "error": result['error']}
+    
+    return {"success": True, "data": result}
 
 @app.get("/api/stations/search")
-def search_stations(
+async def search_stations(
     lat: float,
     lng: float,
     product: str,
     nearest: bool = False,
     store: bool = False,
+    cheapest: bool = False,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_SEARCH_LIMIT),
+    offset: int = Query(0, ge=0),
+    radius_km: Optional[float] = Query(None, gt=0),
+    alpha: Optional[float] = Query(None, ge=0),
+    service: FuelService = Depends(get_fuel_service)
+):
+    result = await service.search_stations_async(lat, lng, product, nearest, store, cheapest,
+                                                 limit, offset, radius_km, alpha)
+    return FastJSONResponse({**search_response(result), "snapshot": service.snapshot_info()})
+
+class SearchQuery(BaseModel):
+    lat: float
+    lng: float
+    product: str
+    nearest: bool = False
+    store: bool = False
     cheapest: bool = False
+    limit: Optional[int] = None
+    offset: int = 0
+    radius_km: Optional[float] = None
+    alpha: Optional[float] = None
+
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchQuery] = Field(..., max_length=1000)
+
+@app.post("/api/stations/search/batch")
+async def search_stations_batch(
+    body: BatchSearchRequest,
+    service: FuelService = Depends(get_fuel_service)
 ):
-    service = FuelService()
-    result = service.search_stations(lat, lng, product, nearest, store, cheapest)
-    
-    if isinstance(result, dict) and 'error' in result:
-        return {"success": False, "error": result['error']}
-    
-    return {"success": True, "data": result}
+    """Búsqueda para muchos orígenes en una sola llamada, contra un mismo snapshot"""
+    results = await service.search_stations_batch_async([query.model_dump() for query in body.queries])
+    return FastJSONResponse({"success": True, "total": len(results),
+                             "results": [search_response(r) for r in results],
+                             "snapshot": service.snapshot_info()})
 
 @app.get("/debug/estacion")
-def debug_estacion():
-    service = FuelService()
-    data = service.buscar_estaciones()
+async def debug_estacion(service: FuelService = Depends(get_fuel_service)):
+    data = await service.get_estaciones_async()
     
     if 'data' in data and len(data['data']) > 0:
         # Buscar específicamente la estación 42
@@ -89,9 +187,8 @@ def debug_estacion():
     return {"error": "No hay datos"}
 
 @app.get("/debug/tiendas")
-def debug_tiendas():
-    service = FuelService()
-    data = service.buscar_estaciones()
+async def debug_tiendas(service: FuelService = Depends(get_fuel_service)):
+    data = await service.get_estaciones_async()
     
     if 'data' in data:
         # Buscar estaciones que podrían tener tienda
@@ -1,101 +1,682 @@
-import httpx
+import asyncio
+import hashlib
+import logging
 import os
+import time
+from collections import namedtuple
+from datetime import datetime
+from typing import Optional
 from dotenv import load_dotenv
-from utils.distance import calculate_distance
+from utils.aggregates import GROUPINGS
 from utils.mappings import (
-    get_product_id, 
-    get_company_name, 
-    has_convenience_store, 
-    get_store_info, 
     validate_product,
-    get_valid_products
+    get_valid_products,
+    reload_mappings_if_changed
 )
+from utils.distance import haversine_matrix
 from utils.search_utils import (
-    process_station_data,
-    filter_stations_by_store,
-    apply_search_logic,
+    compact_station,
+    depends_on_origin,
+    nearest_pool_size,
+    rank_candidate_rows,
+    select_candidate_rows,
+    select_search_rows,
     build_error_response,
     validate_coordinates
 )
+from utils.geohash import decode_geohash_bounds, encode_geohash
+from utils.json_response import dumps
+from utils.json_stream import JsonArrayStream
+from utils.metrics import (
+    CACHE_ENTRIES,
+    CACHE_HIT_RATIO,
+    PARSE_SECONDS,
+    SEARCH_STAGE_SECONDS,
+    SNAPSHOT_AGE_SECONDS,
+    SNAPSHOT_STATIONS,
+    SNAPSHOT_VERSION,
+    UPSTREAM_CIRCUIT_OPEN,
+    UPSTREAM_COALESCED,
+    UPSTREAM_READ_TIMEOUT_SECONDS,
+    UPSTREAM_UP
+)
+from utils.result_cache import ResultCache
+from utils.single_flight import SingleFlight
+from utils.station import build_station_results
+from services.station_cache import FetchResult, StationCache
+from services.shared_snapshot import SnapshotCoordinator
+from services.snapshot_persistence import load_snapshot, save_snapshot
+from services.resilience import CircuitBreaker, ResilienceConfig
+from services.upstream_client import UpstreamClient
 
 # Cargar variables de entorno
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Máximo de estaciones por página en búsquedas con `limit`
+MAX_SEARCH_LIMIT = 50
+
+# Clave de la caché de búsquedas: celda geohash del origen + criterios
+SearchCacheKey = namedtuple("SearchCacheKey", "geohash product nearest store cheapest k pool radius_km alpha")
+
+class _StationBody:
+    """Cuerpo de busqueda_estacion_filtro recibido por fragmentos: hash, bytes raw y estaciones compactas"""
+    
+    def __init__(self):
+        self._hash = hashlib.blake2b(digest_size=16)
+        self._chunks = []
+        self._parser = JsonArrayStream("data", transform=compact_station)
+        self._parse_seconds = 0.0
+    
+    def feed(self, chunk):
+        self._hash.update(chunk)
+        self._chunks.append(chunk)
+        inicio = time.perf_counter()
+        self._parser.feed(chunk)
+        self._parse_seconds += time.perf_counter() - inicio
+    
+    def close(self):
+        """Termina el parseo y retorna las estaciones (lanza ValueError si el JSON es inválido)"""
+        inicio = time.perf_counter()
+        estaciones = self._parser.close()
+        PARSE_SECONDS.observe(self._parse_seconds + time.perf_counter() - inicio)
+        if not self._parser.found:
+            raise ValueError("La respuesta no contiene 'data'")
+        return estaciones
+    
+    def hexdigest(self):
+        return self._hash.hexdigest()
+    
+    def raw(self):
+        return b"".join(self._chunks)
+
+class _UpstreamReply(namedtuple("_UpstreamReply", "status_code data")):
+    """Respuesta del upstream ya leída (JSON parseado si es 200), para compartirla entre llamadores"""
+    
+    @classmethod
+    def from_response(cls, response):
+        return cls(response.status_code, response.json() if response.status_code == 200 else None)
+
 class FuelService:
     def __init__(self):
         self.api_url = os.getenv("API_BASE_URL", "https://api.bencinaenlinea.cl/api")
         self.timeout = int(os.getenv("TIMEOUT_SECONDS", "30"))
+        self.cache_ttl = float(os.getenv("STATIONS_TTL_SECONDS", "300"))
+        self.refresh_interval = float(os.getenv("STATIONS_REFRESH_SECONDS", "240"))
+        self.snapshot_dir = os.getenv("SNAPSHOT_DIR") or None
+        self.snapshot_poll_interval = float(os.getenv("SNAPSHOT_POLL_SECONDS", "5"))
+        self.coordinator = SnapshotCoordinator(self.snapshot_dir) if self.snapshot_dir else None
+        self.search_cache_precision = int(os.getenv("SEARCH_CACHE_PRECISION", "7"))
+        self.search_cache = ResultCache(maxsize=int(os.getenv("SEARCH_CACHE_SIZE", "10000")),
+                                        ttl=float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "60")))
+        self.health_probe_interval = float(os.getenv("HEALTH_PROBE_SECONDS", "30"))
+        self.max_snapshot_age = float(os.getenv("HEALTH_MAX_SNAPSHOT_AGE_SECONDS", "900"))
+        self.started_at = time.time()
+        self._health_probe: Optional[asyncio.Task] = None
+        self.mappings_config = os.getenv("MAPPINGS_CONFIG") or None
+        reload_mappings_if_changed(self.mappings_config)
+        self.client = UpstreamClient(self.api_url, self.timeout, config=ResilienceConfig.from_env(self.timeout))
+        # Llamadas concurrentes al mismo endpoint comparten una sola solicitud al upstream
+        self.upstream_calls = SingleFlight(on_shared=lambda path: UPSTREAM_COALESCED.inc(path))
+        self._combustibles_json = None  # (versión del snapshot, expira, bytes)
+        self.cache = StationCache(self.fetch_snapshot, ttl=self.cache_ttl,
+                                  refresh_interval=self.refresh_interval,
+                                  fetch_async=self.fetch_snapshot_async)
+        self.cache.add_listener(self._invalidate_search_cache)
+        self.cache.add_listener(self._persist_snapshot)
+    
+    async def warm_up(self):
+        """
+        Abre el cliente HTTP, precarga el snapshot con sus índices e inicia el refresco periódico.
+        Si hay un snapshot guardado en disco se sirve de inmediato y se revalida en segundo plano.
+        Con varios workers sobre el mismo SNAPSHOT_DIR sólo uno descarga del upstream; el resto
+        lee el snapshot que ese worker publica.
+        """
+        self.client.open()
+        self.start_health_probe()
+        if self.coordinator is not None and not self.coordinator.acquire():
+            await self._follow_shared_snapshot()
+            return
+        
+        if self.cache.snapshot is None and self.snapshot_dir:
+            snapshot = await asyncio.to_thread(load_snapshot, self.snapshot_dir)
+            if snapshot is not None:
+                self.cache.publish(snapshot)
+        
+        if self.cache.snapshot is None:
+            await self.cache.refresh_async()
+        else:
+            self.cache.refresh_in_background()
+        self.cache.start()
+    
+    async def _follow_shared_snapshot(self):
+        """Configura este worker como lector del snapshot compartido"""
+        self.cache.set_source(self._load_shared_snapshot, refresh_interval=self.snapshot_poll_interval)
+        # El refrescador puede estar haciendo la primera descarga: se espera hasta el timeout
+        espera = 0.0
+        while self.cache.snapshot is None and espera < self.timeout:
+            if await self.cache.refresh_async() is None:
+                await asyncio.sleep(0.2)
+                espera += 0.2
+        self.cache.start()
+    
+    def _load_shared_snapshot(self):
+        """Fuente de la caché en workers lectores; si el refrescador murió, toma su lugar"""
+        if self.coordinator.acquire():
+            logger.info("Worker %s pasa a descargar estaciones del upstream", os.getpid())
+            self.cache.set_source(self.fetch_snapshot, self.fetch_snapshot_async, self.refresh_interval)
+            return self.fetch_snapshot()
+        self.reload_mappings()
+        return self.coordinator.load(self.cache.snapshot)
+    
+    @property
+    def snapshot_role(self):
+        """Rol de este worker respecto del snapshot: refrescador, lector o independiente"""
+        if self.coordinator is None:
+            return "independiente"
+        return "refrescador" if self.coordinator.is_refresher else "lector"
+    
+    def start_health_probe(self):
+        """Inicia el sondeo periódico del upstream en el event loop actual (idempotente)"""
+        if self.health_probe_interval > 0 and self._health_probe is None:
+            self._health_probe = asyncio.create_task(self._probe_upstream())
+    
+    async def _probe_upstream(self):
+        """Sondea el upstream sólo si no hubo solicitudes reales en el último intervalo"""
+        while True:
+            await asyncio.sleep(self.health_probe_interval)
+            ultima = self.client.health.last_activity
+            if ultima is None or time.time() - ultima >= self.health_probe_interval:
+                await self.test_connection_async()
+    
+    def upstream_status(self):
+        """Último estado conocido del upstream, sin llamarlo"""
+        return self.client.health.status_text()
+    
+    def readiness(self):
+        """
+        Si este worker puede atender búsquedas: hay snapshot y no supera
+        HEALTH_MAX_SNAPSHOT_AGE_SECONDS de antigüedad.
+        
+        Returns:
+            Tupla (listo, motivo)
+        """
+        snapshot = self.cache.snapshot
+        if snapshot is None:
+            return False, self.cache.last_error or "Sin snapshot de estaciones"
+        if snapshot.age() > self.max_snapshot_age:
+            return False, f"Snapshot con {round(snapshot.age())} s de antigüedad"
+        return True, "Snapshot vigente"
+    
+    def health_report(self):
+        """Estado completo para `/health`, armado sólo con datos en memoria"""
+        listo, motivo = self.readiness()
+        upstream = self.client.health
+        return {
+            "status": "healthy" if listo and upstream.ok else "degraded",
+            "api_externa": upstream.status_text(),
+            "upstream": {**upstream.to_dict(), "circuito": self.client.breaker.state},
+            "listo": listo,
+            "motivo": motivo,
+            "uptime_segundos": round(time.time() - self.started_at, 1)
+        }
+    
+    async def close(self):
+        """Detiene el refresco y el sondeo en segundo plano y cierra las conexiones"""
+        if self._health_probe is not None:
+            self._health_probe.cancel()
+            self._health_probe = None
+        self.cache.stop()
+        await self.client.aclose()
+        if self.coordinator is not None:
+            self.coordinator.release()
     
     def test_connection(self):
         try:
-            with httpx.Client(timeout=self.timeout) as client:
-                response = client.get(f"{self.api_url}/combustible_ciudadano")
-                if response.status_code == 200:
-                    return "Conexión ready"
-                else:
-                    return f"Respuesta: {response.status_code}"
+            return self._connection_status(self._get("combustible_ciudadano"))
+        except Exception as e:
+            return f"Error de conexión: {str(e)}"
+    
+    async def test_connection_async(self):
+        try:
+            return self._connection_status(await self._aget("combustible_ciudadano"))
         except Exception as e:
             return f"Error de conexión: {str(e)}"
     
     def get_combustibles(self):
         try:
-            with httpx.Client(timeout=self.timeout) as client:
-                response = client.get(f"{self.api_url}/combustible_ciudadano")
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    return {"error": f"Status: {response.status_code}"}
+            return self._json_or_error(self._get("combustible_ciudadano"))
+        except Exception as e:
+            return {"error": str(e)}
+    
+    async def get_combustibles_async(self):
+        try:
+            return self._json_or_error(await self._aget("combustible_ciudadano"))
         except Exception as e:
             return {"error": str(e)}
         
+    async def get_combustibles_json_async(self):
+        """
+        Combustibles ya serializados. Se reutilizan mientras no cambie el snapshot de
+        estaciones y como máximo STATIONS_TTL_SECONDS; los errores no se guardan.
+        """
+        snapshot = self.cache.snapshot
+        version = snapshot.version if snapshot is not None else None
+        guardado = self._combustibles_json
+        if guardado is not None and guardado[0] == version and time.time() < guardado[1]:
+            return guardado[2]
+        
+        data = await self.get_combustibles_async()
+        body = dumps(data)
+        if not (isinstance(data, dict) and 'error' in data):
+            self._combustibles_json = (version, time.time() + self.cache_ttl, body)
+        return body
+        
     def buscar_estaciones(self):
         try:
-            with httpx.Client(timeout=self.timeout) as client:
-                response = client.get(f"{self.api_url}/busqueda_estacion_filtro")
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    return {"error": f"Status: {response.status_code}"}
+            return self._json_or_error(self._get("busqueda_estacion_filtro"))
         except Exception as e:
             return {"error": str(e)}
     
-    def search_stations(self, lat: float, lng: float, product: str, nearest: bool = False, 
-                       store: bool = False, cheapest: bool = False):
+    async def buscar_estaciones_async(self):
         try:
-            # Validar coordenadas
-            if not validate_coordinates(lat, lng):
-                return build_error_response("Coordenadas fuera del rango válido para Chile")
-            
-            # Validar producto
+            return self._json_or_error(await self._aget("busqueda_estacion_filtro"))
+        except Exception as e:
+            return {"error": str(e)}
+    
+    def _get(self, path):
+        """GET al upstream compartido con las llamadas concurrentes al mismo endpoint (hilos o asyncio)"""
+        return self.upstream_calls.do(path, lambda: _UpstreamReply.from_response(self.client.get(path)))
+    
+    async def _aget(self, path):
+        async def pedir():
+            return _UpstreamReply.from_response(await self.client.aget(path))
+        return await self.upstream_calls.do_async(path, pedir)
+    
+    def reload_mappings(self):
+        """
+        Recarga los mapeos de marcas si cambió MAPPINGS_CONFIG y reconstruye el snapshot
+        vigente para que la info de tienda quede resuelta con los mapeos nuevos.
+        
+        Returns:
+            bool: True si se recargaron los mapeos
+        """
+        if not reload_mappings_if_changed(self.mappings_config):
+            return False
+        logger.info("Mapeos de marcas recargados desde %s", self.mappings_config)
+        if self.coordinator is None or self.coordinator.is_refresher:
+            self.cache.rebuild()
+        return True
+    
+    def fetch_snapshot(self):
+        """
+        Descarga condicional de estaciones para la caché (ETag/Last-Modified o hash del cuerpo).
+        El cuerpo se parsea en streaming conservando sólo los campos de búsqueda de cada estación.
+        """
+        self.reload_mappings()
+        try:
+            with self.client.stream("busqueda_estacion_filtro", headers=self._conditional_headers()) as response:
+                if response.status_code != 200:
+                    return self._fetch_status(response)
+                body = _StationBody()
+                for chunk in response.iter_bytes():
+                    body.feed(chunk)
+                return self._fetch_result(response, body)
+        except Exception as e:
+            return {"error": str(e)}
+    
+    async def fetch_snapshot_async(self):
+        await asyncio.to_thread(self.reload_mappings)
+        try:
+            async with self.client.astream("busqueda_estacion_filtro",
+                                           headers=self._conditional_headers()) as response:
+                if response.status_code != 200:
+                    return self._fetch_status(response)
+                body = _StationBody()
+                async for chunk in response.aiter_bytes():
+                    body.feed(chunk)
+                return self._fetch_result(response, body)
+        except Exception as e:
+            return {"error": str(e)}
+    
+    def _conditional_headers(self):
+        snapshot = self.cache.snapshot
+        headers = {}
+        if snapshot is not None and snapshot.etag:
+            headers["If-None-Match"] = snapshot.etag
+        if snapshot is not None and snapshot.last_modified:
+            headers["If-Modified-Since"] = snapshot.last_modified
+        return headers
+    
+    @staticmethod
+    def _fetch_status(response):
+        if response.status_code == 304:
+            return FetchResult(not_modified=True, etag=response.headers.get("etag"),
+                               last_modified=response.headers.get("last-modified"))
+        return {"error": f"Status: {response.status_code}"}
+    
+    def _fetch_result(self, response, body):
+        etag = response.headers.get("etag")
+        last_modified = response.headers.get("last-modified")
+        stations = body.close()
+        
+        # Sin validadores del upstream: si el cuerpo es idéntico no se vuelve a indexar
+        body_hash = body.hexdigest()
+        snapshot = self.cache.snapshot
+        if snapshot is not None and snapshot.body_hash == body_hash:
+            return FetchResult(not_modified=True, etag=etag, last_modified=last_modified, body_hash=body_hash)
+        return FetchResult(etag=etag, last_modified=last_modified, body_hash=body_hash,
+                           stations=stations, raw=body.raw())
+    
+    def _invalidate_search_cache(self, snapshot):
+        """Descarta sólo las búsquedas memorizadas afectadas por el diff del snapshot nuevo"""
+        diff = snapshot.diff
+        if diff is None or snapshot.previous_version != self.search_cache.version:
+            self.search_cache.invalidate(snapshot.version)
+            return
+        self.search_cache.invalidate(
+            snapshot.version,
+            lambda clave: clave.product in diff.layout_products
+            or ((clave.cheapest or clave.alpha is not None) and clave.product in diff.price_products)
+        )
+    
+    def _persist_snapshot(self, snapshot):
+        """Guarda cada snapshot bueno en disco para arranques en frío y caídas del upstream"""
+        if not self.snapshot_dir or (self.coordinator is not None and not self.coordinator.is_refresher):
+            return
+        try:
+            save_snapshot(snapshot, self.snapshot_dir)
+        except Exception as e:
+            logger.warning("No se pudo guardar el snapshot en %s: %s", self.snapshot_dir, e)
+    
+    def snapshot_info(self):
+        """Versión, antigüedad y origen de los datos que se están sirviendo"""
+        snapshot = self.cache.snapshot
+        if snapshot is None:
+            return {"version": None, "actualizado": None, "edad_segundos": None, "origen": None}
+        return {
+            "version": snapshot.version,
+            "actualizado": datetime.fromtimestamp(snapshot.fetched_at).isoformat(),
+            "edad_segundos": round(snapshot.age(), 1),
+            "origen": snapshot.origin
+        }
+    
+    def update_metrics(self):
+        """Actualiza los gauges de snapshot y cachés justo antes de exponer las métricas"""
+        snapshot = self.cache.snapshot
+        SNAPSHOT_AGE_SECONDS.set(snapshot.age() if snapshot is not None else None)
+        SNAPSHOT_VERSION.set(snapshot.version if snapshot is not None else None)
+        SNAPSHOT_STATIONS.set(len(snapshot.store) if snapshot is not None else None)
+        stats = self.search_cache.stats()
+        CACHE_HIT_RATIO.set(stats["hit_ratio"], "busquedas")
+        CACHE_ENTRIES.set(stats["entradas"], "busquedas")
+        stats = self.cache.stats()
+        CACHE_HIT_RATIO.set(stats["hit_ratio"], "snapshot")
+        UPSTREAM_UP.set(1 if self.client.health.ok else 0)
+        UPSTREAM_CIRCUIT_OPEN.set(0 if self.client.breaker.state == CircuitBreaker.CLOSED else 1)
+        for path in ("busqueda_estacion_filtro", "combustible_ciudadano"):
+            UPSTREAM_READ_TIMEOUT_SECONDS.set(self.client.timeouts.read_timeout(path), path)
+    
+    @staticmethod
+    def _connection_status(response):
+        if response.status_code == 200:
+            return "Conexión ready"
+        return f"Respuesta: {response.status_code}"
+    
+    @staticmethod
+    def _json_or_error(response):
+        if response.status_code == 200:
+            return response.data
+        return {"error": f"Status: {response.status_code}"}
+    
+    def get_estaciones(self):
+        """Payload de estaciones servido desde el snapshot compartido"""
+        return self._snapshot_data(self.cache.get())
+    
+    async def get_estaciones_async(self):
+        # El payload completo se parsea desde el cuerpo raw en un hilo, fuera del event loop
+        return await asyncio.to_thread(self._snapshot_data, await self.cache.get_async())
+    
+    async def get_snapshot_async(self):
+        """Snapshot vigente de estaciones (None si nunca se pudo descargar)"""
+        return await self.cache.get_async()
+    
+    def _snapshot_data(self, snapshot):
+        if snapshot is None:
+            return self.snapshot_error()
+        return snapshot.data
+    
+    def get_aggregates(self, by: str, product: Optional[str] = None):
+        """
+        Precio mínimo, promedio y máximo por producto agrupado por región, comuna o compañía.
+        Se calcula al construir el snapshot y se serializa una vez por versión.
+        
+        Returns:
+            bytes JSON con la lista de grupos o dict con error
+        """
+        return self._aggregates(self.cache.get(), by, product)
+    
+    async def get_aggregates_async(self, by: str, product: Optional[str] = None):
+        snapshot = await self.cache.get_async()
+        if snapshot is not None and not snapshot.aggregates_ready:
+            # Snapshot restaurado de disco: el primer cálculo se hace fuera del event loop
+            return await asyncio.to_thread(self._aggregates, snapshot, by, product)
+        return self._aggregates(snapshot, by, product)
+    
+    def _aggregates(self, snapshot, by: str, product: Optional[str]):
+        if by not in GROUPINGS:
+            return build_error_response(f"Agrupación no válida. Use: {', '.join(GROUPINGS)}")
+        if product is not None:
             if not validate_product(product):
-                valid_products = get_valid_products()
-                return build_error_response(f"Producto no válido. Use: {', '.join(valid_products)}")
-            
-            # Obtener todas las estaciones
-            datos_estaciones = self.buscar_estaciones()
-            if 'error' in datos_estaciones:
-                return datos_estaciones
-            
-            estaciones = datos_estaciones.get('data', [])
-            id_producto = get_product_id(product)
-            
-            # Procesar cada estación
-            estaciones_validas = []
-            for estacion in estaciones:
-                estacion_procesada = process_station_data(estacion, lat, lng, product, id_producto)
-                if estacion_procesada:
-                    estaciones_validas.append(estacion_procesada)
-            
-            # Filtrar por tienda si se requiere
-            estaciones_filtradas = filter_stations_by_store(estaciones_validas, store)
+                return build_error_response(f"Producto no válido. Use: {', '.join(get_valid_products())}")
+            product = product.lower()
+        if snapshot is None:
+            return self.snapshot_error()
+        return snapshot.aggregates_json(by, product)
+    
+    def snapshot_error(self):
+        """Error a informar cuando no hay snapshot de estaciones"""
+        return {"error": self.cache.last_error or "Sin datos de estaciones"}
+    
+    def search_stations(self, lat: float, lng: float, product: str, nearest: bool = False, 
+                       store: bool = False, cheapest: bool = False, limit: Optional[int] = None,
+                       offset: int = 0, radius_km: Optional[float] = None, alpha: Optional[float] = None):
+        with SEARCH_STAGE_SECONDS.time("validate"):
+            error = self._validate_search(lat, lng, product, limit, offset, radius_km, alpha)
+        if error:
+            return error
+        try:
+            snapshot = self.cache.get()
+        except Exception as e:
+            return build_error_response(str(e))
+        return self._search_snapshot(snapshot, lat, lng, product, nearest, store, cheapest,
+                                     limit, offset, radius_km, alpha)
+    
+    async def search_stations_async(self, lat: float, lng: float, product: str, nearest: bool = False,
+                                    store: bool = False, cheapest: bool = False, limit: Optional[int] = None,
+                                    offset: int = 0, radius_km: Optional[float] = None, alpha: Optional[float] = None):
+        with SEARCH_STAGE_SECONDS.time("validate"):
+            error = self._validate_search(lat, lng, product, limit, offset, radius_km, alpha)
+        if error:
+            return error
+        try:
+            snapshot = await self.cache.get_async()
+        except Exception as e:
+            return build_error_response(str(e))
+        return self._search_snapshot(snapshot, lat, lng, product, nearest, store, cheapest,
+                                     limit, offset, radius_km, alpha)
+    
+    def search_stations_batch(self, queries):
+        """
+        Resuelve muchas búsquedas contra un mismo snapshot.
+        
+        Args:
+            queries: Lista de dicts con lat, lng, product, nearest, store, cheapest
             
-            # Aplicar lógica de búsqueda
-            resultado = apply_search_logic(estaciones_filtradas, product, nearest, cheapest)
+        Returns:
+            Lista de resultados (estación o dict de error) en el orden de entrada
+        """
+        try:
+            snapshot = self.cache.get()
+        except Exception as e:
+            return [build_error_response(str(e)) for _ in queries]
+        return self._search_batch(snapshot, queries)
+    
+    async def search_stations_batch_async(self, queries):
+        try:
+            snapshot = await self.cache.get_async()
+        except Exception as e:
+            return [build_error_response(str(e)) for _ in queries]
+        # Trabajo de CPU: fuera del event loop
+        return await asyncio.to_thread(self._search_batch, snapshot, queries)
+    
+    def _search_batch(self, snapshot, queries):
+        """
+        Resuelve un lote agrupando las consultas por celda geohash y criterios: cada grupo
+        comparte sus filas candidatas y las distancias de todos sus orígenes a ellas se
+        calculan en una sola matriz (`haversine_matrix`).
+        """
+        resultados = [None] * len(queries)
+        grupos = {}
+        for posicion, query in enumerate(queries):
+            limit, offset, radius_km = query.get("limit"), query.get("offset", 0), query.get("radius_km")
+            alpha = query.get("alpha")
+            nearest, store = query.get("nearest", False), query.get("store", False)
+            cheapest = query.get("cheapest", False)
+            with SEARCH_STAGE_SECONDS.time("validate"):
+                error = self._validate_search(query["lat"], query["lng"], query["product"], limit, offset,
+                                              radius_km, alpha)
+            if error:
+                resultados[posicion] = error
+                continue
+            if snapshot is None or not depends_on_origin(nearest, cheapest, radius_km, alpha):
+                resultados[posicion] = self._search_snapshot(snapshot, query["lat"], query["lng"], query["product"],
+                                                             nearest, store, cheapest, limit, offset, radius_km, alpha)
+                continue
+            clave = SearchCacheKey(encode_geohash(query["lat"], query["lng"], self.search_cache_precision),
+                                   query["product"].lower(), nearest, store, cheapest, offset + (limit or 1),
+                                   nearest_pool_size(limit), radius_km, alpha)
+            grupos.setdefault(clave, []).append(posicion)
+        
+        for clave, posiciones in grupos.items():
+            if len(posiciones) == 1 and self.search_cache.maxsize <= 0:
+                # Sin caché ni otras consultas en la celda la búsqueda directa es más barata
+                query = queries[posiciones[0]]
+                resultados[posiciones[0]] = self._search_snapshot(
+                    snapshot, query["lat"], query["lng"], query["product"], clave.nearest, clave.store,
+                    clave.cheapest, query.get("limit"), query.get("offset", 0), clave.radius_km, clave.alpha)
+                continue
+            try:
+                candidatas = self._search_candidates(snapshot, clave)
+                lats = [queries[posicion]["lat"] for posicion in posiciones]
+                lngs = [queries[posicion]["lng"] for posicion in posiciones]
+                with SEARCH_STAGE_SECONDS.time("rank"):
+                    distancias = haversine_matrix(lats, lngs, snapshot.store.lat[candidatas],
+                                                  snapshot.store.lng[candidatas])
+                for posicion, distancias_origen in zip(posiciones, distancias):
+                    query = queries[posicion]
+                    with SEARCH_STAGE_SECONDS.time("rank"):
+                        filas = rank_candidate_rows(snapshot.store, candidatas, query["lat"], query["lng"],
+                                                    clave.product, clave.nearest, clave.cheapest, clave.k,
+                                                    clave.radius_km, clave.alpha, distancias_origen, clave.pool)
+                    resultados[posicion] = self._search_response(snapshot, filas, query["lat"], query["lng"],
+                                                                 query["product"], query.get("limit"),
+                                                                 query.get("offset", 0), clave.alpha)
+            except Exception as e:
+                for posicion in posiciones:
+                    resultados[posicion] = build_error_response(str(e))
+        return resultados
+    
+    def _validate_search(self, lat: float, lng: float, product: str, limit: Optional[int] = None,
+                         offset: int = 0, radius_km: Optional[float] = None, alpha: Optional[float] = None):
+        # Validar coordenadas
+        if not validate_coordinates(lat, lng):
+            return build_error_response("Coordenadas fuera del rango válido para Chile")
+        
+        # Validar producto
+        if not validate_product(product):
+            valid_products = get_valid_products()
+            return build_error_response(f"Producto no válido. Use: {', '.join(valid_products)}")
+        
+        # Validar paginación y radio
+        if limit is not None and not 1 <= limit <= MAX_SEARCH_LIMIT:
+            return build_error_response(f"limit debe estar entre 1 y {MAX_SEARCH_LIMIT}")
+        if offset < 0:
+            return build_error_response("offset no puede ser negativo")
+        if radius_km is not None and radius_km <= 0:
+            return build_error_response("radius_km debe ser mayor que 0")
+        if alpha is not None and alpha < 0:
+            return build_error_response("alpha debe ser mayor o igual a 0")
+        return None
+    
+    def _search_snapshot(self, snapshot, lat: float, lng: float, product: str, nearest: bool,
+                         store: bool, cheapest: bool, limit: Optional[int] = None, offset: int = 0,
+                         radius_km: Optional[float] = None, alpha: Optional[float] = None):
+        try:
+            # Estaciones del snapshot compartido
+            if snapshot is None:
+                return build_error_response(self.cache.last_error or "Sin datos de estaciones")
             
-            if not resultado:
-                return build_error_response("No se encontraron estaciones que cumplan los criterios")
+            product_key = product.lower()
+            k = offset + (limit or 1)
+            # Las páginas de `nearest&cheapest` se cortan siempre del mismo grupo de cercanas
+            pool = nearest_pool_size(limit)
             
-            return resultado
+            if self.search_cache.maxsize > 0:
+                # Se memorizan por celda geohash candidatas válidas para todo origen de la celda;
+                # el orden y el radio se aplican con el origen exacto
+                geohash = encode_geohash(lat, lng, self.search_cache_precision)
+                candidatas = self._search_candidates(snapshot, SearchCacheKey(
+                    geohash, product_key, nearest, store, cheapest, k, pool, radius_km, alpha))
+                with SEARCH_STAGE_SECONDS.time("rank"):
+                    filas = rank_candidate_rows(snapshot.store, candidatas, lat, lng, product_key,
+                                                nearest, cheapest, k, radius_km, alpha, pool=pool)
+            else:
+                with SEARCH_STAGE_SECONDS.time("select"):
+                    filas = select_search_rows(snapshot.indexes[product_key], snapshot.store, lat, lng,
+                                               product_key, nearest, store, cheapest, k, radius_km,
+                                               snapshot.price_indexes[product_key], alpha,
+                                               self._cost_table(snapshot, product_key, store, cheapest,
+                                                                nearest, radius_km, alpha), pool)
+            return self._search_response(snapshot, filas, lat, lng, product, limit, offset, alpha)
             
         except Exception as e:
-            return build_error_response(str(e))
\ No newline at end of file
+            return build_error_response(str(e))
+    
+    @staticmethod
+    def _cost_table(snapshot, product_key: str, store: bool, cheapest: bool, nearest: bool,
+                    radius_km: Optional[float], alpha: Optional[float]):
+        # Costo combinado o "la más barata dentro del radio": tabla de precios por celda del snapshot
+        if alpha is not None or (cheapest and not nearest and radius_km is not None):
+            return snapshot.cost_table(product_key, store)
+        return None
+    
+    def _search_candidates(self, snapshot, clave):
+        """Filas candidatas de la celda geohash de `clave`, desde la caché de búsquedas o calculadas."""
+        candidatas = self.search_cache.get(clave, snapshot.version) if self.search_cache.maxsize > 0 else None
+        if candidatas is None:
+            with SEARCH_STAGE_SECONDS.time("select"):
+                candidatas = select_candidate_rows(
+                    snapshot.indexes[clave.product], snapshot.store, decode_geohash_bounds(clave.geohash),
+                    clave.product, clave.nearest, clave.store, clave.cheapest, clave.k, clave.radius_km,
+                    snapshot.price_indexes[clave.product], clave.alpha,
+                    self._cost_table(snapshot, clave.product, clave.store, clave.cheapest, clave.nearest,
+                                     clave.radius_km, clave.alpha), clave.pool)
+            self.search_cache.put(clave, candidatas, snapshot.version)
+        return candidatas
+    
+    def _search_response(self, snapshot, filas, lat: float, lng: float, product: str, limit: Optional[int],
+                         offset: int, alpha: Optional[float]):
+        with SEARCH_STAGE_SECONDS.time("build"):
+            resultado = build_station_results(snapshot.store, snapshot.station_table, filas[offset:],
+                                              lat, lng, product, alpha)
+        
+        # Con `limit` se responde una lista (posiblemente vacía); sin él, una sola estación
+        if limit is not None:
+            return resultado
+        
+        if not resultado:
+            return build_error_response("No se encontraron estaciones que cumplan los criterios")
+        
+        return resultado[0]
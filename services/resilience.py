@@ -0,0 +1,241 @@
+"""
+Políticas de resiliencia para las llamadas al upstream.
+Reintentos con backoff exponencial y jitter limitados por un presupuesto,
+circuit breaker que falla rápido mientras el upstream está caído, y timeouts
+de lectura que se ajustan al p99 observado.
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+import httpx
+
+# Respuestas que se consideran falla del upstream (se reintentan y abren el circuito)
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(Exception):
+    """El circuito hacia el upstream está abierto: se falla sin llamar."""
+
+
+class ResilienceConfig:
+    """Parámetros de timeouts, reintentos y circuit breaker."""
+
+    def __init__(self, connect_timeout: float = 3.0, read_timeout_min: float = 2.0,
+                 read_timeout_max: float = 30.0, write_timeout: float = 5.0, pool_timeout: float = 5.0,
+                 timeout_factor: float = 3.0, retries: int = 2, backoff_base: float = 0.2,
+                 backoff_max: float = 2.0, retry_budget_ratio: float = 0.2, retry_budget_min: int = 5,
+                 breaker_failures: int = 5, breaker_reset: float = 30.0):
+        """
+        Args:
+            connect_timeout: Timeout de conexión en segundos
+            read_timeout_min: Timeout de lectura mínimo (el adaptativo no baja de aquí)
+            read_timeout_max: Timeout de lectura máximo y el usado sin historial
+            write_timeout: Timeout de envío
+            pool_timeout: Espera máxima por una conexión libre del pool
+            timeout_factor: El timeout de lectura es `factor * p99` de las respuestas exitosas
+            retries: Reintentos máximos por llamada (0 = sin reintentos)
+            backoff_base: Espera base del backoff exponencial
+            backoff_max: Espera máxima entre intentos
+            retry_budget_ratio: Reintentos permitidos por cada solicitud original (en una ventana de 10 s)
+            retry_budget_min: Reintentos permitidos en la ventana aunque haya poco tráfico
+            breaker_failures: Fallas consecutivas que abren el circuito (0 = sin circuit breaker)
+            breaker_reset: Segundos que el circuito queda abierto antes de probar de nuevo
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout_min = read_timeout_min
+        self.read_timeout_max = read_timeout_max
+        self.write_timeout = write_timeout
+        self.pool_timeout = pool_timeout
+        self.timeout_factor = timeout_factor
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_budget_ratio = retry_budget_ratio
+        self.retry_budget_min = retry_budget_min
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+
+    @classmethod
+    def from_env(cls, read_timeout_max: float) -> "ResilienceConfig":
+        """
+        Configuración desde variables de entorno (UPSTREAM_*).
+
+        Args:
+            read_timeout_max: Timeout de lectura máximo (TIMEOUT_SECONDS)
+
+        Returns:
+            ResilienceConfig
+        """
+        return cls(
+            connect_timeout=float(os.getenv("UPSTREAM_CONNECT_TIMEOUT_SECONDS", "3")),
+            read_timeout_min=float(os.getenv("UPSTREAM_READ_TIMEOUT_MIN_SECONDS", "2")),
+            read_timeout_max=read_timeout_max,
+            retries=int(os.getenv("UPSTREAM_RETRIES", "2")),
+            retry_budget_ratio=float(os.getenv("UPSTREAM_RETRY_BUDGET", "0.2")),
+            breaker_failures=int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5")),
+            breaker_reset=float(os.getenv("UPSTREAM_BREAKER_RESET_SECONDS", "30")),
+        )
+
+    def backoff(self, intento: int) -> float:
+        """Espera antes del reintento `intento` (desde 1): backoff exponencial con jitter completo."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (intento - 1)))
+
+
+class RetryBudget:
+    """
+    Limita los reintentos a una fracción de las solicitudes recientes, para no
+    multiplicar la carga sobre un upstream que ya está degradado.
+    """
+
+    def __init__(self, ratio: float, minimum: int, window: float = 10.0):
+        """
+        Args:
+            ratio: Reintentos permitidos por solicitud original
+            minimum: Reintentos permitidos en la ventana aunque haya poco tráfico
+            window: Segundos de la ventana
+        """
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def record_request(self) -> None:
+        """Registra una solicitud original."""
+        with self._lock:
+            self._requests.append(time.monotonic())
+
+    def try_acquire(self) -> bool:
+        """Reserva un reintento si el presupuesto lo permite."""
+        ahora = time.monotonic()
+        with self._lock:
+            for eventos in (self._requests, self._retries):
+                while eventos and eventos[0] < ahora - self.window:
+                    eventos.popleft()
+            if len(self._retries) >= max(self.minimum, self.ratio * len(self._requests)):
+                return False
+            self._retries.append(ahora)
+            return True
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de tres estados:
+
+    - cerrado: las llamadas pasan; `failures` fallas consecutivas lo abren
+    - abierto: las llamadas fallan de inmediato durante `reset_timeout` segundos
+    - semiabierto: pasa una sola llamada de prueba; si resulta bien se cierra, si no se vuelve a abrir
+    """
+
+    CLOSED = "cerrado"
+    OPEN = "abierto"
+    HALF_OPEN = "semiabierto"
+
+    def __init__(self, failures: int, reset_timeout: float):
+        """
+        Args:
+            failures: Fallas consecutivas que abren el circuito (0 = nunca se abre)
+            reset_timeout: Segundos abierto antes de permitir una llamada de prueba
+        """
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_inflight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """Estado actual del circuito."""
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def retry_in(self) -> float:
+        """Segundos hasta que se permita una llamada de prueba (0 si ya se permite)."""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def before_call(self) -> bool:
+        """
+        Lanza CircuitOpenError si la llamada no debe hacerse.
+
+        Returns:
+            bool: True si la llamada es la de prueba del estado semiabierto
+        """
+        with self._lock:
+            estado = self.state
+            if estado == self.CLOSED:
+                return False
+            if estado == self.HALF_OPEN and not self._trial_inflight:
+                self._trial_inflight = True
+                return True
+        raise CircuitOpenError(f"Circuito abierto hacia el upstream (nuevo intento en {self.retry_in():.0f} s)")
+
+    def record_success(self) -> None:
+        """Una llamada terminó bien: cierra el circuito."""
+        with self._lock:
+            self.consecutive_failures = 0
+            self._opened_at = None
+            self._trial_inflight = False
+
+    def release_trial(self) -> None:
+        """La llamada de prueba terminó sin resultado (p. ej. se canceló): la siguiente llamada puede probar."""
+        with self._lock:
+            self._trial_inflight = False
+
+    def record_failure(self) -> None:
+        """Una llamada falló: abre el circuito al llegar al umbral o si falló la prueba."""
+        with self._lock:
+            self.consecutive_failures += 1
+            if self._trial_inflight or (self.failures > 0 and self.consecutive_failures >= self.failures):
+                self._opened_at = time.monotonic()
+            self._trial_inflight = False
+
+
+class AdaptiveTimeout:
+    """Timeout de lectura por endpoint a partir del p99 de las respuestas exitosas recientes."""
+
+    def __init__(self, config: ResilienceConfig, samples: int = 200, min_samples: int = 20):
+        """
+        Args:
+            config: Límites y factor del timeout
+            samples: Duraciones que se conservan por endpoint
+            min_samples: Duraciones necesarias antes de ajustar el timeout
+        """
+        self.config = config
+        self.min_samples = min_samples
+        self._samples = samples
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, path: str, duracion: float) -> None:
+        """Registra la duración de una respuesta exitosa."""
+        with self._lock:
+            latencias = self._latencies.get(path)
+            if latencias is None:
+                latencias = self._latencies[path] = deque(maxlen=self._samples)
+            latencias.append(duracion)
+
+    def read_timeout(self, path: str) -> float:
+        """Timeout de lectura vigente para el endpoint."""
+        with self._lock:
+            latencias = sorted(self._latencies.get(path, ()))
+        if len(latencias) < self.min_samples:
+            return self.config.read_timeout_max
+        p99 = latencias[min(len(latencias) - 1, int(0.99 * len(latencias)))]
+        return min(self.config.read_timeout_max, max(self.config.read_timeout_min, p99 * self.config.timeout_factor))
+
+    def timeout(self, path: str) -> httpx.Timeout:
+        """Timeouts por fase para una solicitud al endpoint."""
+        return httpx.Timeout(connect=self.config.connect_timeout, read=self.read_timeout(path),
+                             write=self.config.write_timeout, pool=self.config.pool_timeout)
@@ -0,0 +1,120 @@
+"""
+Snapshot compartido entre procesos worker.
+Con varios workers de uvicorn sólo uno (el que obtiene el lock del directorio
+de snapshots) descarga e indexa el listado; los demás mapean en memoria el
+snapshot que ese worker publica en disco, así todos leen los mismos buffers
+desde el page cache del sistema operativo.
+"""
+
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from services.snapshot_persistence import CURRENT_FILE, load_snapshot_dir, read_meta
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: cada worker refresca por su cuenta
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LOCK_FILE = "refresher.lock"
+
+
+class SnapshotCoordinator:
+    """
+    Elige un único worker refrescador por directorio de snapshots.
+
+    El lock es un `flock` exclusivo que se libera solo si el proceso muere, de
+    modo que otro worker puede tomar el relevo en su siguiente sondeo.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: Directorio base de snapshots compartido por los workers
+        """
+        self.directory = directory
+        self._lock_file = None
+        self._is_refresher = False
+
+    @property
+    def is_refresher(self) -> bool:
+        """True si este proceso tiene el lock de refrescador."""
+        return self._is_refresher
+
+    def acquire(self) -> bool:
+        """
+        Intenta convertirse en el refrescador sin bloquear.
+
+        Returns:
+            bool: True si este proceso es (o ya era) el refrescador
+        """
+        if self._is_refresher:
+            return True
+        if fcntl is None:
+            self._is_refresher = True
+            return True
+
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, LOCK_FILE), "a+b")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self._is_refresher = True
+        logger.info("Worker %s es el refrescador de %s", os.getpid(), self.directory)
+        return True
+
+    def release(self) -> None:
+        """Libera el lock de refrescador si se tenía."""
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self._is_refresher = False
+
+    def current(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Lee el puntero CURRENT y los metadatos del snapshot al que apunta.
+
+        Returns:
+            (ruta, meta) o None si aún no hay snapshot publicado
+        """
+        try:
+            with open(os.path.join(self.directory, CURRENT_FILE), "rb") as f:
+                ruta = os.path.join(self.directory, f.read().decode().strip())
+            return ruta, read_meta(ruta)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, current_snapshot=None):
+        """
+        Obtiene el snapshot publicado por el refrescador.
+
+        Si es el mismo que ya se está sirviendo sólo se actualizan sus metadatos
+        (fecha de revalidación y validadores), sin volver a mapear los arreglos.
+
+        Args:
+            current_snapshot: Snapshot que sirve hoy este worker
+
+        Returns:
+            StationSnapshot o dict con 'error' si no hay snapshot publicado
+        """
+        actual = self.current()
+        if actual is None:
+            return {"error": "Aún no hay un snapshot compartido"}
+        ruta, meta = actual
+
+        if current_snapshot is not None and current_snapshot.key == meta["key"]:
+            current_snapshot.fetched_at = meta["fetched_at"]
+            current_snapshot.etag = meta.get("etag")
+            current_snapshot.last_modified = meta.get("last_modified")
+            return current_snapshot
+        try:
+            return load_snapshot_dir(ruta, origin="compartido")
+        except (OSError, ValueError, KeyError) as e:
+            # El refrescador pudo reemplazar el snapshot mientras se leía; se reintenta en el próximo sondeo
+            return {"error": f"No se pudo cargar el snapshot compartido: {e}"}
@@ -0,0 +1,259 @@
+"""
+Persistencia en disco de snapshots de estaciones.
+Cada snapshot se guarda en un directorio propio con las columnas del store y
+los índices espaciales y de precios como arreglos .npy (mapeables en memoria), las estaciones raw como
+líneas JSON con sus offsets y el payload completo. Un archivo CURRENT apunta
+al último snapshot válido y se reemplaza de forma atómica.
+"""
+
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+import numpy as np
+
+from services.station_cache import StationSnapshot
+from utils.aggregates import GROUPINGS
+from utils.mappings import PRODUCT_MAPPING
+from utils.price_index import PriceIndex
+from utils.spatial_index import GridIndex
+from utils.station_store import StationStore
+
+FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+SNAPSHOTS_TO_KEEP = 2
+
+
+class LazyStationList(Sequence):
+    """Estaciones raw guardadas como líneas JSON; cada una se parsea sólo al accederla."""
+
+    def __init__(self, buffer, offsets: np.ndarray):
+        """
+        Args:
+            buffer: Bytes (o mmap) con una estación JSON por línea
+            offsets: Offsets de inicio de cada línea más el largo total
+        """
+        self._buffer = buffer
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, posicion):
+        if isinstance(posicion, slice):
+            return [self[i] for i in range(*posicion.indices(len(self)))]
+        if posicion < 0:
+            posicion += len(self)
+        inicio, fin = int(self._offsets[posicion]), int(self._offsets[posicion + 1])
+        return json.loads(self._buffer[inicio:fin])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for posicion in range(len(self)):
+            yield self[posicion]
+
+
+def save_snapshot(snapshot: StationSnapshot, directory: str) -> str:
+    """
+    Guarda un snapshot y lo marca como el vigente.
+
+    Si el snapshot ya estaba guardado (p. ej. tras una revalidación) sólo se
+    reescriben sus metadatos.
+
+    Args:
+        snapshot: Snapshot a guardar
+        directory: Directorio base de snapshots
+
+    Returns:
+        str: Ruta del directorio del snapshot
+    """
+    os.makedirs(directory, exist_ok=True)
+    nombre = f"snapshot-{snapshot.key}"
+    destino = os.path.join(directory, nombre)
+
+    if not os.path.isdir(destino):
+        temporal = tempfile.mkdtemp(prefix=".tmp-", dir=directory)
+        try:
+            _write_contents(snapshot, temporal)
+            _write_meta(snapshot, temporal)
+            os.rename(temporal, destino)
+        except BaseException:
+            shutil.rmtree(temporal, ignore_errors=True)
+            raise
+    else:
+        _write_meta(snapshot, destino)
+
+    _atomic_write(os.path.join(directory, CURRENT_FILE), nombre.encode())
+    _cleanup(directory, nombre)
+    return destino
+
+
+def load_snapshot(directory: str) -> Optional[StationSnapshot]:
+    """
+    Carga el último snapshot guardado mapeando sus arreglos desde disco.
+
+    Args:
+        directory: Directorio base de snapshots
+
+    Returns:
+        StationSnapshot restaurado o None si no hay uno válido
+    """
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), "rb") as f:
+            ruta = os.path.join(directory, f.read().decode().strip())
+        return load_snapshot_dir(ruta)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_meta(ruta: str) -> Dict[str, Any]:
+    """
+    Lee los metadatos de un snapshot guardado.
+
+    Args:
+        ruta: Directorio del snapshot
+
+    Returns:
+        Dict con versión, clave, fecha de descarga y validadores
+    """
+    with open(os.path.join(ruta, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Formato de snapshot no soportado: {meta.get('format')}")
+    return meta
+
+
+def load_snapshot_dir(ruta: str, origin: str = "disco") -> StationSnapshot:
+    """
+    Carga un snapshot desde su directorio.
+
+    Todos los archivos quedan mapeados al cargar, así el snapshot sigue siendo
+    legible aunque otro proceso elimine el directorio después.
+
+    Args:
+        ruta: Directorio del snapshot
+        origin: Procedencia que se informa en las respuestas
+
+    Returns:
+        StationSnapshot restaurado
+    """
+    meta = read_meta(ruta)
+
+    def cargar(nombre: str) -> np.ndarray:
+        return np.load(os.path.join(ruta, f"{nombre}.npy"), mmap_mode="r")
+
+    store = StationStore.from_arrays({nombre: cargar(f"store_{nombre}") for nombre in _store_names()})
+    indexes = {
+        product: GridIndex.from_arrays({nombre: cargar(f"index_{product}_{nombre}") for nombre in _index_names()})
+        for product in PRODUCT_MAPPING
+    }
+    price_indexes = {product: _load_price_index(ruta, product, store, cargar) for product in PRODUCT_MAPPING}
+    aggregate_groups = None
+    if os.path.exists(os.path.join(ruta, "aggregates_labels.json")):
+        with open(os.path.join(ruta, "aggregates_labels.json"), encoding="utf-8") as f:
+            labels = json.load(f)
+        aggregate_groups = {by: (labels[by], cargar(f"aggregates_{by}_codes")) for by in GROUPINGS}
+    stations = LazyStationList(_map_file(os.path.join(ruta, "stations.jsonl")), cargar("station_offsets"))
+    return StationSnapshot.restore(
+        version=meta["version"], fetched_at=meta["fetched_at"], store=store, indexes=indexes,
+        stations=stations, raw=_map_file(os.path.join(ruta, "payload.json")), key=meta["key"], etag=meta.get("etag"),
+        last_modified=meta.get("last_modified"), body_hash=meta.get("body_hash"), origin=origin,
+        price_indexes=price_indexes, aggregate_groups=aggregate_groups
+    )
+
+
+def _load_price_index(ruta: str, product: str, store: StationStore, cargar) -> Optional[PriceIndex]:
+    """
+    Mapea el índice de precios guardado. Si no está (producto con precios fuera de rango o
+    snapshot guardado por una versión anterior) se construye desde el store, con el mismo resultado.
+    """
+    if not os.path.exists(os.path.join(ruta, f"price_{product}_keys.npy")):
+        return PriceIndex.build(store, product)
+    return PriceIndex.from_arrays({nombre: cargar(f"price_{product}_{nombre}") for nombre in _price_names()})
+
+
+def _write_contents(snapshot: StationSnapshot, ruta: str) -> None:
+    for nombre, arreglo in snapshot.store.to_arrays().items():
+        np.save(os.path.join(ruta, f"store_{nombre}.npy"), arreglo)
+    for product, index in snapshot.indexes.items():
+        for nombre, arreglo in index.to_arrays().items():
+            np.save(os.path.join(ruta, f"index_{product}_{nombre}.npy"), arreglo)
+    for product, price_index in snapshot.price_indexes.items():
+        if price_index is None:
+            continue
+        for nombre, arreglo in price_index.to_arrays().items():
+            np.save(os.path.join(ruta, f"price_{product}_{nombre}.npy"), arreglo)
+    grupos = snapshot.aggregates.to_groups()
+    for by, (_, codes) in grupos.items():
+        np.save(os.path.join(ruta, f"aggregates_{by}_codes.npy"), codes)
+    with open(os.path.join(ruta, "aggregates_labels.json"), "w", encoding="utf-8") as f:
+        json.dump({by: labels for by, (labels, _) in grupos.items()}, f, ensure_ascii=False)
+
+    offsets = [0]
+    with open(os.path.join(ruta, "stations.jsonl"), "wb") as f:
+        for estacion in snapshot.stations:
+            linea = json.dumps(estacion, ensure_ascii=False).encode() + b"\n"
+            f.write(linea)
+            offsets.append(offsets[-1] + len(linea))
+    np.save(os.path.join(ruta, "station_offsets.npy"), np.array(offsets, dtype=np.int64))
+
+    if snapshot.raw is not None:
+        with open(os.path.join(ruta, "payload.json"), "wb") as f:
+            f.write(snapshot.raw)
+    else:
+        with open(os.path.join(ruta, "payload.json"), "w", encoding="utf-8") as f:
+            json.dump(snapshot.data, f, ensure_ascii=False)
+
+
+def _write_meta(snapshot: StationSnapshot, ruta: str) -> None:
+    meta = {
+        "format": FORMAT_VERSION,
+        "version": snapshot.version,
+        "key": snapshot.key,
+        "fetched_at": snapshot.fetched_at,
+        "etag": snapshot.etag,
+        "last_modified": snapshot.last_modified,
+        "body_hash": snapshot.body_hash
+    }
+    _atomic_write(os.path.join(ruta, "meta.json"), json.dumps(meta).encode())
+
+
+def _atomic_write(ruta: str, contenido: bytes) -> None:
+    temporal = f"{ruta}.tmp-{os.getpid()}"
+    with open(temporal, "wb") as f:
+        f.write(contenido)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+
+
+def _cleanup(directory: str, vigente: str) -> None:
+    """Elimina snapshots antiguos conservando los más recientes."""
+    snapshots = sorted(
+        (nombre for nombre in os.listdir(directory) if nombre.startswith("snapshot-") and nombre != vigente),
+        key=lambda nombre: os.path.getmtime(os.path.join(directory, nombre)),
+        reverse=True
+    )
+    for nombre in snapshots[SNAPSHOTS_TO_KEEP - 1:]:
+        shutil.rmtree(os.path.join(directory, nombre), ignore_errors=True)
+
+
+def _map_file(ruta: str):
+    with open(ruta, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _store_names():
+    return ["lat", "lng", "brand", "has_store", "source", "ids"] + [f"price_{product}" for product in PRODUCT_MAPPING]
+
+
+def _index_names():
+    return ["lats", "lngs", "ids", "order", "cell_rows", "cell_cols", "cell_bounds", "cell_deg"]
+
+
+def _price_names():
+    return ["keys", "store_keys"]
@@ -0,0 +1,499 @@
+"""
+Módulo de caché de estaciones.
+Mantiene en memoria un snapshot compartido del listado nacional de estaciones,
+con TTL, refresco periódico en segundo plano y coalescencia de fetches concurrentes.
+"""
+
+import asyncio
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Union
+
+from utils.aggregates import PriceAggregates
+from utils.json_response import dumps
+from utils.mappings import brand_tables
+from utils.metrics import INDEX_BUILD_SECONDS, SNAPSHOT_REFRESHES
+from utils.price_index import PriceIndex, build_price_indexes
+from utils.search_utils import build_cost_table, build_product_indexes
+from utils.spatial_index import GridIndex
+from utils.station import StationTable
+from utils.station_store import StationStore, StoreDiff, diff_stores
+
+
+class FetchResult:
+    """Resultado de una descarga condicional de busqueda_estacion_filtro."""
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None, not_modified: bool = False,
+                 etag: Optional[str] = None, last_modified: Optional[str] = None,
+                 body_hash: Optional[str] = None, stations: Optional[List[Dict[str, Any]]] = None,
+                 raw: Optional[bytes] = None):
+        """
+        Args:
+            data: Payload parseado (None si no cambió o si se parseó en streaming)
+            not_modified: True si el upstream respondió 304 o el cuerpo es idéntico al anterior
+            etag: Header ETag de la respuesta
+            last_modified: Header Last-Modified de la respuesta
+            body_hash: Hash del cuerpo raw
+            stations: Estaciones compactas parseadas en streaming
+            raw: Cuerpo raw, para servir el payload completo sin mantenerlo parseado
+        """
+        self.data = data
+        self.not_modified = not_modified
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body_hash = body_hash
+        self.stations = stations
+        self.raw = raw
+
+
+class StationSnapshot:
+    """Copia inmutable del payload de busqueda_estacion_filtro, su store columnar e índices."""
+
+    def __init__(self, data: Optional[Dict[str, Any]], version: int, fetched_at: Optional[float] = None,
+                 previous: Optional["StationSnapshot"] = None, etag: Optional[str] = None,
+                 last_modified: Optional[str] = None, body_hash: Optional[str] = None,
+                 stations: Optional[Sequence[Dict[str, Any]]] = None, raw: Optional[bytes] = None):
+        """
+        Args:
+            data: Payload parseado (None si se entrega `stations` + `raw`)
+            version: Versión del snapshot
+            fetched_at: Momento de la descarga (por defecto ahora)
+            previous: Snapshot anterior, para reutilizar sus índices
+            etag: ETag del upstream
+            last_modified: Last-Modified del upstream
+            body_hash: Hash del cuerpo raw
+            stations: Estaciones ya extraídas del payload (p. ej. compactas)
+            raw: Cuerpo JSON raw; `data` se parsea desde aquí al primer acceso
+        """
+        self._data = data
+        self._data_lock = threading.Lock()
+        self._stations = stations if stations is not None else data.get('data', [])
+        self._payload_json: Optional[bytes] = None
+        self.raw = raw
+        self.version = version
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body_hash = body_hash
+        # Los mapeos de marcas cambian columnas derivadas (tienda), así que son parte de la clave
+        self.key = f"{body_hash}-{brand_tables().fingerprint}" if body_hash else uuid.uuid4().hex
+        self.origin = "upstream"
+        with INDEX_BUILD_SECONDS.time("store"):
+            self.store = StationStore(self._stations)
+        self.station_table = StationTable(self.store, self._stations)
+        self._cost_tables: Dict[Any, Any] = {}
+
+        # Con un snapshot previo sólo se reconstruyen los índices de productos afectados
+        self.previous_version = previous.version if previous is not None else None
+        with INDEX_BUILD_SECONDS.time("spatial"):
+            self.diff: Optional[StoreDiff] = diff_stores(previous.store, self.store) if previous is not None else None
+            self.indexes: Dict[str, GridIndex] = build_product_indexes(
+                self.store, previous.indexes if previous is not None else None, self.diff)
+        # Los índices de precios se actualizan en lugar de reconstruirse cuando sólo cambian precios
+        with INDEX_BUILD_SECONDS.time("price"):
+            self.price_indexes: Dict[str, Optional[PriceIndex]] = build_price_indexes(
+                self.store, previous.price_indexes if previous is not None else None,
+                previous.store if previous is not None else None, self.diff)
+        with INDEX_BUILD_SECONDS.time("aggregates"):
+            self._aggregates: Optional[PriceAggregates] = PriceAggregates(
+                self.store, self._stations, previous._aggregates if previous is not None else None, self.diff)
+        self._aggregates_json: Dict[Any, bytes] = {}
+
+    @classmethod
+    def restore(cls, version: int, fetched_at: float, store: StationStore, indexes: Dict[str, GridIndex],
+                stations: Sequence[Dict[str, Any]], raw, key: str, etag: Optional[str] = None,
+                last_modified: Optional[str] = None, body_hash: Optional[str] = None, origin: str = "disco",
+                price_indexes: Optional[Dict[str, Optional[PriceIndex]]] = None,
+                aggregate_groups: Optional[Dict[str, Any]] = None) -> "StationSnapshot":
+        """
+        Reconstruye un snapshot ya procesado (p. ej. desde disco) sin volver a parsear ni indexar.
+
+        Args:
+            version: Versión del snapshot
+            fetched_at: Momento de la descarga original
+            store: Store columnar
+            indexes: Índices por producto
+            stations: Secuencia de estaciones raw (puede ser perezosa)
+            raw: Cuerpo JSON del payload completo (bytes o mmap), `data` lo parsea al primer acceso
+            key: Identificador estable del contenido
+            etag: ETag del upstream
+            last_modified: Last-Modified del upstream
+            body_hash: Hash del cuerpo raw
+            origin: Procedencia del snapshot
+            price_indexes: Índices de precios ya construidos (por defecto se construyen desde el store)
+            aggregate_groups: Resultado de `PriceAggregates.to_groups()`; sin él los agregados
+                leen región y comuna de las estaciones raw
+
+        Returns:
+            StationSnapshot
+        """
+        snapshot = cls.__new__(cls)
+        snapshot._data = None
+        snapshot._data_lock = threading.Lock()
+        snapshot._stations = stations
+        snapshot._payload_json = None
+        snapshot.raw = raw
+        snapshot.version = version
+        snapshot.fetched_at = fetched_at
+        snapshot.etag = etag
+        snapshot.last_modified = last_modified
+        snapshot.body_hash = body_hash
+        snapshot.key = key
+        snapshot.origin = origin
+        snapshot.store = store
+        snapshot.station_table = StationTable(store, stations)
+        snapshot._cost_tables = {}
+        snapshot.previous_version = None
+        snapshot.diff = None
+        snapshot.indexes = indexes
+        snapshot.price_indexes = price_indexes if price_indexes is not None else build_price_indexes(store)
+        # Los agregados se calculan al primer uso, desde los códigos guardados si los hay
+        snapshot._aggregate_groups = aggregate_groups
+        snapshot._aggregates = None
+        snapshot._aggregates_json = {}
+        return snapshot
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        """
+        Payload completo. Si sólo se tiene el cuerpo raw se parsea una vez, al primer acceso, y
+        queda en el snapshot hasta que éste se reemplaza. El primer acceso es lento: no hacerlo
+        desde el event loop.
+        """
+        if self._data is None:
+            with self._data_lock:
+                if self._data is None:
+                    self._data = json.loads(self.raw[:])
+        return self._data
+
+    def cost_table(self, product: str, store_required: bool):
+        """Precios por punto del índice y mínimos por celda para búsquedas por costo (se calculan una vez)."""
+        clave = (product, store_required)
+        tabla = self._cost_tables.get(clave)
+        if tabla is None:
+            tabla = self._cost_tables[clave] = build_cost_table(self.indexes[product], self.store,
+                                                                 product, store_required)
+        return tabla
+
+    @property
+    def aggregates(self) -> PriceAggregates:
+        """Estadísticas de precios por región, comuna y compañía."""
+        if self._aggregates is None:
+            with INDEX_BUILD_SECONDS.time("aggregates"):
+                self._aggregates = PriceAggregates(self.store, self._stations, groups=self._aggregate_groups)
+        return self._aggregates
+
+    @property
+    def aggregates_ready(self) -> bool:
+        """Si los agregados ya están calculados (un snapshot restaurado los calcula al primer uso)."""
+        return self._aggregates is not None
+
+    def aggregates_json(self, by: str, product: Optional[str] = None) -> bytes:
+        """Grupos de `aggregates.groups()` serializados una sola vez por snapshot."""
+        clave = (by, product)
+        body = self._aggregates_json.get(clave)
+        if body is None:
+            body = self._aggregates_json[clave] = dumps(self.aggregates.groups(by, product))
+        return body
+
+    def payload_json(self) -> Union[bytes, memoryview]:
+        """
+        Payload completo serializado. Si se tiene el cuerpo raw del upstream (bytes o mmap)
+        se entrega una vista sin copiarlo, compartida entre workers vía page cache; si no,
+        se serializa una sola vez por snapshot.
+        """
+        if self.raw is not None:
+            return memoryview(self.raw)
+        if self._payload_json is None:
+            self._payload_json = dumps(self.data)
+        return self._payload_json
+
+    @property
+    def stations(self) -> Sequence[Dict[str, Any]]:
+        """Estaciones raw del snapshot, indexables por posición."""
+        return self._stations
+
+    def age(self, now: Optional[float] = None) -> float:
+        """Segundos transcurridos desde que se descargó o revalidó el snapshot."""
+        return (now if now is not None else time.time()) - self.fetched_at
+
+    def revalidated(self, result: FetchResult) -> None:
+        """Marca el snapshot como vigente tras una respuesta sin cambios."""
+        self.fetched_at = time.time()
+        self.etag = result.etag or self.etag
+        self.last_modified = result.last_modified or self.last_modified
+
+
+class StationCache:
+    """
+    Caché de proceso para el snapshot de estaciones.
+
+    - Si el snapshot está fresco (edad < ttl) se sirve directamente.
+    - Si está vencido se sirve igual y se revalida en segundo plano.
+    - Si no hay snapshot, los llamadores concurrentes comparten un único fetch.
+    """
+
+    def __init__(self, fetch: Callable[[], Dict[str, Any]], ttl: float = 300.0,
+                 refresh_interval: float = 0.0, retry_interval: float = 10.0,
+                 fetch_async: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None):
+        """
+        Args:
+            fetch: Función que descarga el payload (retorna dict con 'error' si falla)
+            ttl: Segundos que un snapshot se considera fresco
+            refresh_interval: Cada cuántos segundos refrescar en segundo plano (0 = desactivado)
+            retry_interval: Segundos mínimos entre revalidaciones tras un intento fallido
+            fetch_async: Versión asíncrona de `fetch` para llamadores asyncio
+
+        `fetch` puede retornar el payload (dict), un FetchResult de una descarga condicional
+        o un StationSnapshot ya construido (p. ej. publicado por otro proceso).
+        """
+        self._fetch = fetch
+        self._fetch_async = fetch_async
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.last_error: Optional[str] = None
+        # Lecturas servidas con snapshot fresco, vencido (revalidando) o sin snapshot
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+        self._snapshot: Optional[StationSnapshot] = None
+        self._version = 0
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+        self._inflight: Optional[Future] = None
+        self._stop = threading.Event()
+        self._scheduler: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[StationSnapshot], None]] = []
+
+    def add_listener(self, listener: Callable[[StationSnapshot], None]) -> None:
+        """
+        Registra una función que se llama con cada snapshot nuevo (antes de publicarlo)
+        y con cada snapshot revalidado sin cambios.
+        """
+        self._listeners.append(listener)
+
+    def publish(self, snapshot: StationSnapshot) -> None:
+        """
+        Publica un snapshot obtenido por otra vía (p. ej. restaurado desde disco).
+        Las versiones siguientes continúan desde la suya.
+        """
+        with self._lock:
+            self._version = max(self._version, snapshot.version)
+            self._snapshot = snapshot
+
+    def set_source(self, fetch: Callable[[], Any],
+                   fetch_async: Optional[Callable[[], Awaitable[Any]]] = None,
+                   refresh_interval: Optional[float] = None) -> None:
+        """
+        Cambia de dónde se obtienen los snapshots (p. ej. al pasar de leer el
+        snapshot compartido a descargarlo del upstream).
+
+        Args:
+            fetch: Nueva función de descarga
+            fetch_async: Versión asíncrona de `fetch` (None = usar `fetch` en un hilo)
+            refresh_interval: Nuevo intervalo de refresco (None = mantener el actual)
+        """
+        self._fetch = fetch
+        self._fetch_async = fetch_async
+        if refresh_interval is not None:
+            self.refresh_interval = refresh_interval
+
+    @property
+    def snapshot(self) -> Optional[StationSnapshot]:
+        """Snapshot actual (puede estar vencido) o None si aún no hay datos."""
+        return self._snapshot
+
+    def get(self) -> Optional[StationSnapshot]:
+        """
+        Obtiene el snapshot aplicando stale-while-revalidate.
+
+        Returns:
+            StationSnapshot o None si nunca se pudo descargar (ver last_error)
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.misses += 1
+            return self.refresh()
+        self._serve(snapshot)
+        return snapshot
+
+    async def get_async(self) -> Optional[StationSnapshot]:
+        """Versión asíncrona de `get()`: no bloquea el event loop mientras se descarga."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.misses += 1
+            return await self.refresh_async()
+        self._serve(snapshot)
+        return snapshot
+
+    def _serve(self, snapshot: StationSnapshot) -> None:
+        if snapshot.age() >= self.ttl:
+            self.stale_hits += 1
+            self.refresh_in_background()
+        else:
+            self.hits += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de lecturas del snapshot (frescas, vencidas y sin snapshot)."""
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0
+        }
+
+    def refresh(self) -> Optional[StationSnapshot]:
+        """
+        Descarga un snapshot nuevo. Si ya hay un fetch en curso, espera su resultado.
+
+        Returns:
+            El snapshot vigente tras el refresco (el anterior si el fetch falló)
+        """
+        future, leader = self._join_inflight()
+        if leader:
+            return self._resolve(future, lambda: self._apply(self._safe_fetch()))
+        return future.result()
+
+    async def refresh_async(self) -> Optional[StationSnapshot]:
+        """
+        Versión asíncrona de `refresh()`. Comparte el fetch en curso con
+        llamadores síncronos y asíncronos por igual.
+        """
+        future, leader = self._join_inflight()
+        if not leader:
+            return await asyncio.wrap_future(future)
+        if self._fetch_async is None:
+            return await asyncio.to_thread(self._resolve, future,
+                                           lambda: self._apply(self._safe_fetch()))
+
+        try:
+            data = await self._fetch_async()
+        except asyncio.CancelledError:
+            # Liberar a quienes esperan este fetch antes de propagar la cancelación
+            self._resolve(future, lambda: self._snapshot)
+            raise
+        except Exception as e:
+            data = {"error": str(e)}
+        # Construir índices fuera del event loop
+        return await asyncio.to_thread(self._resolve, future, lambda: self._apply(data))
+
+    def _join_inflight(self):
+        with self._lock:
+            future = self._inflight
+            leader = future is None
+            if leader:
+                future = self._inflight = Future()
+                self._last_attempt = time.time()
+        return future, leader
+
+    def _resolve(self, future: Future, load: Callable[[], Optional[StationSnapshot]]):
+        try:
+            future.set_result(load())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight = None
+        return future.result()
+
+    def rebuild(self) -> Optional[StationSnapshot]:
+        """
+        Reconstruye el snapshot vigente desde sus mismas estaciones, sin descargar
+        (p. ej. tras recargar los mapeos de marcas). Publica una versión nueva.
+
+        Returns:
+            El snapshot reconstruido o None si no hay snapshot
+        """
+        with self._lock:
+            actual = self._snapshot
+            if actual is None:
+                return None
+            self._version += 1
+            version = self._version
+        snapshot = StationSnapshot(None, version, fetched_at=actual.fetched_at, previous=actual,
+                                   etag=actual.etag, last_modified=actual.last_modified,
+                                   body_hash=actual.body_hash, stations=actual.stations, raw=actual.raw)
+        self._notify(snapshot)
+        self.publish(snapshot)
+        return snapshot
+
+    def refresh_in_background(self) -> None:
+        """Lanza una revalidación en un hilo aparte salvo que ya haya una en curso."""
+        with self._lock:
+            if self._inflight is not None:
+                return
+            if time.time() - self._last_attempt < self.retry_interval:
+                return
+        threading.Thread(target=self.refresh, name="station-cache-refresh", daemon=True).start()
+
+    def start(self) -> None:
+        """Inicia el refresco periódico en segundo plano (idempotente)."""
+        if self.refresh_interval <= 0 or self._scheduler is not None:
+            return
+        with self._lock:
+            if self._scheduler is not None:
+                return
+            self._stop.clear()
+            self._scheduler = threading.Thread(target=self._run_scheduler,
+                                               name="station-cache-scheduler", daemon=True)
+            self._scheduler.start()
+
+    def stop(self) -> None:
+        """Detiene el refresco periódico."""
+        self._stop.set()
+        scheduler = self._scheduler
+        if scheduler is not None:
+            scheduler.join(timeout=5)
+        self._scheduler = None
+
+    def _run_scheduler(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
+
+    def _safe_fetch(self) -> Dict[str, Any]:
+        try:
+            return self._fetch()
+        except Exception as e:
+            return {"error": str(e)}
+
+    def _apply(self, data: Any) -> Optional[StationSnapshot]:
+        if isinstance(data, StationSnapshot):
+            if data is not self._snapshot:
+                self._notify(data)
+                self.publish(data)
+            self.last_error = None
+            return data
+
+        result = data if isinstance(data, FetchResult) else FetchResult(data)
+        if result.not_modified and self._snapshot is not None:
+            self._snapshot.revalidated(result)
+            self._notify(self._snapshot)
+            self.last_error = None
+            SNAPSHOT_REFRESHES.inc("not_modified")
+            return self._snapshot
+
+        if result.stations is None and (not isinstance(result.data, dict) or 'error' in result.data):
+            data = result.data
+            self.last_error = data.get('error') if isinstance(data, dict) else "Respuesta inválida"
+            SNAPSHOT_REFRESHES.inc("error")
+            return self._snapshot
+
+        self._version += 1
+        snapshot = StationSnapshot(result.data, self._version, previous=self._snapshot,
+                                   etag=result.etag, last_modified=result.last_modified,
+                                   body_hash=result.body_hash, stations=result.stations, raw=result.raw)
+        self._notify(snapshot)
+        self._snapshot = snapshot
+        self.last_error = None
+        SNAPSHOT_REFRESHES.inc("updated")
+        return snapshot
+
+    def _notify(self, snapshot: StationSnapshot) -> None:
+        for listener in self._listeners:
+            listener(snapshot)
@@ -0,0 +1,266 @@
+"""
+Cliente HTTP hacia la API de Bencina en Línea.
+Reutiliza conexiones (keep-alive y HTTP/2) en lugar de abrir un cliente por llamada,
+y aplica timeouts por fase, reintentos y circuit breaker (ver services/resilience.py).
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from services.resilience import (RETRYABLE_STATUS, AdaptiveTimeout, CircuitBreaker, CircuitOpenError,
+                                 ResilienceConfig, RetryBudget)
+from services.upstream_health import UpstreamHealth
+from utils.metrics import UPSTREAM_REJECTED, UPSTREAM_REQUEST_SECONDS, UPSTREAM_RETRIES
+
+POOL_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60)
+
+
+class UpstreamClient:
+    """
+    Par de clientes httpx de larga vida: uno síncrono para los hilos de refresco
+    y uno asíncrono para los endpoints `async def`. El resultado de cada solicitud
+    queda en `health`.
+
+    Los errores de conexión, timeouts y respuestas 429/5xx se reintentan con backoff
+    mientras el presupuesto de reintentos y el circuit breaker lo permitan. Con el
+    circuito abierto las llamadas lanzan CircuitOpenError sin tocar la red. En las
+    descargas en streaming sólo se reintenta hasta recibir los encabezados.
+    """
+
+    def __init__(self, base_url: str, timeout: float, transport: Optional[httpx.BaseTransport] = None,
+                 async_transport: Optional[httpx.AsyncBaseTransport] = None,
+                 config: Optional[ResilienceConfig] = None):
+        """
+        Args:
+            base_url: URL base de la API
+            timeout: Timeout de lectura máximo en segundos
+            transport: Transporte httpx alternativo para el cliente síncrono (p. ej. en tests)
+            async_transport: Transporte httpx alternativo para el cliente asíncrono
+            config: Política de timeouts, reintentos y circuit breaker (por defecto
+                sin reintentos ni circuit breaker)
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.transport = transport
+        self.async_transport = async_transport
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+        self.health = UpstreamHealth()
+        self.config = config or ResilienceConfig(read_timeout_max=timeout, retries=0, breaker_failures=0)
+        self.timeouts = AdaptiveTimeout(self.config)
+        self.breaker = CircuitBreaker(self.config.breaker_failures, self.config.breaker_reset)
+        self.retry_budget = RetryBudget(self.config.retry_budget_ratio, self.config.retry_budget_min)
+
+    @property
+    def client(self) -> httpx.Client:
+        """Cliente síncrono compartido (se crea en el primer uso)."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(timeout=self.timeout, limits=POOL_LIMITS, http2=True,
+                                                transport=self.transport)
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """Cliente asíncrono compartido (normalmente creado por `open()` al iniciar la app)."""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(timeout=self.timeout, limits=POOL_LIMITS, http2=True,
+                                                   transport=self.async_transport)
+        return self._async_client
+
+    def open(self) -> None:
+        """Crea el cliente asíncrono dentro del event loop de la aplicación."""
+        self.async_client
+
+    def get(self, path: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """GET síncrono a `{base_url}/{path}`."""
+        url = f"{self.base_url}/{path}"
+        response, inicio, _ = self._send(path, lambda timeout: self.client.get(url, headers=headers, timeout=timeout))
+        self._observe_final(path, inicio, response)
+        return response
+
+    async def aget(self, path: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """GET asíncrono a `{base_url}/{path}`."""
+        url = f"{self.base_url}/{path}"
+        response, inicio, _ = await self._asend(
+            path, lambda timeout: self.async_client.get(url, headers=headers, timeout=timeout))
+        self._observe_final(path, inicio, response)
+        return response
+
+    @contextmanager
+    def stream(self, path: str, headers: Optional[Dict[str, str]] = None):
+        """GET síncrono en streaming; usar como `with client.stream(...) as response`."""
+        def enviar(timeout):
+            request = self.client.build_request("GET", f"{self.base_url}/{path}", headers=headers, timeout=timeout)
+            return self.client.send(request, stream=True)
+
+        response, inicio, prueba = self._send(path, enviar)
+        try:
+            yield response
+        except Exception as e:
+            self._observe_stream_error(path, inicio, response, e)
+            raise
+        except BaseException:
+            self._release_trial(prueba)
+            raise
+        finally:
+            response.close()
+        self._observe_final(path, inicio, response)
+
+    @asynccontextmanager
+    async def astream(self, path: str, headers: Optional[Dict[str, str]] = None):
+        """GET asíncrono en streaming; usar como `async with client.astream(...) as response`."""
+        def enviar(timeout):
+            request = self.async_client.build_request("GET", f"{self.base_url}/{path}", headers=headers,
+                                                      timeout=timeout)
+            return self.async_client.send(request, stream=True)
+
+        response, inicio, prueba = await self._asend(path, enviar)
+        try:
+            yield response
+        except Exception as e:
+            self._observe_stream_error(path, inicio, response, e)
+            raise
+        except BaseException:
+            self._release_trial(prueba)
+            raise
+        finally:
+            await response.aclose()
+        self._observe_final(path, inicio, response)
+
+    def _send(self, path: str,
+              enviar: Callable[[httpx.Timeout], httpx.Response]) -> Tuple[httpx.Response, float, bool]:
+        """
+        Envía una solicitud con reintentos.
+
+        Los intentos fallidos quedan registrados aquí; la respuesta final, si no es
+        una falla reintentable, la registra el llamador con `_observe_final()`. Si el
+        envío se interrumpe sin resultado (cancelación, KeyboardInterrupt) se libera
+        la llamada de prueba del circuit breaker.
+
+        Returns:
+            Tupla (respuesta, inicio del último intento, si es la llamada de prueba del circuito)
+        """
+        prueba = self._before_call(path)
+        intento = 0
+        while True:
+            inicio = time.perf_counter()
+            try:
+                response = enviar(self.timeouts.timeout(path))
+            except Exception as e:
+                self._observe(path, inicio, None, e)
+                if not (isinstance(e, httpx.TransportError) and self._may_retry(intento)):
+                    raise
+            except BaseException:
+                self._release_trial(prueba)
+                raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS:
+                    return response, inicio, prueba
+                self._observe(path, inicio, response.status_code)
+                if not self._may_retry(intento):
+                    return response, inicio, prueba
+                response.close()
+            intento += 1
+            UPSTREAM_RETRIES.inc(path)
+            time.sleep(self.config.backoff(intento))
+
+    async def _asend(self, path: str,
+                     enviar: Callable[[httpx.Timeout], Awaitable[httpx.Response]]) -> Tuple[httpx.Response, float, bool]:
+        """Versión asíncrona de `_send()`."""
+        prueba = self._before_call(path)
+        intento = 0
+        while True:
+            inicio = time.perf_counter()
+            try:
+                response = await enviar(self.timeouts.timeout(path))
+            except Exception as e:
+                self._observe(path, inicio, None, e)
+                if not (isinstance(e, httpx.TransportError) and self._may_retry(intento)):
+                    raise
+            except BaseException:
+                self._release_trial(prueba)
+                raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS:
+                    return response, inicio, prueba
+                self._observe(path, inicio, response.status_code)
+                if not self._may_retry(intento):
+                    return response, inicio, prueba
+                await response.aclose()
+            intento += 1
+            UPSTREAM_RETRIES.inc(path)
+            await asyncio.sleep(self.config.backoff(intento))
+
+    def _before_call(self, path: str) -> bool:
+        """
+        Consulta el circuit breaker y cuenta la solicitud en el presupuesto de reintentos.
+
+        Returns:
+            bool: True si es la llamada de prueba del circuito semiabierto
+        """
+        try:
+            prueba = self.breaker.before_call()
+        except CircuitOpenError:
+            UPSTREAM_REJECTED.inc(path)
+            raise
+        self.retry_budget.record_request()
+        return prueba
+
+    def _release_trial(self, prueba: bool) -> None:
+        """Libera la llamada de prueba del circuito si la interrumpida era esa."""
+        if prueba:
+            self.breaker.release_trial()
+
+    def _may_retry(self, intento: int) -> bool:
+        """Si corresponde otro intento tras la falla del intento `intento` (desde 0)."""
+        return (intento < self.config.retries and self.breaker.state == CircuitBreaker.CLOSED
+                and self.retry_budget.try_acquire())
+
+    def _observe_final(self, path: str, inicio: float, response: httpx.Response) -> None:
+        """Registra la respuesta final salvo que `_send()` ya la haya registrado como falla."""
+        if response.status_code not in RETRYABLE_STATUS:
+            self._observe(path, inicio, response.status_code)
+
+    def _observe_stream_error(self, path: str, inicio: float, response: httpx.Response, error: Exception) -> None:
+        """Registra un error al leer el cuerpo; un error del llamador al procesarlo no es una falla de conexión."""
+        if isinstance(error, httpx.HTTPError):
+            self._observe(path, inicio, None, error)
+        else:
+            self._observe_final(path, inicio, response)
+
+    async def aclose(self) -> None:
+        """Cierra ambos clientes y sus conexiones."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _observe(self, path: str, inicio: float, status_code: Optional[int],
+                 error: Optional[Exception] = None) -> None:
+        """
+        Registra duración y resultado de una solicitud en las métricas, en `health`, en
+        el circuit breaker y, si fue exitosa, en el timeout adaptativo.
+        """
+        duracion = time.perf_counter() - inicio
+        UPSTREAM_REQUEST_SECONDS.observe(duracion, path, str(status_code) if status_code else "error")
+        if status_code is None:
+            self.health.record(False, f"Error de conexión: {error}", duracion)
+        elif status_code in (200, 304):
+            self.health.record(True, "Conexión ready", duracion)
+            self.timeouts.observe(path, duracion)
+        else:
+            self.health.record(False, f"Respuesta: {status_code}", duracion)
+        if status_code is None or status_code in RETRYABLE_STATUS:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
@@ -0,0 +1,69 @@
+"""
+Estado de salud del upstream en memoria.
+Se actualiza con el resultado de cada solicitud real al upstream (refrescos,
+combustibles) y con un sondeo periódico cuando no hubo tráfico reciente, así
+`/health` responde sin llamar a la API externa.
+"""
+
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class UpstreamHealth:
+    """Último resultado observado de las solicitudes al upstream."""
+
+    def __init__(self):
+        self.last_success: Optional[float] = None
+        self.last_failure: Optional[float] = None
+        self.last_status: Optional[str] = None
+        self.last_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self._lock = threading.Lock()
+
+    def record(self, ok: bool, status: str, latency: float) -> None:
+        """
+        Registra el resultado de una solicitud.
+
+        Args:
+            ok: True si el upstream respondió correctamente (200 o 304)
+            status: Texto de estado ("Conexión ready", "Respuesta: 503", "Error de conexión: ...")
+            latency: Duración de la solicitud en segundos
+        """
+        ahora = time.time()
+        with self._lock:
+            self.last_status = status
+            self.last_latency = latency
+            if ok:
+                self.last_success = ahora
+                self.consecutive_failures = 0
+            else:
+                self.last_failure = ahora
+                self.consecutive_failures += 1
+
+    @property
+    def last_activity(self) -> Optional[float]:
+        """Momento de la última solicitud observada (None si no hubo ninguna)."""
+        instantes = [t for t in (self.last_success, self.last_failure) if t is not None]
+        return max(instantes) if instantes else None
+
+    @property
+    def ok(self) -> bool:
+        """True si la última solicitud observada fue exitosa."""
+        return self.last_success is not None and self.consecutive_failures == 0
+
+    def status_text(self) -> str:
+        """Estado en el formato histórico de `test_connection`."""
+        return self.last_status or "Sin datos del upstream"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Resumen para `/health`."""
+        ahora = time.time()
+        return {
+            "estado": self.status_text(),
+            "ok": self.ok,
+            "fallos_consecutivos": self.consecutive_failures,
+            "ultimo_exito_hace_segundos": round(ahora - self.last_success, 1) if self.last_success else None,
+            "ultimo_fallo_hace_segundos": round(ahora - self.last_failure, 1) if self.last_failure else None,
+            "latencia_ms": round(self.last_latency * 1000, 1) if self.last_latency is not None else None
+        }
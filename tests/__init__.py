@@ -1 +1,5 @@
 # Tests para la API de combustibles
+import os
+
+# Los tests no persisten snapshots en disco salvo que lo configuren explícitamente
+os.environ.setdefault("SNAPSHOT_DIR", "")
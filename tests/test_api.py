@@ -1,13 +1,21 @@
+import json
+import mmap
 import pytest
 from fastapi.testclient import TestClient
 from main import app
+from services.snapshot_persistence import load_snapshot, save_snapshot
+from services.station_cache import StationCache, StationSnapshot
 
-client = TestClient(app)
+@pytest.fixture(scope="module")
+def client():
+    """Cliente de pruebas con el ciclo de vida de la app (startup/shutdown)"""
+    with TestClient(app) as test_client:
+        yield test_client
 
 class TestsAPI:
     """Tests para los endpoints principales de la API"""
 
-    def test_endpoint_inicio(self):
+    def test_endpoint_inicio(self, client):
         """Test del endpoint raíz"""
         response = client.get("/")
         assert response.status_code == 200
@@ -16,7 +24,7 @@ class TestsAPI:
         assert "autor" in data
         assert data["autor"] == "Ignacio Torres González"
     
-    def test_endpoint_salud(self):
+    def test_endpoint_salud(self, client):
         """Test del endpoint de monitoreo de salud"""
         response = client.get("/health")
         assert response.status_code == 200
@@ -26,19 +34,19 @@ class TestsAPI:
         assert "version" in data
         assert data["version"] == "1.0.0"
     
-    def test_endpoint_test(self):
+    def test_endpoint_test(self, client):
         """Test del endpoint de prueba"""
         response = client.get("/test")
         assert response.status_code == 200
         data = response.json()
         assert data["status"] == "OK"
     
-    def test_buscar_sin_params(self):
+    def test_buscar_sin_params(self, client):
         """Test del endpoint de búsqueda sin parámetros requeridos"""
         response = client.get("/api/stations/search")
         assert response.status_code == 422  # Error de validación
     
-    def test_buscar_producto_malo(self):
+    def test_buscar_producto_malo(self, client):
         """Test del endpoint de búsqueda con producto inválido"""
         response = client.get("/api/stations/search?lat=-23.65&lng=-70.40&product=invalid")
         assert response.status_code == 200
@@ -46,7 +54,7 @@ class TestsAPI:
         assert data["success"] == False
         assert "error" in data
     
-    def test_buscar_ok(self):
+    def test_buscar_ok(self, client):
         """Test del endpoint de búsqueda con parámetros válidos"""
         response = client.get("/api/stations/search?lat=-23.65&lng=-70.40&product=93&nearest=true")
         assert response.status_code == 200
@@ -61,3 +69,137 @@ class TestsAPI:
             assert "distancia(lineal)" in estacion
         else:
             assert "error" in data
+
+    def test_servicio_compartido(self, client):
+        """Test que los endpoints usan el servicio único creado en el startup"""
+        servicio = app.state.fuel_service
+        cache_original = servicio.cache
+        estacion = {
+            "id": 7, "marca": 5, "comuna": "Santiago", "latitud": "-33.45", "longitud": "-70.65",
+            "combustibles": [{"id": 1, "precio": "1300"}]
+        }
+        servicio.cache = StationCache(lambda: {"data": [estacion]}, ttl=60)
+        try:
+            response = client.get("/api/stations/search?lat=-33.45&lng=-70.65&product=93&nearest=true")
+            data = response.json()
+            assert data["success"] == True
+            assert data["data"]["id"] == "7"
+            assert client.get("/estaciones").json()["total_estaciones"] == 1
+        finally:
+            servicio.cache = cache_original
+
+    def test_estaciones_preserializadas(self, client):
+        """Test que /estaciones entrega el payload completo y lo serializa una vez por snapshot"""
+        servicio = app.state.fuel_service
+        cache_original = servicio.cache
+        payload = {"data": [{"id": 7, "comuna": "Ñuñoa", "latitud": "-33.45", "longitud": "-70.65",
+                             "servicios": [{"nombre": "Baño"}]}]}
+        servicio.cache = StationCache(lambda: payload, ttl=60)
+        try:
+            data = client.get("/estaciones").json()
+            assert data["muestra"] == payload
+            assert data["snapshot"]["version"] == 1
+            cuerpo = servicio.cache.snapshot.payload_json()
+            client.get("/estaciones")
+            assert servicio.cache.snapshot.payload_json() is cuerpo
+        finally:
+            servicio.cache = cache_original
+
+    def test_estaciones_desde_snapshot_mapeado(self, client, tmp_path):
+        """Test que /estaciones envía el payload desde el mmap del snapshot restaurado, sin copiarlo"""
+        servicio = app.state.fuel_service
+        cache_original = servicio.cache
+        payload = {"data": [{"id": 7, "comuna": "Ñuñoa", "latitud": "-33.45", "longitud": "-70.65"}]}
+        raw = json.dumps(payload, ensure_ascii=False).encode()
+        save_snapshot(StationSnapshot(None, version=3, stations=payload["data"], raw=raw, body_hash="h"),
+                      str(tmp_path))
+        restaurado = load_snapshot(str(tmp_path))
+        assert isinstance(restaurado.payload_json().obj, mmap.mmap)
+        servicio.cache = StationCache(lambda: {"error": "sin upstream"}, ttl=60)
+        servicio.cache.publish(restaurado)
+        try:
+            response = client.get("/estaciones")
+            assert response.json()["muestra"] == payload
+            assert int(response.headers["content-length"]) == len(response.content)
+        finally:
+            servicio.cache = cache_original
+
+    def test_agregados(self, client):
+        """Test del endpoint de estadísticas de precios por región"""
+        servicio = app.state.fuel_service
+        cache_original = servicio.cache
+        estaciones = [
+            {"id": 1, "marca": 5, "region": "Metropolitana", "latitud": "-33.45", "longitud": "-70.65",
+             "combustibles": [{"id": 1, "precio": "1300"}]},
+            {"id": 2, "marca": 5, "region": "Metropolitana", "latitud": "-33.46", "longitud": "-70.66",
+             "combustibles": [{"id": 1, "precio": "1201"}]},
+        ]
+        servicio.cache = StationCache(lambda: {"data": estaciones}, ttl=60)
+        try:
+            data = client.get("/api/stations/aggregates?by=region&product=93").json()
+            assert data["success"] == True
+            assert data["agrupacion"] == "region"
+            assert data["data"] == [{"region": "Metropolitana", "estaciones": 2, "precios": {
+                "93": {"min": 1201, "promedio": 1250.5, "max": 1300, "estaciones": 2}}}]
+            assert data["snapshot"]["version"] == 1
+            assert client.get("/api/stations/aggregates?by=ciudad").json()["success"] == False
+        finally:
+            servicio.cache = cache_original
+
+    def test_busqueda_batch(self, client):
+        """Test de la búsqueda por lotes con errores por ítem"""
+        servicio = app.state.fuel_service
+        cache_original = servicio.cache
+        estaciones = [
+            {"id": 1, "marca": 10, "latitud": "-33.45", "longitud": "-70.65",
+             "combustibles": [{"id": 1, "precio": "1300"}]},
+            {"id": 2, "marca": 5, "latitud": "-20.21", "longitud": "-70.15",
+             "combustibles": [{"id": 1, "precio": "1250"}]},
+        ]
+        servicio.cache = StationCache(lambda: {"data": estaciones}, ttl=60)
+        try:
+            response = client.post("/api/stations/search/batch", json={"queries": [
+                {"lat": -20.2, "lng": -70.1, "product": "93", "nearest": True},
+                {"lat": -33.4, "lng": -70.6, "product": "invalido"},
+                {"lat": -33.4, "lng": -70.6, "product": "93", "nearest": True},
+                {"lat": -33.4, "lng": -70.6, "product": "93", "cheapest": True},
+            ]})
+            assert response.status_code == 200
+            data = response.json()
+            assert data["total"] == 4
+            assert [r["success"] for r in data["results"]] == [True, False, True, True]
+            assert [r["data"]["id"] for r in data["results"] if r["success"]] == ["2", "1", "2"]
+            assert "Producto no válido" in data["results"][1]["error"]
+        finally:
+            servicio.cache = cache_original
+
+    def test_busqueda_batch_sin_queries(self, client):
+        """Test de validación del cuerpo de la búsqueda por lotes"""
+        response = client.post("/api/stations/search/batch", json={})
+        assert response.status_code == 422
+
+    def test_metricas(self, client):
+        """Test del endpoint de métricas en formato Prometheus"""
+        client.get("/api/stations/search?lat=-23.65&lng=-70.40&product=invalid")
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        texto = response.text
+        assert '# TYPE fuel_search_stage_seconds histogram' in texto
+        assert 'fuel_search_stage_seconds_count{stage="validate"}' in texto
+        assert 'fuel_http_request_seconds_count{method="GET",route="/api/stations/search",status="200"}' in texto
+        assert 'fuel_cache_hit_ratio{cache="busquedas"}' in texto
+
+    def test_liveness_y_readiness(self, client):
+        """Test de los chequeos de liveness y readiness"""
+        assert client.get("/health/live").json() == {"status": "alive"}
+
+        servicio = app.state.fuel_service
+        cache_original = servicio.cache
+        servicio.cache = StationCache(lambda: {"error": "caído"}, ttl=60)
+        try:
+            response = client.get("/health/ready")
+            assert response.status_code == 503
+            assert response.json()["status"] == "not_ready"
+        finally:
+            servicio.cache = cache_original
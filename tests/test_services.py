@@ -1,8 +1,74 @@
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+import httpx
+import numpy as np
 import pytest
+from benchmarks.mock_upstream import MockUpstream
+from benchmarks.load_test import build_requests, parse_mix
+from benchmarks.run_benchmarks import compare
+from benchmarks.synthetic import generate_payload, generate_stations
 from services.fuel_service import FuelService
-from utils.distance import calculate_distance
-from utils.mappings import get_product_id, get_company_name, validate_product
-from utils.search_utils import validate_coordinates
+from services.resilience import CircuitBreaker, ResilienceConfig, RetryBudget
+from services.shared_snapshot import SnapshotCoordinator
+from services.snapshot_persistence import load_snapshot, save_snapshot
+from services.station_cache import StationCache, StationSnapshot
+from utils.aggregates import PriceAggregates
+from services.upstream_client import UpstreamClient
+from utils.distance import (
+    calculate_distance,
+    haversine_distances,
+    haversine_matrix,
+    equirectangular_distances,
+    nearest_indices
+)
+from utils.geohash import encode_geohash
+from utils.json_response import RawJSON, dumps, dumps_object
+from utils.json_stream import JsonArrayStream
+from utils.metrics import Counter, Histogram, MetricsRegistry, SEARCH_STAGE_SECONDS
+from utils import mappings
+from utils.mappings import (
+    brand_tables,
+    get_company_name,
+    get_product_id,
+    get_store_info,
+    has_convenience_store,
+    validate_product
+)
+from utils.price_index import PriceIndex
+from utils.result_cache import ResultCache
+from utils.single_flight import SingleFlight
+from utils.search_utils import build_cost_table, process_station_data, validate_coordinates
+from utils.station import StationResult, StationTable, build_station_results
+from utils.spatial_index import GridIndex
+from utils.station_store import StationStore, diff_stores
+
+
+def _estacion(id_estacion, lat, lng, marca=5, precios=None, comuna="Santiago"):
+    """Construye una estación con el formato de busqueda_estacion_filtro"""
+    precios = precios if precios is not None else {1: 1300}
+    return {
+        "id": id_estacion,
+        "marca": marca,
+        "direccion": f"Calle {id_estacion}",
+        "comuna": comuna,
+        "region": "Metropolitana de Santiago",
+        "latitud": str(lat),
+        "longitud": str(lng),
+        "combustibles": [{"id": producto, "precio": str(precio)} for producto, precio in precios.items()],
+    }
+
+
+def _servicio_con_estaciones(estaciones):
+    """FuelService con una caché local precargada con las estaciones dadas"""
+    servicio = FuelService()
+    servicio.cache = StationCache(lambda: {"data": estaciones}, ttl=60)
+    return servicio
+
 
 class TestServicios:
     """Tests para el servicio de combustibles"""
@@ -45,6 +111,81 @@ class TestMappings:
         assert validate_product("invalido") == False
         assert validate_product("") == False
         assert validate_product(None) == False
+    
+    def test_tablas_de_tienda(self):
+        """Test que las tablas compiladas resuelven las tiendas como las reglas originales"""
+        assert get_store_info(5, "COPEC", "Ñuñoa", "1") == {"codigo": "1", "nombre": "Pronto Ñuñoa", "tipo": "Pronto"}
+        assert get_store_info(151, "ARAMCO", "Maipú", "9")["tipo"] == "Select"
+        assert get_store_info(4, "COPEC EXPRESS", "Maipú", "9")["tipo"] == "Pronto"  # nombre no canónico
+        assert get_store_info(10, "Sin Bandera", "Maipú", "9") is None
+        assert has_convenience_store(88) and not has_convenience_store(999)
+        assert brand_tables().store_mask(np.array([5, 10, -1, 5000, 151])).tolist() == [True, False, False, False, True]
+    
+    def test_recarga_desde_archivo(self, tmp_path, monkeypatch):
+        """Test que un archivo de mapeos nuevo se aplica al snapshot vigente sin redesplegar"""
+        monkeypatch.setattr(mappings, "_tables", mappings._tables)
+        monkeypatch.setattr(mappings, "_config_mtime", None)
+        servicio = _servicio_con_estaciones([_estacion(1, -33.45, -70.65, marca=174, comuna="Maipú")])
+        servicio.mappings_config = str(tmp_path / "mappings.json")
+        anterior = servicio.cache.refresh()
+        assert servicio.search_stations(-33.45, -70.65, "93", store=True)["error"]
+        
+        (tmp_path / "mappings.json").write_text(json.dumps({
+            "companias": {"174": "MI MARCA"},
+            "marcas_con_tienda": [5, 4, 3, 88, 2, 151, 174],
+            "reglas_tienda": [{"marcas": [174], "tipo": "Mi Tienda", "nombre": "Mi Tienda"}]
+        }))
+        assert servicio.reload_mappings()
+        assert not servicio.reload_mappings()  # sin cambios en el archivo
+        
+        snapshot = servicio.cache.snapshot
+        assert snapshot.version == anterior.version + 1
+        assert snapshot.key != anterior.key
+        resultado = servicio.search_stations(-33.45, -70.65, "93", store=True)
+        assert resultado["compania"] == "MI MARCA"
+        assert resultado["tienda"] == {"codigo": "1", "nombre": "Mi Tienda Maipú", "tipo": "Mi Tienda"}
+
+    def test_archivo_invalido_no_corta_las_descargas(self, tmp_path, monkeypatch):
+        """Test que un archivo de mapeos inválido se ignora y no impide descargar ni iniciar el servicio"""
+        monkeypatch.setattr(mappings, "_tables", mappings._tables)
+        monkeypatch.setattr(mappings, "_config_mtime", None)
+        config = tmp_path / "mappings.json"
+        config.write_text(json.dumps({"companias": {"no-es-id": "MI MARCA"}}))
+        monkeypatch.setenv("MAPPINGS_CONFIG", str(config))
+        vigentes = brand_tables()
+        
+        servicio = FuelService()
+        assert brand_tables() is vigentes
+        assert mappings._config_mtime == os.stat(config).st_mtime_ns
+        
+        config.write_text("{no es json")
+        os.utime(config, ns=(0, 1))
+        cuerpo = {"data": [_estacion(1, -33.45, -70.65)]}
+        servicio.client = UpstreamClient("http://upstream.test/api", 5,
+                                         transport=httpx.MockTransport(lambda request: httpx.Response(200, json=cuerpo)))
+        resultado = servicio.fetch_snapshot()
+        assert [estacion["id"] for estacion in resultado.stations] == [1]
+        assert servicio.cache.refresh().store.ids.tolist() == ["1"]
+        assert brand_tables() is vigentes
+        assert not servicio.reload_mappings()  # no se reintenta hasta que el archivo cambie
+    
+    def test_ids_fuera_de_rango_se_ignoran(self, tmp_path, monkeypatch, caplog):
+        """Test que ids de marca enormes o negativos no agrandan las tablas y se registran"""
+        monkeypatch.setattr(mappings, "_tables", mappings._tables)
+        config = tmp_path / "mappings.json"
+        config.write_text(json.dumps({
+            "companias": {"174": "MI MARCA", "1000000000": "ENORME", "-1": "NEGATIVA"},
+            "marcas_con_tienda": [5, 174, 10**9, -1]
+        }))
+        with caplog.at_level("WARNING", logger=mappings.__name__):
+            tables = mappings.load_mappings(str(config))
+        
+        assert "fuera de rango" in caplog.text
+        assert len(tables.names) == 175 and len(tables.has_store) == 175
+        assert tables.brands_with_stores == {5, 174}
+        assert get_company_name(174) == "MI MARCA"
+        assert get_company_name(10**9) == f"Compañía {10**9}"
+        assert tables.store_mask(np.array([174, 10**9, -1])).tolist() == [True, False, False]
 
 class TestDistancias:
     """Tests para el cálculo de distancias"""
@@ -70,6 +211,30 @@ class TestDistancias:
         dist = calculate_distance(-23.65, -70.40, -20.21, -70.15)
         assert dist >= 0
 
+    def test_lote_coincide_con_escalar(self):
+        """Test que la versión vectorizada coincide con el cálculo punto a punto"""
+        lats = [-33.0458, -20.21, -53.16]
+        lngs = [-71.6197, -70.15, -70.91]
+        distancias = haversine_distances(-33.4489, -70.6693, lats, lngs)
+        for i in range(3):
+            assert distancias[i] == pytest.approx(calculate_distance(-33.4489, -70.6693, lats[i], lngs[i]))
+
+        matriz = haversine_matrix([-33.4489, -23.65], [-70.6693, -70.40], lats, lngs)
+        assert matriz.shape == (2, 3)
+        assert matriz[1] == pytest.approx(haversine_distances(-23.65, -70.40, lats, lngs))
+
+    def test_prefiltro_equirectangular(self):
+        """Test que la preselección equirectangular conserva los k más cercanos"""
+        rng = random.Random(3)
+        lats = [rng.uniform(-34, -33) for _ in range(300)]
+        lngs = [rng.uniform(-71, -70) for _ in range(300)]
+        exactas = haversine_distances(-33.5, -70.5, lats, lngs)
+        aproximadas = equirectangular_distances(-33.5, -70.5, lats, lngs)
+        assert aproximadas == pytest.approx(exactas, rel=1e-3)
+
+        esperado = nearest_indices(-33.5, -70.5, lats, lngs, 10)
+        assert nearest_indices(-33.5, -70.5, lats, lngs, 10, prefilter=True).tolist() == esperado.tolist()
+
 class TestBusquedas:
     """Tests para la lógica de búsqueda"""
     
@@ -91,3 +256,1189 @@ class TestBusquedas:
         # Coordenadas fuera de Chile
         assert validate_coordinates(40.7128, -74.0060) == False  # NY
         assert validate_coordinates(0, 0) == False  # Ecuador
+
+class TestCacheEstaciones:
+    """Tests para la caché de snapshot de estaciones"""
+
+    def test_snapshot_fresco_no_refetch(self):
+        """Test que un snapshot fresco se sirve sin volver a descargar"""
+        llamadas = []
+        cache = StationCache(lambda: llamadas.append(1) or {"data": [{"id": 1}]}, ttl=60)
+
+        primero = cache.get()
+        segundo = cache.get()
+        assert primero is segundo
+        assert len(llamadas) == 1
+        assert primero.stations == [{"id": 1}]
+
+    def test_fetches_concurrentes_coalescen(self):
+        """Test que llamadores concurrentes sin snapshot comparten un único fetch"""
+        llamadas = []
+        liberar = threading.Event()
+
+        def fetch_lento():
+            llamadas.append(1)
+            liberar.wait(2)
+            return {"data": []}
+
+        cache = StationCache(fetch_lento, ttl=60)
+        resultados = []
+        hilos = [threading.Thread(target=lambda: resultados.append(cache.get())) for _ in range(8)]
+        for hilo in hilos:
+            hilo.start()
+        time.sleep(0.1)
+        liberar.set()
+        for hilo in hilos:
+            hilo.join()
+
+        assert len(llamadas) == 1
+        assert len(resultados) == 8
+        assert all(r is resultados[0] for r in resultados)
+
+    def test_snapshot_vencido_se_sirve_y_revalida(self):
+        """Test de stale-while-revalidate"""
+        versiones = iter([{"data": [{"id": 1}]}, {"data": [{"id": 2}]}])
+        cache = StationCache(lambda: next(versiones), ttl=0, retry_interval=0)
+
+        viejo = cache.get()
+        assert cache.get() is not None  # sirve el vencido y dispara refresco
+        for _ in range(50):
+            if cache.snapshot.version > viejo.version:
+                break
+            time.sleep(0.02)
+        assert cache.snapshot.stations == [{"id": 2}]
+
+    def test_error_conserva_snapshot_anterior(self):
+        """Test que un fetch fallido no descarta el último snapshot válido"""
+        respuestas = iter([{"data": [{"id": 1}]}, {"error": "Status: 503"}])
+        cache = StationCache(lambda: next(respuestas), ttl=60)
+
+        bueno = cache.get()
+        assert cache.refresh() is bueno
+        assert cache.last_error == "Status: 503"
+
+    def test_sin_datos_reporta_error(self):
+        """Test que sin snapshot previo se informa el error del upstream"""
+        cache = StationCache(lambda: {"error": "Status: 500"}, ttl=60)
+        assert cache.get() is None
+        assert cache.last_error == "Status: 500"
+
+    def test_fetches_async_coalescen(self):
+        """Test que llamadores asyncio concurrentes comparten un único fetch asíncrono"""
+        llamadas = []
+
+        async def fetch_async():
+            llamadas.append(1)
+            await asyncio.sleep(0.05)
+            return {"data": [{"id": 1}]}
+
+        cache = StationCache(lambda: {"error": "no usado"}, ttl=60, fetch_async=fetch_async)
+
+        async def varios():
+            return await asyncio.gather(*(cache.get_async() for _ in range(10)))
+
+        resultados = asyncio.run(varios())
+        assert len(llamadas) == 1
+        assert all(r is resultados[0] for r in resultados)
+        assert resultados[0].stations == [{"id": 1}]
+
+    def test_busqueda_async(self):
+        """Test que la búsqueda asíncrona entrega lo mismo que la síncrona"""
+        servicio = _servicio_con_estaciones([_estacion(1, -33.45, -70.65)])
+        esperado = servicio.search_stations(-33.45, -70.65, "93", nearest=True)
+        assert asyncio.run(servicio.search_stations_async(-33.45, -70.65, "93", nearest=True)) == esperado
+        assert "error" in asyncio.run(servicio.search_stations_async(-33.45, -70.65, "invalido"))
+
+
+class TestIndiceEspacial:
+    """Tests para el índice espacial de grilla"""
+
+    def test_coincide_con_busqueda_lineal(self):
+        """Test que los k vecinos del índice coinciden con un recorrido completo"""
+        rng = random.Random(7)
+        lats = [rng.uniform(-40, -18) for _ in range(500)]
+        lngs = [rng.uniform(-74, -68) for _ in range(500)]
+        indice = GridIndex(lats, lngs, cell_deg=0.5)
+
+        for _ in range(20):
+            lat, lng = rng.uniform(-42, -16), rng.uniform(-76, -66)
+            esperado = sorted(range(500), key=lambda i: calculate_distance(lat, lng, lats[i], lngs[i]))[:5]
+            assert [i for _, i in indice.nearest(lat, lng, 5)] == esperado
+
+    def test_predicado_e_indice_vacio(self):
+        """Test del filtro por predicado y de un índice sin puntos"""
+        indice = GridIndex([-33.0, -33.1, -33.2], [-70.0, -70.0, -70.0], ids=[10, 11, 12])
+        assert [i for _, i in indice.nearest(-33.0, -70.0, 1, lambda i: i != 10)] == [11]
+        assert GridIndex([], []).nearest(-33.0, -70.0, 3) == []
+
+    def test_busqueda_usa_indice(self):
+        """Test de los modos nearest y nearest&cheapest sobre el snapshot"""
+        estaciones = [
+            _estacion(1, -33.45, -70.65, marca=10, precios={1: 1200}),
+            _estacion(2, -33.46, -70.65, marca=5, precios={1: 1300}),
+            _estacion(3, -33.60, -70.65, marca=4, precios={1: 1100}),
+            _estacion(4, -33.44, -70.65, marca=5, precios={3: 900}),
+        ]
+        servicio = _servicio_con_estaciones(estaciones)
+
+        assert servicio.search_stations(-33.45, -70.65, "93", nearest=True)["id"] == "1"
+        assert servicio.search_stations(-33.45, -70.65, "93", nearest=True, store=True)["id"] == "2"
+        assert servicio.search_stations(-33.45, -70.65, "93", nearest=True, cheapest=True)["id"] == "3"
+        assert servicio.search_stations(-33.45, -70.65, "diesel", nearest=True)["preciosdiesel"] == 900
+
+
+class TestIndicePrecios:
+    """Tests para el índice de precios por producto"""
+
+    def _estaciones(self, semilla, n=300):
+        rng = random.Random(semilla)
+        return [_estacion(i, -33 - rng.random(), -70 - rng.random(), marca=rng.choice([5, 4, 10, 118]),
+                          precios={1: rng.randint(1200, 1260), 3: rng.randint(900, 950)}) for i in range(n)]
+
+    def test_igual_a_seleccion_parcial(self):
+        """Test que el índice entrega las mismas filas que la selección sobre el store"""
+        store = StationStore(self._estaciones(3))
+        for product in ("93", "diesel", "kerosene"):
+            indice = PriceIndex.build(store, product)
+            for k in (1, 5, 50, 1000):
+                for store_required in (False, True):
+                    assert indice.cheapest(k, store_required) == store.cheapest_rows(product, k, store_required)
+
+    def test_actualizacion_incremental(self):
+        """Test que un cambio sólo de precios actualiza el índice sin alterar el anterior"""
+        estaciones = self._estaciones(5)
+        anterior = StationSnapshot({"data": estaciones}, version=1)
+        cambiadas = [dict(e) for e in estaciones]
+        for i in (0, 17, 150):
+            cambiadas[i] = _estacion(i, float(estaciones[i]["latitud"]), float(estaciones[i]["longitud"]),
+                                     marca=estaciones[i]["marca"], precios={1: 1100 + i // 10, 3: 900})
+        nuevo = StationSnapshot({"data": cambiadas}, version=2, previous=anterior)
+
+        assert nuevo.diff.price_products == {"93", "diesel"}
+        esperado_anterior = anterior.store.cheapest_rows("93", 10, True)
+        for product in ("93", "diesel"):
+            for store_required in (False, True):
+                assert (nuevo.price_indexes[product].cheapest(400, store_required)
+                        == PriceIndex.build(nuevo.store, product).cheapest(400, store_required))
+        assert nuevo.price_indexes["93"].cheapest(3) == [0, 17, 150]
+        assert anterior.price_indexes["93"].cheapest(10, True) == esperado_anterior
+        assert nuevo.price_indexes["95"] is anterior.price_indexes["95"]
+
+        servicio = _servicio_con_estaciones([])
+        servicio.cache.publish(nuevo)
+        assert servicio.search_stations(-33.5, -70.5, "93", cheapest=True)["id"] == "0"
+
+
+class TestBusquedaPorCosto:
+    """Tests para la búsqueda por costo combinado precio + alpha * distancia"""
+
+    def _fuerza_bruta(self, store, product, lat, lng, alpha, k, store_required=False, radius_km=None):
+        precios = store.prices[product]
+        distancias = haversine_distances(lat, lng, store.lat, store.lng)
+        candidatas = [
+            (float(precios[fila] + alpha * distancias[fila]), float(distancias[fila]), fila)
+            for fila in range(len(store))
+            if not math.isnan(precios[fila]) and (not store_required or store.has_store[fila])
+            and (radius_km is None or distancias[fila] <= radius_km)
+        ]
+        return [fila for _, _, fila in sorted(candidatas)[:k]]
+
+    def test_igual_a_fuerza_bruta(self):
+        """Test que la ramificación y poda entrega el mismo top-k que ordenar todas las estaciones"""
+        rng = random.Random(11)
+        estaciones = [_estacion(i, -33 - 2 * rng.random(), -70 - 2 * rng.random(), marca=rng.choice([5, 4, 118]),
+                                precios={1: rng.randint(1200, 1300)}) for i in range(400)]
+        store = StationStore(estaciones)
+        indice = GridIndex(store.lat, store.lng, list(range(len(store))), cell_deg=0.1)
+        for alpha in (0.0, 0.5, 5.0, 200.0):
+            for store_required in (False, True):
+                tabla = build_cost_table(indice, store, "93", store_required)
+                for radius_km in (None, 40.0):
+                    lat, lng = -33 - 2 * rng.random(), -70 - 2 * rng.random()
+                    precios, minimos = tabla
+                    obtenido = [fila for _, _, fila in indice.best_by_cost(lat, lng, 10, precios, minimos,
+                                                                          alpha, radius_km)]
+                    assert obtenido == self._fuerza_bruta(store, "93", lat, lng, alpha, 10, store_required, radius_km)
+
+    def test_busqueda_con_alpha(self):
+        """Test del parámetro alpha en el servicio: orden por costo y campo costo en la respuesta"""
+        estaciones = [
+            _estacion(1, -33.450, -70.65, precios={1: 1300}),  # al lado, cara
+            _estacion(2, -33.500, -70.65, precios={1: 1250}),  # ~5.6 km, intermedia
+            _estacion(3, -34.450, -70.65, precios={1: 1100}),  # ~111 km, la más barata
+        ]
+        servicio = _servicio_con_estaciones(estaciones)
+
+        cerca = servicio.search_stations(-33.45, -70.65, "93", limit=3, alpha=5)
+        assert [r["id"] for r in cerca] == ["2", "1", "3"]
+        assert cerca[0]["costo"] == pytest.approx(1250 + 5 * cerca[0]["distancia(lineal)"], abs=0.05)
+
+        assert servicio.search_stations(-33.45, -70.65, "93", alpha=0)["id"] == "3"
+        assert "costo" not in servicio.search_stations(-33.45, -70.65, "93", nearest=True)
+        assert "error" in servicio.search_stations(-33.45, -70.65, "93", alpha=-1)
+
+        # "La más barata dentro del radio" usa la misma búsqueda con alpha = 0
+        assert servicio.search_stations(-33.45, -70.65, "93", cheapest=True, radius_km=10)["id"] == "2"
+
+
+class TestAgregados:
+    """Tests para las estadísticas de precios por región, comuna y compañía"""
+
+    ESTACIONES = [
+        {**_estacion(1, -33.45, -70.65, marca=5, precios={1: 1300, 3: 1000}, comuna="Ñuñoa")},
+        {**_estacion(2, -33.46, -70.66, marca=5, precios={1: 1200}, comuna="Ñuñoa")},
+        {**_estacion(3, -33.47, -70.67, marca=10, precios={1: 1251, 3: 1100}, comuna="Maipú")},
+        {**_estacion(4, -33.02, -71.55, marca=10, precios={3: 990}, comuna="Viña del Mar"), "region": "Valparaíso"},
+        {**_estacion(5, -33.48, -70.68, marca=10, precios={1: 1280}), "comuna": None},
+        {"id": 6, "comuna": "Ñuñoa", "combustibles": [{"id": 1, "precio": "1"}]},  # sin coordenadas
+    ]
+
+    def test_estadisticas_por_grupo(self):
+        """Test de mínimo, promedio y máximo por grupo contra un cálculo directo"""
+        servicio = _servicio_con_estaciones(self.ESTACIONES)
+        regiones = json.loads(servicio.get_aggregates("region"))
+        assert [g["region"] for g in regiones] == ["Metropolitana de Santiago", "Valparaíso"]
+        assert regiones[0]["estaciones"] == 4
+        assert regiones[0]["precios"]["93"] == {"min": 1200, "promedio": 1257.8, "max": 1300, "estaciones": 4}
+        assert regiones[0]["precios"]["diesel"] == {"min": 1000, "promedio": 1050.0, "max": 1100, "estaciones": 2}
+        assert "93" not in regiones[1]["precios"]
+
+        comunas = {g["comuna"]: g for g in json.loads(servicio.get_aggregates("comuna", "93"))}
+        assert set(comunas) == {"Maipú", "N/A", "Ñuñoa"}  # Viña del Mar no vende 93
+        assert comunas["Ñuñoa"]["precios"] == {"93": {"min": 1200, "promedio": 1250.0, "max": 1300, "estaciones": 2}}
+
+        companias = {g["compania"]: g for g in json.loads(servicio.get_aggregates("compania", "DIESEL"))}
+        assert companias[get_company_name(10)]["precios"]["diesel"]["min"] == 990
+        assert companias[get_company_name(5)]["estaciones"] == 2
+
+        assert "error" in servicio.get_aggregates("ciudad")
+        assert "error" in servicio.get_aggregates("region", "gas")
+
+    def test_agregados_incrementales_por_snapshot(self):
+        """Test que los agregados reutilizan lo que no cambió y se serializan una vez por snapshot"""
+        respuestas = [list(self.ESTACIONES),
+                      [_estacion(1, -33.45, -70.65, precios={1: 1350, 3: 1000}, comuna="Ñuñoa")]
+                      + self.ESTACIONES[1:]]
+        cache = StationCache(lambda: {"data": respuestas.pop(0)}, ttl=60)
+        primero = cache.refresh()
+        cuerpo = primero.aggregates_json("region")
+        assert primero.aggregates_json("region") is cuerpo
+
+        segundo = cache.refresh()
+        for by in ("region", "comuna", "compania"):
+            assert segundo.aggregates.stats[(by, "diesel")] is primero.aggregates.stats[(by, "diesel")]
+            assert segundo.aggregates.stats[(by, "93")] is not primero.aggregates.stats[(by, "93")]
+        nuevo = json.loads(segundo.aggregates_json("region"))
+        assert nuevo[0]["precios"]["93"]["max"] == 1350
+        assert nuevo == PriceAggregates(segundo.store, segundo.stations).groups("region")
+
+
+class TestMetricas:
+    """Tests para las métricas en formato Prometheus"""
+
+    def test_formato_de_texto(self):
+        """Test de buckets acumulados, suma, conteo y etiquetas de un histograma y un contador"""
+        registro = MetricsRegistry()
+        histograma = registro.register(Histogram("prueba_seconds", "Histograma de prueba", ("etapa",),
+                                                 buckets=(0.1, 1.0)))
+        contador = registro.register(Counter("prueba_total", "Contador de prueba", ("resultado",)))
+        for valor in (0.05, 0.5, 5.0):
+            histograma.observe(valor, "a")
+        contador.inc("ok")
+        contador.inc("ok", amount=2)
+
+        lineas = registro.render().splitlines()
+        assert "# TYPE prueba_seconds histogram" in lineas
+        assert 'prueba_seconds_bucket{etapa="a",le="0.1"} 1' in lineas
+        assert 'prueba_seconds_bucket{etapa="a",le="1"} 2' in lineas
+        assert 'prueba_seconds_bucket{etapa="a",le="+Inf"} 3' in lineas
+        assert 'prueba_seconds_sum{etapa="a"} 5.55' in lineas
+        assert 'prueba_seconds_count{etapa="a"} 3' in lineas
+        assert 'prueba_total{resultado="ok"} 3' in lineas
+        with pytest.raises(ValueError):
+            histograma.observe(1.0)
+
+    def test_etapas_de_busqueda(self):
+        """Test que una búsqueda sin caché observa las etapas validate, select y build"""
+        antes = {etapa: SEARCH_STAGE_SECONDS.count(etapa) for etapa in ("validate", "select", "build")}
+        servicio = _servicio_con_estaciones([_estacion(1, -33.45, -70.65, precios={1: 1300})])
+        servicio.search_stations(-33.45, -70.65, "93", nearest=True)
+        servicio.search_stations(-33.45, -70.65, "93", nearest=True)
+
+        assert SEARCH_STAGE_SECONDS.count("validate") - antes["validate"] == 2
+        assert SEARCH_STAGE_SECONDS.count("select") - antes["select"] == 1  # la segunda sale de la caché
+        assert SEARCH_STAGE_SECONDS.count("build") - antes["build"] == 2
+        servicio.update_metrics()
+        assert (servicio.cache.stats()["misses"], servicio.cache.stats()["hits"]) == (1, 1)
+
+
+class TestSaludUpstream:
+    """Tests para el estado de salud en memoria del upstream"""
+
+    def test_estado_desde_solicitudes_reales(self):
+        """Test que las descargas normales actualizan el estado sin sondear el upstream"""
+        respuestas = [httpx.Response(200, json={"data": [_estacion(1, -33.45, -70.65)]}), httpx.Response(503)]
+
+        servicio = FuelService()
+        servicio.client = UpstreamClient("http://upstream.test/api", 5,
+                                         transport=httpx.MockTransport(lambda request: respuestas.pop(0)))
+        assert servicio.upstream_status() == "Sin datos del upstream"
+
+        servicio.cache.refresh()
+        assert servicio.upstream_status() == "Conexión ready"
+        assert servicio.health_report()["status"] == "healthy"
+
+        servicio.cache.refresh()
+        reporte = servicio.health_report()
+        assert reporte["api_externa"] == "Respuesta: 503"
+        assert reporte["upstream"]["fallos_consecutivos"] == 1
+        assert reporte["status"] == "degraded"
+        assert reporte["listo"]  # el snapshot anterior sigue vigente
+
+    def test_readiness_por_antiguedad(self):
+        """Test que el worker deja de estar listo sin snapshot o con uno demasiado antiguo"""
+        servicio = FuelService()
+        servicio.cache = StationCache(lambda: {"error": "caído"}, ttl=60)
+        assert servicio.readiness() == (False, "Sin snapshot de estaciones")
+
+        servicio.cache.publish(StationSnapshot({"data": [_estacion(1, -33.45, -70.65)]}, version=1,
+                                               fetched_at=time.time() - 2 * servicio.max_snapshot_age))
+        listo, motivo = servicio.readiness()
+        assert not listo and "antigüedad" in motivo
+
+    def test_sondeo_solo_sin_trafico(self):
+        """Test que el sondeo periódico no llama al upstream si hubo solicitudes recientes"""
+        llamadas = []
+
+        def handler(request):
+            llamadas.append(request.url.path)
+            return httpx.Response(200, json={})
+
+        async def ejecutar():
+            servicio = FuelService()
+            servicio.health_probe_interval = 0.1
+            servicio.client = UpstreamClient("http://upstream.test/api", 5,
+                                             async_transport=httpx.MockTransport(handler))
+            servicio.start_health_probe()
+            await asyncio.sleep(0.25)
+            sondeos = len(llamadas)
+            # Tráfico real constante: el sondeo no agrega solicitudes
+            for _ in range(6):
+                await servicio.get_combustibles_async()
+                await asyncio.sleep(0.01)
+            await servicio.close()
+            return sondeos
+
+        sondeos = asyncio.run(ejecutar())
+        assert sondeos >= 1
+        assert len(llamadas) == sondeos + 6
+
+
+class TestResiliencia:
+    """Tests de reintentos, circuit breaker y timeouts adaptativos contra un upstream con fallas"""
+
+    @staticmethod
+    def _servicio(upstream, **config):
+        servicio = FuelService()
+        config = ResilienceConfig(read_timeout_max=5, backoff_base=0.01, **config)
+        servicio.client = UpstreamClient(upstream.url, 5, config=config)
+        return servicio
+
+    def test_reintentos_ante_fallas_transitorias(self):
+        """Test que 5xx y conexiones cortadas se reintentan, también en la descarga en streaming"""
+        with MockUpstream(generate_payload(50, seed=2)) as upstream:
+            servicio = self._servicio(upstream, retries=2)
+            upstream.inject("combustible_ciudadano", "status:503", "reset")
+            assert "error" not in servicio.get_combustibles()
+            assert upstream.count("combustible_ciudadano") == 3
+
+            upstream.inject("busqueda_estacion_filtro", "status:502")
+            assert len(asyncio.run(servicio.fetch_snapshot_async()).stations) == 50
+            assert upstream.count("busqueda_estacion_filtro") == 2
+
+            # Sin más reintentos disponibles se informa la última falla
+            upstream.inject("combustible_ciudadano", "status:503", "status:503", "status:503")
+            assert servicio.get_combustibles() == {"error": "Status: 503"}
+
+    def test_presupuesto_de_reintentos(self):
+        """Test que los reintentos quedan limitados a una fracción de las solicitudes"""
+        presupuesto = RetryBudget(ratio=0.5, minimum=1)
+        presupuesto.record_request()
+        presupuesto.record_request()
+        assert presupuesto.try_acquire()
+        assert not presupuesto.try_acquire()
+        presupuesto.record_request()
+        presupuesto.record_request()
+        assert presupuesto.try_acquire()
+
+    def test_circuito_abierto_sirve_ultimo_snapshot(self):
+        """Test que con el circuito abierto no se llama al upstream y se sigue sirviendo el snapshot"""
+        with MockUpstream(generate_payload(50, seed=3)) as upstream:
+            servicio = self._servicio(upstream, retries=0, breaker_failures=2, breaker_reset=0.2)
+            snapshot = servicio.cache.refresh()
+            upstream.inject("busqueda_estacion_filtro", "status:503", "reset")
+            servicio.cache.refresh()
+            servicio.cache.refresh()
+            assert servicio.client.breaker.state == CircuitBreaker.OPEN
+
+            llamadas = upstream.count("busqueda_estacion_filtro")
+            servicio.cache.refresh()
+            assert upstream.count("busqueda_estacion_filtro") == llamadas
+            assert "Circuito abierto" in servicio.cache.last_error
+            assert servicio.cache.snapshot is snapshot
+            assert "error" not in servicio.search_stations(-33.45, -70.65, "93", nearest=True)
+            assert servicio.health_report()["upstream"]["circuito"] == "abierto"
+
+            # Pasado el reset una llamada de prueba exitosa cierra el circuito
+            time.sleep(0.25)
+            assert servicio.client.breaker.state == CircuitBreaker.HALF_OPEN
+            servicio.cache.refresh()
+            assert upstream.count("busqueda_estacion_filtro") == llamadas + 1
+            assert servicio.client.breaker.state == CircuitBreaker.CLOSED
+
+    def test_prueba_cancelada_libera_el_circuito(self):
+        """Test que cancelar la llamada de prueba del circuito semiabierto no lo deja abierto para siempre"""
+        bloqueado = {"envio": True}
+
+        async def handler(request):
+            if bloqueado["envio"]:
+                await asyncio.sleep(10)
+            return httpx.Response(200, json={"data": []})
+
+        config = ResilienceConfig(read_timeout_max=5, retries=0, breaker_failures=1, breaker_reset=0.05)
+        cliente = UpstreamClient("http://upstream.test/api", 5, async_transport=httpx.MockTransport(handler),
+                                 config=config)
+
+        async def descargar(leyendo: asyncio.Event):
+            async with cliente.astream("busqueda_estacion_filtro") as response:
+                leyendo.set()
+                await asyncio.sleep(10)
+                return response.status_code
+
+        async def cancelar_prueba(leyendo: asyncio.Event, espera):
+            cliente.breaker.record_failure()
+            await asyncio.sleep(0.06)
+            assert cliente.breaker.state == CircuitBreaker.HALF_OPEN
+            tarea = asyncio.create_task(descargar(leyendo))
+            await espera()
+            tarea.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await tarea
+            assert cliente.breaker.state == CircuitBreaker.HALF_OPEN
+            assert cliente.breaker.before_call()  # la siguiente llamada es la nueva prueba
+            cliente.breaker.release_trial()
+
+        async def escenario():
+            # Cancelada mientras espera los encabezados y mientras se lee el cuerpo
+            await cancelar_prueba(asyncio.Event(), lambda: asyncio.sleep(0.05))
+            bloqueado["envio"] = False
+            leyendo = asyncio.Event()
+            await cancelar_prueba(leyendo, leyendo.wait)
+            async with cliente.astream("busqueda_estacion_filtro") as response:
+                assert response.status_code == 200
+            assert cliente.breaker.state == CircuitBreaker.CLOSED
+            await cliente.aclose()
+
+        asyncio.run(escenario())
+
+    def test_timeout_adaptativo(self):
+        """Test que el timeout de lectura baja con el p99 observado y corta las respuestas lentas"""
+        with MockUpstream(generate_payload(10, seed=4)) as upstream:
+            servicio = self._servicio(upstream, retries=1, read_timeout_min=0.3)
+            assert servicio.client.timeouts.read_timeout("combustible_ciudadano") == 5
+            for _ in range(20):
+                servicio.client.get("combustible_ciudadano")
+            assert servicio.client.timeouts.read_timeout("combustible_ciudadano") == 0.3
+
+            upstream.inject("combustible_ciudadano", "delay:2")
+            inicio = time.perf_counter()
+            assert "error" not in servicio.get_combustibles()
+            assert time.perf_counter() - inicio < 1.5
+            assert upstream.count("combustible_ciudadano") == 22
+
+
+class TestBenchmarks:
+    """Tests para el generador sintético y el upstream local de los benchmarks"""
+
+    def test_generador_reproducible(self):
+        """Test que el listado sintético es determinista y tiene el formato del upstream"""
+        estaciones = generate_stations(500, seed=7)
+        assert estaciones == generate_stations(500, seed=7)
+        store = StationStore(estaciones)
+        assert len(store) == 500
+        assert np.isfinite(store.prices["93"]).mean() > 0.95
+        assert np.isfinite(store.prices["kerosene"]).mean() < 0.5
+        assert all(validate_coordinates(lat, lng) for lat, lng in zip(store.lat, store.lng))
+
+    def test_upstream_local_con_etag(self):
+        """Test que el servicio descarga del upstream local y revalida con 304"""
+        with MockUpstream(generate_payload(300, seed=1)) as upstream:
+            servicio = FuelService()
+            servicio.client = UpstreamClient(upstream.url, 5)
+            primero = servicio.cache.refresh()
+            assert len(primero.store) == 300
+            assert servicio.cache.refresh() is primero
+            assert upstream.count("busqueda_estacion_filtro") == 2
+            assert "error" not in servicio.search_stations(-33.45, -70.65, "93", nearest=True)
+
+    def test_comparacion_de_corridas(self):
+        """Test que la comparación sólo informa empeoramientos sobre el umbral"""
+        anterior = {"results": [{"size": 2000, "mode": "nearest", "p50_ms": 1.0, "p99_ms": 2.0}]}
+        actual = {"results": [{"size": 2000, "mode": "nearest", "p50_ms": 1.1, "p99_ms": 3.0}]}
+        regresiones = compare(actual, anterior, threshold=0.2)
+        assert len(regresiones) == 1 and "p99_ms" in regresiones[0]
+
+    def test_mezcla_de_carga(self):
+        """Test de la mezcla de modos y los orígenes de la prueba de carga"""
+        assert parse_mix("nearest=3,cost") == {"nearest": 3.0, "cost": 1.0}
+        with pytest.raises(ValueError):
+            parse_mix("cercana=1")
+
+        solicitudes = build_requests(2000, {"nearest": 3, "cheapest": 1}, seed=2, distribution="uniform")
+        cercanas = sum(1 for modo, _ in solicitudes if modo == "nearest")
+        assert 1350 < cercanas < 1650
+        assert all(validate_coordinates(float(p["lat"]), float(p["lng"])) for _, p in solicitudes)
+        assert all(params.get(modo) == "true" for modo, params in solicitudes)
+
+
+class TestStoreColumnar:
+    """Tests para el almacenamiento columnar de estaciones"""
+
+    def test_columnas_y_precios_faltantes(self):
+        """Test de normalización del snapshot raw en columnas"""
+        estaciones = [
+            _estacion(1, -33.45, -70.65, marca=5, precios={1: "1299.9", 3: 950}),
+            {"id": 2, "latitud": None, "longitud": "-70.6"},  # sin coordenadas: se descarta
+            _estacion(3, -33.50, -70.70, marca=118, precios={3: "no-numero"}),
+        ]
+        store = StationStore(estaciones)
+
+        assert len(store) == 2
+        assert store.source.tolist() == [0, 2]
+        assert store.brand.tolist() == [5, 118]
+        assert store.has_store.tolist() == [True, False]
+        assert store.prices["93"][0] == 1299
+        assert math.isnan(store.prices["93"][1])
+        assert store.prices["diesel"][0] == 950
+        assert math.isnan(store.prices["diesel"][1])
+
+    def test_mas_barata(self):
+        """Test de la reducción de menor precio con y sin tienda"""
+        estaciones = [
+            _estacion(1, -33.45, -70.65, marca=5, precios={1: 1300}),
+            _estacion(2, -33.46, -70.65, marca=118, precios={1: 1250}),
+            _estacion(3, -33.47, -70.65, marca=4, precios={1: 1250}),
+        ]
+        store = StationStore(estaciones)
+        assert store.cheapest_row("93") == 1
+        assert store.cheapest_row("93", store_required=True) == 2
+        assert store.cheapest_row("kerosene") is None
+
+        servicio = _servicio_con_estaciones(estaciones)
+        assert servicio.search_stations(-33.45, -70.65, "93", cheapest=True)["id"] == "2"
+        assert servicio.search_stations(-33.45, -70.65, "93", cheapest=True, store=True)["id"] == "3"
+
+
+class TestPaginacion:
+    """Tests para búsquedas top-k, por radio y paginadas"""
+
+    estaciones = [
+        _estacion(1, -33.450, -70.65, marca=5, precios={1: 1300}),
+        _estacion(2, -33.460, -70.65, marca=118, precios={1: 1200}),
+        _estacion(3, -33.480, -70.65, marca=4, precios={1: 1250}),
+        _estacion(4, -33.900, -70.65, marca=5, precios={1: 1100}),
+    ]
+
+    def test_limit_y_offset(self):
+        """Test de listas de las más cercanas con paginación"""
+        servicio = _servicio_con_estaciones(self.estaciones)
+        pagina = servicio.search_stations(-33.45, -70.65, "93", nearest=True, limit=2)
+        assert [e["id"] for e in pagina] == ["1", "2"]
+        pagina = servicio.search_stations(-33.45, -70.65, "93", nearest=True, limit=2, offset=2)
+        assert [e["id"] for e in pagina] == ["3", "4"]
+        assert servicio.search_stations(-33.45, -70.65, "93", nearest=True, limit=2, offset=10) == []
+
+    def test_paginas_cercanas_y_baratas(self):
+        """Test que las páginas de nearest&cheapest salen de un mismo grupo: sin repetidas ni saltos"""
+        rng = random.Random(8)
+        estaciones = [_estacion(i, -33.45 + rng.uniform(-0.05, 0.05), -70.65 + rng.uniform(-0.05, 0.05),
+                                precios={1: rng.randint(1100, 1400)}) for i in range(60)]
+        for maxsize in (0, 100):
+            servicio = _servicio_con_estaciones(estaciones)
+            servicio.search_cache = ResultCache(maxsize=maxsize)
+            completa = servicio.search_stations(-33.45, -70.65, "93", nearest=True, cheapest=True, limit=15)
+            assert len(completa) == 15
+            paginas = []
+            for offset in range(0, 20, 5):
+                paginas += servicio.search_stations(-33.45, -70.65, "93", nearest=True, cheapest=True,
+                                                    limit=5, offset=offset)
+            assert [e["id"] for e in paginas] == [e["id"] for e in completa]
+
+    def test_radio(self):
+        """Test de búsquedas restringidas a un radio"""
+        servicio = _servicio_con_estaciones(self.estaciones)
+        baratas = servicio.search_stations(-33.45, -70.65, "93", cheapest=True, limit=5, radius_km=10)
+        assert [e["id"] for e in baratas] == ["2", "3", "1"]
+        assert servicio.search_stations(-33.45, -70.65, "93", cheapest=True)["id"] == "4"
+        cercanas = servicio.search_stations(-33.45, -70.65, "93", nearest=True, limit=5, radius_km=2.5)
+        assert [e["id"] for e in cercanas] == ["1", "2"]
+        assert all(e["distancia(lineal)"] <= 2.5 for e in cercanas)
+
+    def test_parametros_invalidos(self):
+        """Test de validación de limit, offset y radius_km"""
+        servicio = _servicio_con_estaciones(self.estaciones)
+        assert "error" in servicio.search_stations(-33.45, -70.65, "93", limit=0)
+        assert "error" in servicio.search_stations(-33.45, -70.65, "93", offset=-1)
+        assert "error" in servicio.search_stations(-33.45, -70.65, "93", radius_km=0)
+
+    def test_mas_baratas_seleccion_parcial(self):
+        """Test que la selección parcial coincide con un ordenamiento estable completo"""
+        rng = random.Random(5)
+        estaciones = [_estacion(i, -33.4, -70.6, precios={1: rng.choice([1200, 1250, 1300])})
+                      for i in range(200)]
+        store = StationStore(estaciones)
+        esperado = sorted(range(200), key=lambda fila: store.prices["93"][fila])[:25]
+        assert store.cheapest_rows("93", 25) == esperado
+
+
+class TestCacheResultados:
+    """Tests para la memoización de búsquedas por coordenadas cuantizadas"""
+
+    def test_geohash(self):
+        """Test de codificación geohash con un valor conocido"""
+        assert encode_geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+        assert encode_geohash(-33.4500, -70.6500, 6) == encode_geohash(-33.4501, -70.6501, 6)
+
+    def test_lru_ttl_y_version(self):
+        """Test de aciertos, desalojos, expiración e invalidación por versión"""
+        cache = ResultCache(maxsize=2, ttl=60)
+        cache.put("a", 1, version=1)
+        cache.put("b", 2, version=1)
+        assert cache.get("a", version=1) == 1
+        cache.put("c", 3, version=1)  # desaloja "b", el menos usado
+        assert cache.get("b", version=1) is None
+        assert cache.evictions == 1
+
+        assert cache.get("a", version=2) is None  # snapshot nuevo: todo se invalida
+        assert len(cache) == 0
+        assert cache.invalidations == 1
+
+        expirada = ResultCache(maxsize=2, ttl=0)
+        expirada.put("a", 1, version=1)
+        assert expirada.get("a", version=1) is None
+
+    def test_busqueda_memorizada(self):
+        """Test que búsquedas cercanas reutilizan la selección pero con distancia exacta"""
+        servicio = _servicio_con_estaciones([_estacion(1, -33.45, -70.65), _estacion(2, -33.50, -70.65)])
+        primera = servicio.search_stations(-33.4400, -70.6500, "93", nearest=True)
+        segunda = servicio.search_stations(-33.4401, -70.6501, "93", nearest=True)
+        assert primera["id"] == segunda["id"] == "1"
+        assert servicio.search_cache.hits == 1
+        assert segunda["distancia(lineal)"] == round(calculate_distance(-33.4401, -70.6501, -33.45, -70.65), 2)
+
+        servicio.cache.refresh()  # snapshot nuevo invalida la caché
+        servicio.search_stations(-33.4401, -70.6501, "93", nearest=True)
+        assert servicio.search_cache.stats()["invalidaciones"] == 1
+
+    def test_origenes_de_una_misma_celda(self):
+        """Test que dos orígenes de la misma celda reciben cada uno su propia estación más cercana"""
+        a, b = (-33.45, -70.65), (-33.45, -70.64896)
+        assert encode_geohash(*a, 7) == encode_geohash(*b, 7)
+        servicio = _servicio_con_estaciones([_estacion(1, -33.45, -70.6509, precios={1: 1300}),
+                                             _estacion(2, -33.45, -70.6481, precios={1: 1200})])
+        assert servicio.search_stations(*a, "93", nearest=True)["id"] == "1"
+        cercana = servicio.search_stations(*b, "93", nearest=True)
+        assert cercana["id"] == "2" and cercana["distancia(lineal)"] < 0.1
+        assert servicio.search_cache.hits == 1
+
+        for origen, esperado in ((a, ["1"]), (b, ["2"])):
+            dentro = servicio.search_stations(*origen, "93", nearest=True, limit=5, radius_km=0.09)
+            assert [r["id"] for r in dentro] == esperado
+        assert [r["id"] for r in servicio.search_stations(*a, "93", limit=2, alpha=2000)] == ["1", "2"]
+        assert [r["id"] for r in servicio.search_stations(*b, "93", limit=2, alpha=2000)] == ["2", "1"]
+
+    def test_memoizacion_equivale_a_busqueda_directa(self):
+        """Test que con la caché cada origen recibe lo mismo que una búsqueda sin caché, en todos los modos"""
+        rng = random.Random(9)
+        estaciones = [_estacion(i, -33.45 + rng.uniform(-0.02, 0.02), -70.65 + rng.uniform(-0.02, 0.02),
+                                marca=rng.choice([5, 10, 174]), precios={1: rng.choice([1200, 1210, 1250])})
+                      for i in range(300)]
+        memorizado = _servicio_con_estaciones(estaciones)
+        directo = _servicio_con_estaciones(estaciones)
+        directo.search_cache = ResultCache(maxsize=0)
+        modos = [{"nearest": True}, {"nearest": True, "store": True}, {"nearest": True, "cheapest": True},
+                 {"cheapest": True}, {"cheapest": True, "radius_km": 0.5}, {"alpha": 50.0},
+                 {"alpha": 2000.0, "radius_km": 1.0, "store": True}, {"nearest": True, "radius_km": 0.3}]
+        centros = [(-33.45 + rng.uniform(-0.01, 0.01), -70.65 + rng.uniform(-0.01, 0.01)) for _ in range(4)]
+        for _ in range(10):
+            for lat, lng in centros:
+                # Orígenes distintos que caen en la celda de precisión 7 de cada centro
+                origen = (lat + rng.uniform(-0.0006, 0.0006), lng + rng.uniform(-0.0006, 0.0006))
+                for modo in modos:
+                    esperado = directo.search_stations(*origen, "93", limit=4, offset=1, **modo)
+                    obtenido = memorizado.search_stations(*origen, "93", limit=4, offset=1, **modo)
+                    assert [(r["id"], r["distancia(lineal)"]) for r in obtenido] == \
+                        [(r["id"], r["distancia(lineal)"]) for r in esperado], modo
+        assert memorizado.search_cache.hits > 0
+
+    def test_lote_por_celda_equivale_a_busquedas_sueltas(self):
+        """Test que el lote agrupado por celda (matriz de distancias) responde igual que cada búsqueda"""
+        rng = random.Random(11)
+        estaciones = [_estacion(i, -33.45 + rng.uniform(-0.02, 0.02), -70.65 + rng.uniform(-0.02, 0.02),
+                                marca=rng.choice([5, 10]), precios={1: rng.choice([1200, 1210, 1250])})
+                      for i in range(200)]
+        directo = _servicio_con_estaciones(estaciones)
+        directo.search_cache = ResultCache(maxsize=0)
+        modos = [{"nearest": True}, {"nearest": True, "cheapest": True, "limit": 3},
+                 {"cheapest": True, "radius_km": 0.5, "limit": 2}, {"alpha": 50.0, "store": True, "limit": 3},
+                 {"nearest": True, "radius_km": 0.3, "limit": 5, "offset": 1}, {"cheapest": True}]
+        consultas = [{"lat": -33.451 + rng.uniform(-0.0005, 0.0005), "lng": -70.651 + rng.uniform(-0.0005, 0.0005),
+                      "product": "93", **modo} for modo in modos for _ in range(4)]
+        consultas.append({"lat": -33.451, "lng": -70.651, "product": "invalido"})
+        esperado = [directo.search_stations(c["lat"], c["lng"], c["product"], c.get("nearest", False),
+                                            c.get("store", False), c.get("cheapest", False), c.get("limit"),
+                                            c.get("offset", 0), c.get("radius_km"), c.get("alpha"))
+                    for c in consultas]
+        for maxsize in (0, 100):
+            servicio = _servicio_con_estaciones(estaciones)
+            servicio.search_cache = ResultCache(maxsize=maxsize)
+            assert servicio.search_stations_batch(consultas) == esperado
+
+
+class TestJsonStream:
+    """Tests para el parseo JSON incremental"""
+
+    cuerpo = json.dumps({
+        "status": 200, "meta": {"a": [1, {"b": "]}"}]},
+        "data": [{"id": 1, "comuna": "Ñuñoa", "precio": 1234.5}, {"id": 2, "texto": "\\\"[{"}, 17, "x"],
+        "total": 123456
+    }, ensure_ascii=False).encode()
+
+    @pytest.mark.parametrize("tamano", [1, 2, 3, 7, 64, 100000])
+    def test_fragmentos_de_cualquier_tamano(self, tamano):
+        """Test que el resultado no depende de cómo llegan los bytes"""
+        parser = JsonArrayStream("data")
+        for inicio in range(0, len(self.cuerpo), tamano):
+            parser.feed(self.cuerpo[inicio:inicio + tamano])
+        assert parser.close() == json.loads(self.cuerpo)["data"]
+        assert parser.found
+
+    def test_transformacion(self):
+        """Test que cada elemento pasa por la transformación al completarse"""
+        parser = JsonArrayStream("data", transform=lambda item: item["id"])
+        parser.feed(b'{"data": [{"id": 1}, {"id": 2}]}')
+        assert parser.items == [1, 2]
+
+    def test_json_invalido(self):
+        """Test que un cuerpo incompleto o inválido lanza ValueError"""
+        for cuerpo in (b'{"data": [1, 2', b'[1, 2]', b'{"data": {"id": 1}}', b'{"data": [1]} extra'):
+            parser = JsonArrayStream("data")
+            with pytest.raises(ValueError):
+                parser.feed(cuerpo)
+                parser.close()
+
+
+class TestModeloEstacion:
+    """Tests para el modelo compacto de estación"""
+
+    estaciones = [
+        _estacion(1, -33.45, -70.65, marca=5, precios={1: 1300, 3: 900}, comuna="Ñuñoa"),
+        _estacion(2, -33.46, -70.64, marca=118, precios={1: "1250.7", 7: 1400}),
+        {**_estacion(3, -33.47, -70.66, marca=4), "comuna": None},
+        {"id": 4, "marca": 88, "Direccion": "Ruta 5", "latitud": "-33.48", "longitud": "-70.6",
+         "combustibles": [{"id": 1, "precio": "x"}, {"id": 1, "precio": "1290"}]},
+    ]
+
+    def test_misma_salida_que_process_station_data(self):
+        """Test que el resultado serializado coincide con el formato histórico"""
+        store = StationStore(self.estaciones)
+        tabla = StationTable(store, self.estaciones)
+        for product in ("93", "Diesel", "95"):
+            resultados = build_station_results(store, tabla, list(range(len(store))), -33.4, -70.6, product)
+            esperados = [process_station_data(e, -33.4, -70.6, product, get_product_id(product))
+                         for e in self.estaciones]
+            assert [json.loads(dumps(r)) for r in resultados] == [e for e in esperados if e]
+
+    def test_objetos_compartidos_por_snapshot(self):
+        """Test que las búsquedas reutilizan los objetos Station del snapshot"""
+        servicio = _servicio_con_estaciones(self.estaciones)
+        primero = servicio.search_stations(-33.45, -70.65, "93", nearest=True)
+        segundo = servicio.search_stations(-33.40, -70.60, "93", nearest=True)
+        assert isinstance(primero, StationResult)
+        assert primero["tienda"] == {"codigo": "1", "nombre": "Pronto Ñuñoa", "tipo": "Pronto"}
+        assert primero.station is servicio.cache.snapshot.station_table[0]
+        assert primero.station is segundo.station
+        assert primero["distancia(lineal)"] != segundo["distancia(lineal)"]
+
+
+class TestSingleFlight:
+    """Tests para la coalescencia de llamadas concurrentes al upstream"""
+
+    def test_hilos_comparten_una_solicitud(self):
+        """Test que los hilos concurrentes hacen una sola solicitud y reciben el mismo resultado"""
+        llamadas = []
+
+        def handler(request):
+            llamadas.append(request.url.path)
+            time.sleep(0.2)
+            return httpx.Response(200, json={"data": [{"id": 1}]})
+
+        servicio = FuelService()
+        servicio.client = UpstreamClient("http://upstream.test/api", 5, transport=httpx.MockTransport(handler))
+        resultados = [None] * 8
+
+        def llamar(i):
+            resultados[i] = servicio.get_combustibles() if i % 2 else servicio.test_connection()
+
+        hilos = [threading.Thread(target=llamar, args=(i,)) for i in range(8)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        assert llamadas == ["/api/combustible_ciudadano"]
+        assert resultados[1] == {"data": [{"id": 1}]} and resultados[1] is resultados[3]
+        assert resultados[0] == "Conexión ready"
+        assert servicio.upstream_calls.inflight() == 0
+
+    def test_corrutinas_y_errores(self):
+        """Test que las corrutinas comparten la solicitud, también cuando falla"""
+        llamadas = []
+
+        async def handler(request):
+            llamadas.append(request.url.path)
+            await asyncio.sleep(0.05)
+            if len(llamadas) > 1:
+                raise httpx.ConnectError("caído")
+            return httpx.Response(200, json={"data": []})
+
+        servicio = FuelService()
+        servicio.client = UpstreamClient("http://upstream.test/api", 5, async_transport=httpx.MockTransport(handler))
+
+        async def ejecutar():
+            exitos = await asyncio.gather(*(servicio.get_combustibles_async() for _ in range(5)))
+            fallas = await asyncio.gather(servicio.get_combustibles_async(), servicio.test_connection_async())
+            await servicio.client.aclose()
+            return exitos, fallas
+
+        exitos, fallas = asyncio.run(ejecutar())
+        assert len(llamadas) == 2
+        assert all(resultado == {"data": []} for resultado in exitos)
+        assert fallas[0] == {"error": "caído"}
+        assert fallas[1] == "Error de conexión: caído"
+
+    def test_lider_cancelado_e_hilos_con_corrutinas(self):
+        """Test que cancelar al líder no cancela la llamada y que un hilo espera a una corrutina"""
+        vuelo = SingleFlight()
+        ejecuciones = []
+
+        async def lenta():
+            ejecuciones.append(1)
+            await asyncio.sleep(0.1)
+            return "listo"
+
+        async def ejecutar():
+            lider = asyncio.ensure_future(vuelo.do_async("k", lenta))
+            await asyncio.sleep(0.01)
+            seguidor = asyncio.ensure_future(vuelo.do_async("k", lenta))
+            desde_hilo = asyncio.ensure_future(asyncio.to_thread(vuelo.do, "k", lambda: "otro"))
+            lider.cancel()
+            return await seguidor, await desde_hilo
+
+        assert asyncio.run(ejecutar()) == ("listo", "listo")
+        assert ejecuciones == [1]
+
+
+class TestRespuestasJson:
+    """Tests para la serialización de respuestas"""
+
+    contenido = {"id": "7", "comuna": "Ñuñoa", "precio": np.int64(1300), "distancias": np.array([1.5, 2.0]),
+                 "tienda": None, "ok": True}
+
+    @pytest.mark.parametrize("fast_json", ["false", "true"])
+    def test_dumps(self, monkeypatch, fast_json):
+        """Test que ambos backends producen JSON equivalente con tipos NumPy"""
+        monkeypatch.setenv("FAST_JSON", fast_json)
+        assert json.loads(dumps(self.contenido)) == {
+            "id": "7", "comuna": "Ñuñoa", "precio": 1300, "distancias": [1.5, 2.0], "tienda": None, "ok": True
+        }
+
+    def test_fragmentos_preserializados(self):
+        """Test que los fragmentos RawJSON se insertan sin volver a serializar"""
+        cuerpo = dumps_object({"total": 2, "muestra": RawJSON(b'{"data": [1, 2]}'), "fuente": "API"})
+        assert json.loads(cuerpo) == {"total": 2, "muestra": {"data": [1, 2]}, "fuente": "API"}
+
+    def test_combustibles_por_version(self):
+        """Test que los combustibles serializados se reutilizan hasta que cambia el snapshot"""
+        llamadas = []
+
+        async def handler(request):
+            llamadas.append(request.url.path)
+            return httpx.Response(200, json={"data": [{"id": 1, "nombre": "Gasolina 93"}]})
+
+        servicio = _servicio_con_estaciones([_estacion(1, -33.45, -70.65)])
+        servicio.client = UpstreamClient("http://upstream.test/api", 5, async_transport=httpx.MockTransport(handler))
+        servicio.cache.refresh()
+
+        async def pedir(veces):
+            return [await servicio.get_combustibles_json_async() for _ in range(veces)]
+
+        primero, segundo = asyncio.run(pedir(2))
+        assert segundo is primero
+        assert json.loads(primero) == {"data": [{"id": 1, "nombre": "Gasolina 93"}]}
+        assert len(llamadas) == 1
+
+        servicio.cache.refresh()
+        asyncio.run(pedir(1))
+        assert len(llamadas) == 2
+
+
+class TestDescargaCondicional:
+    """Tests para descargas condicionales y reconstrucción incremental"""
+
+    def _servicio_con_upstream(self, handler):
+        servicio = FuelService()
+        servicio.client = UpstreamClient("http://upstream.test/api", 5, transport=httpx.MockTransport(handler))
+        return servicio
+
+    def test_etag_y_304(self):
+        """Test que se envía If-None-Match y un 304 conserva el snapshot"""
+        recibidos = []
+
+        def handler(request):
+            recibidos.append(request.headers.get("if-none-match"))
+            if request.headers.get("if-none-match") == '"v1"':
+                return httpx.Response(304, headers={"ETag": '"v1"'})
+            return httpx.Response(200, json={"data": [_estacion(1, -33.45, -70.65)]}, headers={"ETag": '"v1"'})
+
+        servicio = self._servicio_con_upstream(handler)
+        primero = servicio.cache.refresh()
+        segundo = servicio.cache.refresh()
+        assert recibidos == [None, '"v1"']
+        assert segundo is primero
+        assert segundo.version == 1
+
+    def test_cuerpo_identico_no_se_reprocesa(self):
+        """Test que sin validadores un cuerpo idéntico no genera snapshot nuevo"""
+        cuerpo = {"data": [_estacion(1, -33.45, -70.65)]}
+        servicio = self._servicio_con_upstream(lambda request: httpx.Response(200, json=cuerpo))
+        primero = servicio.cache.refresh()
+        assert servicio.cache.refresh() is primero
+        assert primero.body_hash is not None
+
+    def test_diff_reconstruye_solo_lo_afectado(self):
+        """Test que un cambio sólo de precios reutiliza índices y conserva búsquedas por cercanía"""
+        versiones = [
+            {"data": [_estacion(1, -33.45, -70.65, precios={1: 1300, 3: 900}),
+                      _estacion(2, -33.46, -70.65, precios={1: 1200})]},
+            {"data": [_estacion(1, -33.45, -70.65, precios={1: 1100, 3: 900}),
+                      _estacion(2, -33.46, -70.65, precios={1: 1200})]},
+        ]
+        servicio = self._servicio_con_upstream(lambda request: httpx.Response(200, json=versiones.pop(0)))
+        anterior = servicio.cache.refresh()
+        servicio.search_stations(-33.45, -70.65, "93", nearest=True)
+        servicio.search_stations(-33.45, -70.65, "93", cheapest=True)
+        assert len(servicio.search_cache) == 2
+
+        nuevo = servicio.cache.refresh()
+        assert nuevo.diff.changed == {"1"}
+        assert nuevo.diff.price_products == {"93"}
+        assert nuevo.diff.layout_products == set()
+        assert nuevo.indexes["93"] is anterior.indexes["93"]
+        assert len(servicio.search_cache) == 1  # sólo sobrevive la búsqueda por cercanía
+        assert servicio.search_stations(-33.45, -70.65, "93", cheapest=True)["precios93"] == 1100
+        assert servicio.search_stations(-33.45, -70.65, "93", nearest=True)["precios93"] == 1100
+
+    def test_descarga_en_streaming(self):
+        """Test que el snapshot descargado conserva sólo campos de búsqueda y el payload completo"""
+        estacion = {**_estacion(1, -33.45, -70.65, comuna="Ñuñoa"), "servicios": [{"nombre": "Baño"}]}
+        cuerpo = {"status": "ok", "data": [estacion]}
+        servicio = self._servicio_con_upstream(lambda request: httpx.Response(200, json=cuerpo))
+
+        snapshot = servicio.cache.refresh()
+        assert "servicios" not in snapshot.stations[0]
+        assert snapshot.stations[0]["comuna"] == "Ñuñoa"
+        assert snapshot._data is None  # se parsea recién cuando se pide
+        assert asyncio.run(servicio.get_estaciones_async())["data"][0]["servicios"] == [{"nombre": "Baño"}]
+        assert snapshot.data == cuerpo
+        assert snapshot.data is snapshot.data  # una sola vez por snapshot
+        assert servicio.search_stations(-33.45, -70.65, "93", nearest=True)["comuna"] == "Ñuñoa"
+
+    def test_respuesta_sin_data(self):
+        """Test que una respuesta sin 'data' o truncada no reemplaza el snapshot"""
+        respuestas = [b'{"data": [{"id": 1}]}', b'{"mensaje": "mantenimiento"}', b'{"data": [{"id": 1']
+        servicio = self._servicio_con_upstream(lambda request: httpx.Response(200, content=respuestas.pop(0)))
+        primero = servicio.cache.refresh()
+        assert servicio.cache.refresh() is primero
+        assert "data" in servicio.cache.last_error
+        servicio.cache.last_error = None
+        assert servicio.cache.refresh() is primero
+        assert servicio.cache.last_error is not None
+
+    def test_diff_estaciones_agregadas(self):
+        """Test del diff por estación al agregar y quitar estaciones"""
+        anterior = StationStore([_estacion(1, -33.45, -70.65), _estacion(2, -33.46, -70.65)])
+        nuevo = StationStore([_estacion(2, -33.46, -70.65), _estacion(3, -33.47, -70.65)])
+        diff = diff_stores(anterior, nuevo)
+        assert diff.added == {"3"}
+        assert diff.removed == {"1"}
+        assert diff.changed == set()
+        assert diff.layout_products == {"93"}
+
+
+class TestSnapshotEnDisco:
+    """Tests para la persistencia de snapshots en disco"""
+
+    estaciones = [
+        _estacion(1, -33.45, -70.65, marca=5, precios={1: 1300, 3: 900}, comuna="Ñuñoa"),
+        {"id": 2, "latitud": "", "longitud": ""},
+        _estacion(3, -33.50, -70.60, marca=118, precios={1: 1200}),
+    ]
+
+    def test_guardar_y_cargar(self, tmp_path):
+        """Test que un snapshot restaurado responde igual que el original"""
+        original = StationSnapshot({"data": self.estaciones}, version=4, body_hash="abc")
+        save_snapshot(original, str(tmp_path))
+        restaurado = load_snapshot(str(tmp_path))
+
+        assert restaurado.version == 4
+        assert restaurado.origin == "disco"
+        assert restaurado.fetched_at == original.fetched_at
+        assert len(restaurado.stations) == 3
+        assert restaurado.stations[0]["comuna"] == "Ñuñoa"
+        assert restaurado.data == {"data": self.estaciones}
+        assert np.array_equal(restaurado.store.ids, original.store.ids)
+        for product in ("93", "diesel"):
+            assert (restaurado.indexes[product].nearest(-33.4, -70.6, 2)
+                    == original.indexes[product].nearest(-33.4, -70.6, 2))
+            claves = restaurado.price_indexes[product].to_arrays()["keys"]
+            assert isinstance(claves, np.memmap)  # mapeado desde disco, no reconstruido
+            assert claves.tolist() == original.price_indexes[product].to_arrays()["keys"].tolist()
+
+        servicio = _servicio_con_estaciones([])
+        servicio.cache.publish(restaurado)
+        assert servicio.search_stations(-33.45, -70.65, "93", cheapest=True)["id"] == "3"
+        assert servicio.snapshot_info()["origen"] == "disco"
+
+    def test_agregados_guardados(self, tmp_path, monkeypatch):
+        """Test que los agregados de un snapshot restaurado salen de los códigos guardados, fuera del event loop"""
+        original = StationSnapshot({"data": self.estaciones}, version=4)
+        save_snapshot(original, str(tmp_path))
+        restaurado = load_snapshot(str(tmp_path))
+        assert not restaurado.aggregates_ready
+
+        servicio = _servicio_con_estaciones([])
+        servicio.cache.publish(restaurado)
+        hilos = []
+        original_to_thread = asyncio.to_thread
+        monkeypatch.setattr(asyncio, "to_thread", lambda *args: hilos.append(args[0]) or original_to_thread(*args))
+        # Sin leer región ni comuna de las estaciones raw
+        monkeypatch.setattr("utils.aggregates._region_comuna", None)
+        for by in ("region", "comuna", "compania"):
+            cuerpo = asyncio.run(servicio.get_aggregates_async(by))
+            assert json.loads(cuerpo) == original.aggregates.groups(by)
+        assert len(hilos) == 1 and restaurado.aggregates_ready
+
+    def test_sin_snapshot(self, tmp_path):
+        """Test que un directorio vacío o dañado no entrega snapshot"""
+        assert load_snapshot(str(tmp_path)) is None
+        (tmp_path / "CURRENT").write_text("snapshot-inexistente")
+        assert load_snapshot(str(tmp_path)) is None
+
+    def test_arranque_con_upstream_caido(self, tmp_path):
+        """Test que el warm-up sirve el snapshot en disco cuando el upstream no responde"""
+        save_snapshot(StationSnapshot({"data": self.estaciones}, version=7), str(tmp_path))
+
+        servicio = FuelService()
+        servicio.snapshot_dir = str(tmp_path)
+        servicio.client = UpstreamClient("http://upstream.test/api", 5,
+                                         async_transport=httpx.MockTransport(lambda request: httpx.Response(503)),
+                                         transport=httpx.MockTransport(lambda request: httpx.Response(503)))
+
+        async def arrancar_y_cerrar():
+            await servicio.warm_up()
+            await servicio.close()
+
+        asyncio.run(arrancar_y_cerrar())
+
+        assert servicio.cache.snapshot.version == 7
+        assert servicio.search_stations(-33.45, -70.65, "93", nearest=True)["id"] == "1"
+
+    def test_conserva_snapshots_recientes(self, tmp_path):
+        """Test que se reemplaza CURRENT y se eliminan snapshots antiguos"""
+        for version in range(1, 5):
+            save_snapshot(StationSnapshot({"data": self.estaciones}, version=version), str(tmp_path))
+        guardados = [p.name for p in tmp_path.iterdir() if p.name.startswith("snapshot-")]
+        assert len(guardados) == 2
+        assert load_snapshot(str(tmp_path)).version == 4
+
+
+class TestSnapshotCompartido:
+    """Tests para el snapshot compartido entre workers"""
+
+    def _worker(self, directorio, respuestas, llamadas):
+        """Servicio que simula un worker de uvicorn sobre un SNAPSHOT_DIR común"""
+        def handler(request):
+            llamadas.append(request.url.path)
+            return httpx.Response(200, json={"data": respuestas[-1]})
+
+        servicio = FuelService()
+        servicio.snapshot_dir = directorio
+        servicio.coordinator = SnapshotCoordinator(directorio)
+        servicio.client = UpstreamClient("http://upstream.test/api", 5,
+                                         transport=httpx.MockTransport(handler),
+                                         async_transport=httpx.MockTransport(handler))
+        servicio.cache.refresh_interval = 0
+        return servicio
+
+    def test_un_solo_refrescador(self, tmp_path):
+        """Test que sólo un worker descarga y los demás leen su snapshot"""
+        respuestas = [[_estacion(1, -33.45, -70.65), _estacion(2, -33.50, -70.60, precios={1: 1200})]]
+        llamadas_a, llamadas_b = [], []
+        worker_a = self._worker(str(tmp_path), respuestas, llamadas_a)
+        worker_b = self._worker(str(tmp_path), respuestas, llamadas_b)
+
+        asyncio.run(worker_a.warm_up())
+        asyncio.run(worker_b.warm_up())
+
+        assert worker_a.snapshot_role == "refrescador"
+        assert worker_b.snapshot_role == "lector"
+        assert len(llamadas_a) == 1 and llamadas_b == []
+        assert worker_b.cache.snapshot.key == worker_a.cache.snapshot.key
+        assert worker_b.snapshot_info()["origen"] == "compartido"
+        assert worker_b.search_stations(-33.45, -70.65, "93", cheapest=True)["id"] == "2"
+
+        # Un snapshot nuevo del refrescador se ve en el lector tras su sondeo
+        respuestas.append([_estacion(1, -33.45, -70.65, precios={1: 1100}), _estacion(2, -33.50, -70.60)])
+        worker_a.cache.refresh()
+        anterior = worker_b.cache.snapshot
+        worker_b.cache.refresh()
+        assert worker_b.cache.snapshot is not anterior
+        assert worker_b.cache.snapshot.version == worker_a.cache.snapshot.version
+        assert worker_b.search_stations(-33.45, -70.65, "93", cheapest=True)["id"] == "1"
+        # Sin cambios publicados el lector conserva el mismo snapshot
+        actual = worker_b.cache.snapshot
+        worker_b.cache.refresh()
+        assert worker_b.cache.snapshot is actual
+        assert llamadas_b == []
+        asyncio.run(worker_b.close())
+        asyncio.run(worker_a.close())
+
+    def test_relevo_del_refrescador(self, tmp_path):
+        """Test que un lector toma el lugar del refrescador cuando éste se detiene"""
+        respuestas = [[_estacion(1, -33.45, -70.65)]]
+        llamadas_a, llamadas_b = [], []
+        worker_a = self._worker(str(tmp_path), respuestas, llamadas_a)
+        worker_b = self._worker(str(tmp_path), respuestas, llamadas_b)
+        asyncio.run(worker_a.warm_up())
+        asyncio.run(worker_b.warm_up())
+
+        asyncio.run(worker_a.close())
+        respuestas.append([_estacion(1, -33.45, -70.65), _estacion(3, -33.46, -70.65)])
+        worker_b.cache.refresh()
+
+        assert worker_b.snapshot_role == "refrescador"
+        assert len(llamadas_b) == 1
+        assert len(worker_b.cache.snapshot.stations) == 2
+        assert load_snapshot(str(tmp_path)).key == worker_b.cache.snapshot.key
+        asyncio.run(worker_b.close())
@@ -2,6 +2,18 @@
 Utilidades para cálculos geográficos
 """
 
-from .distance import calculate_distance
+from .distance import (
+    calculate_distance,
+    haversine_distances,
+    haversine_matrix,
+    equirectangular_distances,
+    nearest_indices
+)
 
-__all__ = ['calculate_distance']
\ No newline at end of file
+__all__ = [
+    'calculate_distance',
+    'haversine_distances',
+    'haversine_matrix',
+    'equirectangular_distances',
+    'nearest_indices'
+]
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Módulo de estadísticas de precios agregadas.
+Calcula mínimo, promedio y máximo por producto agrupando las filas del store
+por región, comuna o compañía con arreglos de códigos de grupo, una vez por
+snapshot. Los códigos y las estadísticas de productos sin cambios se reutilizan
+del snapshot anterior.
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.mappings import PRODUCT_MAPPING, get_company_name
+from utils.station_store import StationStore, StoreDiff
+
+# Región y comuna salen de la estación raw; compañía, de la marca vía COMPANY_MAPPING
+GROUPINGS = ("region", "comuna", "compania")
+
+SIN_DATO = "N/A"
+
+
+class GroupStats:
+    """Estadísticas de un producto por grupo, alineadas con `codes`."""
+
+    __slots__ = ("codes", "minimum", "mean", "maximum", "count")
+
+    def __init__(self, codes: np.ndarray, minimum: np.ndarray, mean: np.ndarray, maximum: np.ndarray,
+                 count: np.ndarray):
+        self.codes = codes
+        self.minimum = minimum
+        self.mean = mean
+        self.maximum = maximum
+        self.count = count
+
+    @classmethod
+    def compute(cls, codes: np.ndarray, orden: np.ndarray, precios: np.ndarray) -> "GroupStats":
+        """
+        Reduce los precios por código de grupo (las filas sin precio no cuentan).
+
+        Args:
+            codes: Código de grupo por fila del store
+            orden: Filas ordenadas por código (`np.argsort(codes)`), compartido entre productos
+            precios: Precio por fila (NaN si la estación no vende el producto)
+
+        Returns:
+            GroupStats con un elemento por grupo que tiene al menos un precio
+        """
+        valores = precios[orden]
+        validos = ~np.isnan(valores)
+        codigos = codes[orden][validos]
+        valores = valores[validos]
+        if not len(codigos):
+            vacio = np.empty(0)
+            return cls(np.empty(0, dtype=np.int32), vacio, vacio, vacio, np.empty(0, dtype=np.intp))
+        inicios = np.flatnonzero(np.r_[True, codigos[1:] != codigos[:-1]])
+        conteo = np.diff(np.r_[inicios, len(codigos)])
+        return cls(codigos[inicios], np.minimum.reduceat(valores, inicios),
+                   np.add.reduceat(valores, inicios) / conteo, np.maximum.reduceat(valores, inicios), conteo)
+
+
+class PriceAggregates:
+    """
+    Estadísticas de precios de un snapshot por agrupación y producto.
+
+    Sólo considera las filas del store (estaciones con coordenadas válidas),
+    igual que las búsquedas.
+    """
+
+    def __init__(self, store: StationStore, estaciones: Sequence[Dict[str, Any]],
+                 previous: Optional["PriceAggregates"] = None, diff: Optional[StoreDiff] = None,
+                 groups: Optional[Dict[str, Tuple[List[str], np.ndarray]]] = None):
+        """
+        Args:
+            store: Store columnar del snapshot
+            estaciones: Estaciones raw del snapshot (para región y comuna)
+            previous: Agregados del snapshot anterior, para reutilizar códigos y estadísticas
+            diff: Diferencias entre el store anterior y este
+            groups: Etiquetas y códigos por agrupación ya calculados (p. ej. guardados con el
+                snapshot); con ellos no se leen las estaciones raw
+        """
+        self.labels: Dict[str, List[str]] = {}
+        self.codes: Dict[str, np.ndarray] = {}
+        self.stations: Dict[str, np.ndarray] = {}
+        self.stats: Dict[Tuple[str, str], GroupStats] = {}
+        cambiados = diff.layout_products | diff.price_products if diff is not None else set(PRODUCT_MAPPING)
+
+        if groups is None:
+            regiones, comunas = _region_comuna(store, estaciones)
+        for by in GROUPINGS:
+            anterior = previous.labels[by] if previous is not None else []
+            if groups is not None:
+                self.labels[by], self.codes[by] = list(groups[by][0]), groups[by][1]
+            elif by == "compania":
+                self.labels[by], self.codes[by] = _encode_brands(store.brand, anterior)
+            else:
+                self.labels[by], self.codes[by] = _encode(regiones if by == "region" else comunas, anterior)
+            self.stations[by] = np.bincount(self.codes[by], minlength=len(self.labels[by]))
+            mismos_grupos = previous is not None and np.array_equal(previous.codes[by], self.codes[by])
+            orden = None
+            for product in PRODUCT_MAPPING:
+                if mismos_grupos and product not in cambiados:
+                    self.stats[(by, product)] = previous.stats[(by, product)]
+                    continue
+                if orden is None:
+                    orden = np.argsort(self.codes[by], kind="stable")
+                self.stats[(by, product)] = GroupStats.compute(self.codes[by], orden, store.prices[product])
+
+    def to_groups(self) -> Dict[str, Tuple[List[str], np.ndarray]]:
+        """Etiquetas y códigos de cada agrupación, para guardarlos con el snapshot."""
+        return {by: (self.labels[by], self.codes[by]) for by in GROUPINGS}
+
+    def groups(self, by: str, product: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Estadísticas por grupo, ordenadas por nombre del grupo.
+
+        Args:
+            by: Agrupación (region, comuna o compania)
+            product: Producto a informar (por defecto todos)
+
+        Returns:
+            Lista de dicts {by, estaciones, precios: {producto: {min, promedio, max, estaciones}}}
+        """
+        labels = self.labels[by]
+        precios: List[Dict[str, Any]] = [{} for _ in labels]
+        for nombre in ([product] if product is not None else PRODUCT_MAPPING):
+            stats = self.stats[(by, nombre)]
+            for code, minimo, promedio, maximo, conteo in zip(stats.codes.tolist(), stats.minimum.tolist(),
+                                                              stats.mean.tolist(), stats.maximum.tolist(),
+                                                              stats.count.tolist()):
+                precios[code][nombre] = {"min": int(minimo), "promedio": round(promedio, 1),
+                                         "max": int(maximo), "estaciones": conteo}
+
+        grupos = []
+        for code in sorted(range(len(labels)), key=labels.__getitem__):
+            estaciones = int(self.stations[by][code])
+            if estaciones and (product is None or precios[code]):
+                grupos.append({by: labels[code], "estaciones": estaciones, "precios": precios[code]})
+        return grupos
+
+
+def _region_comuna(store: StationStore, estaciones: Sequence[Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+    """Región y comuna de cada fila del store, en una sola pasada por las estaciones raw."""
+    regiones, comunas = [], []
+    for posicion in store.source.tolist():
+        estacion = estaciones[posicion]
+        regiones.append(_label(estacion.get('region', estacion.get('Region'))))
+        comunas.append(_label(estacion.get('comuna', estacion.get('Comuna'))))
+    return regiones, comunas
+
+
+def _label(valor: Any) -> str:
+    return str(valor).strip() if valor not in (None, "") else SIN_DATO
+
+
+def _encode_brands(marcas: np.ndarray, anteriores: List[str]) -> Tuple[List[str], np.ndarray]:
+    """Códigos por nombre de compañía: se resuelve una vez por marca distinta y se expande por fila."""
+    unicas, inversa = np.unique(marcas, return_inverse=True)
+    labels, codigos = _encode([get_company_name(int(marca)) for marca in unicas.tolist()], anteriores)
+    return labels, codigos[inversa.reshape(-1)]
+
+
+def _encode(valores: List[str], anteriores: List[str]) -> Tuple[List[str], np.ndarray]:
+    """
+    Códigos enteros por valor. Los valores ya vistos en el snapshot anterior
+    conservan su código, así los arreglos de códigos se pueden comparar entre snapshots.
+    """
+    labels = list(anteriores)
+    codigo_por_valor = {valor: code for code, valor in enumerate(labels)}
+    codes = np.empty(len(valores), dtype=np.int32)
+    for fila, valor in enumerate(valores):
+        code = codigo_por_valor.get(valor)
+        if code is None:
+            code = codigo_por_valor[valor] = len(labels)
+            labels.append(valor)
+        codes[fila] = code
+    return labels, codes
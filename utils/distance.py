@@ -1,18 +1,108 @@
-import math
+import numpy as np
+
+R = 6371.0  # Radio de la Tierra en kilómetros
+
+
+def haversine_distances(lat: float, lon: float, lats, lons) -> np.ndarray:
+    """
+    Calcula en una sola pasada la distancia Haversine (en KM) desde un origen
+    a un arreglo de puntos.
+
+    Args:
+        lat: Latitud de origen
+        lon: Longitud de origen
+        lats: Latitudes de destino (array-like)
+        lons: Longitudes de destino (array-like)
+
+    Returns:
+        np.ndarray con la distancia a cada destino
+    """
+    lat1_rad = np.radians(lat)
+    lat2_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lat2_rad - lat1_rad
+    dlon = np.radians(np.asarray(lons, dtype=np.float64)) - np.radians(lon)
+
+    a = np.sin(dlat/2)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon/2)**2
+    return R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+
+
+def haversine_matrix(origin_lats, origin_lons, lats, lons) -> np.ndarray:
+    """
+    Calcula la matriz de distancias Haversine (en KM) entre muchos orígenes y muchos destinos.
+
+    Args:
+        origin_lats: Latitudes de los orígenes (m)
+        origin_lons: Longitudes de los orígenes (m)
+        lats: Latitudes de destino (n)
+        lons: Longitudes de destino (n)
+
+    Returns:
+        np.ndarray de forma (m, n)
+    """
+    lat1_rad = np.radians(np.asarray(origin_lats, dtype=np.float64))[:, np.newaxis]
+    lon1_rad = np.radians(np.asarray(origin_lons, dtype=np.float64))[:, np.newaxis]
+    lat2_rad = np.radians(np.asarray(lats, dtype=np.float64))[np.newaxis, :]
+    lon2_rad = np.radians(np.asarray(lons, dtype=np.float64))[np.newaxis, :]
+
+    a = np.sin((lat2_rad - lat1_rad)/2)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin((lon2_rad - lon1_rad)/2)**2
+    return R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+
+
+def equirectangular_distances(lat: float, lon: float, lats, lons) -> np.ndarray:
+    """
+    Aproximación equirectangular de la distancia (en KM). Es más barata que
+    Haversine y sirve para preseleccionar candidatos a distancias cortas.
+
+    Args:
+        lat: Latitud de origen
+        lon: Longitud de origen
+        lats: Latitudes de destino (array-like)
+        lons: Longitudes de destino (array-like)
+
+    Returns:
+        np.ndarray con la distancia aproximada a cada destino
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    x = np.radians(np.asarray(lons, dtype=np.float64) - lon) * np.cos(np.radians((lats + lat) / 2))
+    y = np.radians(lats - lat)
+    return R * np.hypot(x, y)
+
+
+def nearest_indices(lat: float, lon: float, lats, lons, k: int,
+                    prefilter: bool = False, tolerance: float = 0.02) -> np.ndarray:
+    """
+    Obtiene las posiciones de los k destinos más cercanos, ordenadas por distancia Haversine.
+
+    Args:
+        lat: Latitud de origen
+        lon: Longitud de origen
+        lats: Latitudes de destino
+        lons: Longitudes de destino
+        k: Cantidad de resultados
+        prefilter: Si preseleccionar candidatos con la aproximación equirectangular
+        tolerance: Margen relativo de la preselección sobre la k-ésima distancia aproximada
+
+    Returns:
+        np.ndarray de posiciones
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    n = len(lats)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    candidatos = np.arange(n)
+    if prefilter and k < n:
+        aproximadas = equirectangular_distances(lat, lon, lats, lons)
+        limite = np.partition(aproximadas, k - 1)[k - 1] * (1 + tolerance)
+        candidatos = np.flatnonzero(aproximadas <= limite)
+
+    distancias = haversine_distances(lat, lon, lats[candidatos], lons[candidatos])
+    orden = np.argsort(distancias, kind="stable")[:k]
+    return candidatos[orden]
+
 
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Calcula distancia entre dos puntos usando fórmula de Haversine (en KM)"""
-    R = 6371.0  # Radio de la Tierra en kilómetros
-    
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
-    
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
-    
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    
-    return R * c
\ No newline at end of file
+    return float(haversine_distances(lat1, lon1, (lat2,), (lon2,))[0])
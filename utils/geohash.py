@@ -0,0 +1,75 @@
+"""
+Módulo de geohash.
+Cuantiza coordenadas en celdas con nombre para agrupar búsquedas cercanas.
+"""
+
+from typing import Tuple
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode_geohash(lat: float, lng: float, precision: int = 7) -> str:
+    """
+    Codifica unas coordenadas como geohash.
+    
+    Args:
+        lat: Latitud
+        lng: Longitud
+        precision: Cantidad de caracteres (7 ≈ celdas de 150 m)
+        
+    Returns:
+        str: Geohash de la celda que contiene el punto
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    
+    while len(geohash) < precision:
+        rango, valor = (lng_range, lng) if even else (lat_range, lat)
+        medio = (rango[0] + rango[1]) / 2
+        if valor >= medio:
+            bits = (bits << 1) | 1
+            rango[0] = medio
+        else:
+            bits <<= 1
+            rango[1] = medio
+        even = not even
+        
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    
+    return "".join(geohash)
+
+
+def decode_geohash_bounds(geohash: str) -> Tuple[float, float, float, float]:
+    """
+    Obtiene los límites de la celda de un geohash.
+    
+    Args:
+        geohash: Geohash de la celda
+        
+    Returns:
+        Tupla (lat_min, lat_max, lng_min, lng_max)
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+    
+    for caracter in geohash:
+        bits = BASE32.index(caracter)
+        for desplazamiento in range(4, -1, -1):
+            rango = lng_range if even else lat_range
+            medio = (rango[0] + rango[1]) / 2
+            if (bits >> desplazamiento) & 1:
+                rango[0] = medio
+            else:
+                rango[1] = medio
+            even = not even
+    
+    return lat_range[0], lat_range[1], lng_range[0], lng_range[1]
@@ -0,0 +1,133 @@
+"""
+Módulo de serialización JSON de respuestas.
+Con FAST_JSON=true y orjson instalado las respuestas se serializan con orjson;
+si no, con el módulo json de la librería estándar. Permite además armar
+cuerpos a partir de fragmentos ya serializados (p. ej. el payload de un snapshot),
+incluso enviándolos por partes desde su buffer sin copiarlos.
+"""
+
+import json
+import os
+from collections.abc import Mapping
+from typing import Any, AsyncIterator, Dict, List, Union
+
+import numpy as np
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from utils.metrics import SERIALIZE_SECONDS
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+
+class RawJSON:
+    """
+    Fragmento JSON ya serializado que se inserta tal cual en `dumps_object`.
+    Puede ser cualquier buffer de bytes (bytes, memoryview de un mmap).
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: Union[bytes, memoryview]):
+        self.data = data
+
+
+def fast_json_enabled() -> bool:
+    """True si FAST_JSON está activado y orjson está disponible."""
+    return orjson is not None and os.getenv("FAST_JSON", "false").lower() in ("1", "true", "yes")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Serializa un valor a JSON UTF-8.
+
+    Args:
+        content: Valor a serializar (acepta escalares y arreglos NumPy)
+
+    Returns:
+        bytes con el JSON compacto
+    """
+    if fast_json_enabled():
+        return orjson.dumps(content, default=_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+                      default=_default).encode("utf-8")
+
+
+def dumps_object(fields: Dict[str, Any]) -> bytes:
+    """
+    Serializa un objeto cuyos valores pueden ser fragmentos RawJSON ya serializados.
+
+    Args:
+        fields: Dict clave -> valor o RawJSON
+
+    Returns:
+        bytes con el objeto JSON
+    """
+    with SERIALIZE_SECONDS.time():
+        return b"".join(_object_parts(fields))
+
+
+def _object_parts(fields: Dict[str, Any]) -> List[Union[bytes, memoryview]]:
+    """Fragmentos del objeto JSON en orden; los RawJSON quedan como su buffer, sin copiar."""
+    partes: List[Union[bytes, memoryview]] = [b"{"]
+    for posicion, (clave, valor) in enumerate(fields.items()):
+        partes.append((b"," if posicion else b"") + dumps(clave) + b":")
+        partes.append(valor.data if isinstance(valor, RawJSON) else dumps(valor))
+    partes.append(b"}")
+    return partes
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse que serializa con `dumps`. Retornarla directamente desde un
+    endpoint evita además el paso por `jsonable_encoder` de FastAPI.
+    """
+
+    def render(self, content: Any) -> bytes:
+        with SERIALIZE_SECONDS.time():
+            return dumps(content)
+
+
+class RawJSONResponse(Response):
+    """Respuesta con un cuerpo JSON ya serializado."""
+
+    media_type = "application/json"
+
+
+class RawJSONStreamResponse(StreamingResponse):
+    """
+    Respuesta con un objeto JSON cuyos fragmentos RawJSON se envían por partes
+    directamente desde su buffer (p. ej. el payload mapeado de un snapshot), así
+    cada worker no arma una copia propia del cuerpo completo.
+    """
+
+    def __init__(self, fields: Dict[str, Any], chunk_size: int = 1 << 16):
+        """
+        Args:
+            fields: Dict clave -> valor o RawJSON
+            chunk_size: Bytes por fragmento enviado
+        """
+        with SERIALIZE_SECONDS.time():
+            partes = [memoryview(parte).cast("B") for parte in _object_parts(fields)]
+        super().__init__(_chunks(partes, chunk_size), media_type="application/json",
+                         headers={"content-length": str(sum(parte.nbytes for parte in partes))})
+
+
+async def _chunks(partes: List[memoryview], chunk_size: int) -> AsyncIterator[bytes]:
+    # Sólo cada fragmento se copia (el servidor ASGI espera bytes), nunca el buffer completo
+    for parte in partes:
+        for inicio in range(0, parte.nbytes, chunk_size):
+            yield parte[inicio:inicio + chunk_size].tobytes()
+
+
+def _default(valor: Any) -> Any:
+    if isinstance(valor, np.generic):
+        return valor.item()
+    if isinstance(valor, np.ndarray):
+        return valor.tolist()
+    if isinstance(valor, Mapping):
+        return dict(valor.items())
+    raise TypeError(f"Tipo no serializable a JSON: {type(valor).__name__}")
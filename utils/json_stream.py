@@ -0,0 +1,145 @@
+"""
+Módulo de parseo JSON incremental.
+Extrae uno a uno los elementos de un arreglo dentro del objeto raíz (p. ej.
+`data` de busqueda_estacion_filtro) a medida que llegan los bytes, sin
+decodificar el cuerpo completo ni armar el árbol entero en memoria.
+"""
+
+import codecs
+import json
+from typing import Any, Callable, List, Optional
+
+_WHITESPACE = " \t\n\r"
+
+
+class JsonArrayStream:
+    """
+    Parser incremental de `{"...": ..., "<key>": [item, item, ...], ...}`.
+
+    Cada elemento del arreglo se decodifica con el decoder en C de `json` en
+    cuanto está completo en el buffer; el resto de las claves del objeto raíz
+    se decodifican y descartan.
+    """
+
+    def __init__(self, key: str = "data", transform: Optional[Callable[[Any], Any]] = None):
+        """
+        Args:
+            key: Clave del objeto raíz cuyo arreglo se quiere recorrer
+            transform: Función aplicada a cada elemento antes de guardarlo
+        """
+        self.key = key
+        self.transform = transform
+        self.items: List[Any] = []
+        self.found = False
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._state = "start"
+        self._current_key: Optional[str] = None
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Agrega bytes del cuerpo y procesa los elementos que ya estén completos.
+
+        Args:
+            chunk: Siguiente fragmento del cuerpo
+        """
+        self._buffer += self._text.decode(chunk)
+        self._parse(final=False)
+
+    def close(self) -> List[Any]:
+        """
+        Termina el parseo.
+
+        Returns:
+            Lista de elementos del arreglo (transformados)
+
+        Raises:
+            ValueError: Si el cuerpo está incompleto o no es JSON válido
+        """
+        self._buffer += self._text.decode(b"", final=True)
+        self._parse(final=True)
+        if self._state != "end":
+            raise ValueError("JSON incompleto")
+        if self._buffer.strip(_WHITESPACE):
+            raise ValueError("Datos extra después del JSON")
+        return self.items
+
+    def _parse(self, final: bool) -> None:
+        buffer = self._buffer
+        pos = 0
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos >= len(buffer) or self._state == "end":
+                break
+            char = buffer[pos]
+
+            if self._state == "start":
+                if char != "{":
+                    raise ValueError("Se esperaba un objeto JSON")
+                self._state = "key"
+                pos += 1
+            elif self._state in ("key", "next_key"):
+                if char == "}":
+                    self._state = "end"
+                    pos += 1
+                elif char == "," and self._state == "next_key":
+                    self._state = "key"
+                    pos += 1
+                else:
+                    valor = self._decode(buffer, pos, final)
+                    if valor is None:
+                        break
+                    self._current_key, pos = valor
+                    self._state = "colon"
+            elif self._state == "colon":
+                if char != ":":
+                    raise ValueError("Se esperaba ':'")
+                pos += 1
+                self._state = "array" if self._current_key == self.key else "value"
+            elif self._state == "value":
+                valor = self._decode(buffer, pos, final)
+                if valor is None:
+                    break
+                pos = valor[1]
+                self._state = "next_key"
+            elif self._state == "array":
+                if char != "[":
+                    raise ValueError(f"'{self.key}' no es un arreglo")
+                self.found = True
+                self._state = "item"
+                pos += 1
+            elif self._state in ("item", "next_item"):
+                if char == "]":
+                    self._state = "next_key"
+                    pos += 1
+                elif char == "," and self._state == "next_item":
+                    self._state = "item"
+                    pos += 1
+                else:
+                    valor = self._decode(buffer, pos, final)
+                    if valor is None:
+                        break
+                    item, pos = valor
+                    self.items.append(self.transform(item) if self.transform else item)
+                    self._state = "next_item"
+        self._buffer = buffer[pos:]
+
+    def _decode(self, buffer: str, pos: int, final: bool):
+        """Decodifica un valor completo o retorna None si faltan bytes."""
+        try:
+            valor, fin = self._decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return None
+        # Un número al final del buffer puede continuar en el siguiente fragmento
+        if fin == len(buffer) and not final:
+            return None
+        return valor, fin
+
+
+def _skip_whitespace(buffer: str, pos: int) -> int:
+    while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+        pos += 1
+    return pos
@@ -1,8 +1,20 @@
 """
 Módulo de mapeos.
 Contiene los mapeos de productos, compañías y tipos de tienda.
+Los mapeos de compañías y tiendas se compilan en tablas indexadas por id de
+marca, y se pueden recargar desde un archivo JSON (MAPPINGS_CONFIG) sin
+desplegar código.
 """
 
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
 # Mapeo de productos de combustible
 PRODUCT_MAPPING = {
     "93": 1,
@@ -127,6 +139,171 @@ COMPANY_MAPPING = {
 # Marcas principales que típicamente tienen tiendas de conveniencia
 BRANDS_WITH_STORES = [5, 4, 3, 88, 2, 151]  # COPEC, SHELL, TERPEL, ENEX, PETROBRAS, ARAMCO
 
+# Reglas de tienda en orden de prioridad: por id de marca o por texto en el nombre de la compañía
+STORE_RULES = [
+    {"marcas": [5], "contiene": "COPEC", "tipo": "Pronto", "nombre": "Pronto"},
+    {"marcas": [4], "contiene": "SHELL", "tipo": "Select", "nombre": "Select"},
+    {"marcas": [3], "contiene": "TERPEL", "tipo": "Tienda Terpel", "nombre": "Tienda Terpel"},
+    {"marcas": [88], "contiene": "ENEX", "tipo": "Tienda ENEX", "nombre": "Tienda ENEX"},
+    {"marcas": [2], "contiene": "PETROBRAS", "tipo": "Tienda Petrobras", "nombre": "Tienda Petrobras"},
+    {"marcas": [], "contiene": "ARAMCO", "tipo": "Select", "nombre": "Select"},
+]
+
+# Para marcas independientes o menores que tienen tienda
+DEFAULT_STORE_TYPE = ("Tienda Local", "Tienda")
+
+# Mayor id de marca que se acepta en las tablas: acota su tamaño (los ids del upstream no pasan de 200)
+MAX_BRAND_ID = 9999
+
+
+class BrandTables:
+    """
+    Mapeos de compañías y tiendas compilados en tablas densas por id de marca.
+
+    Los ids fuera de rango (o que no son enteros) se resuelven con los valores
+    por defecto, igual que un id desconocido. Las tablas no crecen más allá de
+    MAX_BRAND_ID.
+    """
+
+    def __init__(self, companies: Dict[int, str], brands_with_stores: Iterable[int],
+                 store_rules: List[Dict[str, Any]]):
+        """
+        Args:
+            companies: Dict id de marca -> nombre de la compañía
+            brands_with_stores: Ids de marcas con tienda de conveniencia
+            store_rules: Reglas de tipo de tienda en orden de prioridad
+        """
+        self.companies = dict(companies)
+        self.brands_with_stores = frozenset(brands_with_stores)
+        self.store_rules = [dict(regla) for regla in store_rules]
+        # Identifica el contenido de los mapeos (parte de la clave de los snapshots)
+        contenido = json.dumps([{str(k): v for k, v in self.companies.items()},
+                                sorted(map(str, self.brands_with_stores)), self.store_rules], sort_keys=True)
+        self.fingerprint = hashlib.blake2b(contenido.encode(), digest_size=4).hexdigest()
+
+        ids = [company_id for company_id in [*self.companies, *self.brands_with_stores]
+               if type(company_id) is int and 0 <= company_id <= MAX_BRAND_ID]
+        size = max(ids, default=0) + 1
+        self.names: List[Optional[str]] = [None] * size
+        for company_id, nombre in self.companies.items():
+            if self.in_range(company_id):
+                self.names[company_id] = nombre
+        self.has_store = np.zeros(size, dtype=bool)
+        self.has_store[[company_id for company_id in self.brands_with_stores if self.in_range(company_id)]] = True
+        # Tipo y prefijo de nombre de tienda ya resueltos para el nombre canónico de cada marca
+        self.store_types: List[Optional[tuple]] = [
+            self.resolve_store_type(company_id, self.names[company_id]) if self.has_store[company_id] else None
+            for company_id in range(size)
+        ]
+
+    def resolve_store_type(self, company_id: Any, company_name: Optional[str]) -> tuple:
+        """Evalúa las reglas de tienda para una marca y nombre arbitrarios."""
+        for regla in self.store_rules:
+            if company_id in regla.get("marcas", ()):
+                return regla["tipo"], regla["nombre"]
+            if company_name and regla.get("contiene") and regla["contiene"] in company_name:
+                return regla["tipo"], regla["nombre"]
+        return DEFAULT_STORE_TYPE
+
+    def in_range(self, company_id: Any) -> bool:
+        return type(company_id) is int and 0 <= company_id < len(self.names)
+
+    def store_mask(self, brands: np.ndarray) -> np.ndarray:
+        """
+        Marcas con tienda para un arreglo de ids de marca, sin recorrerlo en Python.
+
+        Args:
+            brands: Arreglo de ids de marca
+
+        Returns:
+            Arreglo booleano del mismo largo
+        """
+        brands = np.asarray(brands, dtype=np.int64)
+        validos = (brands >= 0) & (brands < len(self.has_store))
+        mask = np.zeros(len(brands), dtype=bool)
+        mask[validos] = self.has_store[brands[validos]]
+        return mask
+
+
+logger = logging.getLogger(__name__)
+
+_tables = BrandTables(COMPANY_MAPPING, BRANDS_WITH_STORES, STORE_RULES)
+_config_lock = threading.Lock()
+_config_mtime: Optional[float] = None
+
+
+def brand_tables() -> BrandTables:
+    """Tablas de marcas vigentes."""
+    return _tables
+
+
+def load_mappings(path: str) -> BrandTables:
+    """
+    Carga mapeos desde un archivo JSON y los deja vigentes.
+
+    El archivo puede tener `companias` (id -> nombre, se suma a los mapeos por
+    defecto), `marcas_con_tienda` (lista de ids) y `reglas_tienda` (con el formato
+    de STORE_RULES); las secciones ausentes conservan los valores por defecto.
+    Los ids de marca negativos o mayores que MAX_BRAND_ID se descartan con un aviso.
+
+    Args:
+        path: Ruta del archivo JSON
+
+    Returns:
+        BrandTables nuevas
+    """
+    global _tables
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+
+    companias = {**COMPANY_MAPPING, **{int(company_id): nombre
+                                       for company_id, nombre in config.get("companias", {}).items()}}
+    marcas_con_tienda = [int(company_id) for company_id in config.get("marcas_con_tienda", BRANDS_WITH_STORES)]
+    fuera_de_rango = sorted({company_id for company_id in [*companias, *marcas_con_tienda]
+                             if not 0 <= company_id <= MAX_BRAND_ID})
+    if fuera_de_rango:
+        logger.warning("Ids de marca fuera de rango (0-%d) en %s, se ignoran: %s", MAX_BRAND_ID, path, fuera_de_rango)
+        companias = {k: v for k, v in companias.items() if 0 <= k <= MAX_BRAND_ID}
+        marcas_con_tienda = [k for k in marcas_con_tienda if 0 <= k <= MAX_BRAND_ID]
+    tables = BrandTables(companias, marcas_con_tienda, config.get("reglas_tienda", STORE_RULES))
+    _tables = tables
+    return tables
+
+
+def reload_mappings_if_changed(path: Optional[str] = None) -> bool:
+    """
+    Recarga los mapeos si el archivo de configuración cambió desde la última carga.
+
+    Si el archivo no se puede cargar (JSON inválido, ids no enteros, reglas mal
+    formadas) se registra el error y siguen vigentes las tablas actuales; su mtime
+    queda registrado igual, así no se reintenta hasta que el archivo vuelva a cambiar.
+
+    Args:
+        path: Ruta del archivo (por defecto MAPPINGS_CONFIG)
+
+    Returns:
+        bool: True si se cargaron mapeos nuevos
+    """
+    global _config_mtime
+    path = path or os.getenv("MAPPINGS_CONFIG")
+    if not path:
+        return False
+    with _config_lock:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == _config_mtime:
+            return False
+        _config_mtime = mtime
+        try:
+            load_mappings(path)
+        except Exception as e:
+            logger.error("Mapeos inválidos en %s, se mantienen los vigentes: %s", path, e)
+            return False
+        return True
+
+
 def get_product_id(product: str) -> int:
     """
     Obtiene el ID del producto basado en el nombre.
@@ -149,7 +326,10 @@ def get_company_name(company_id: int) -> str:
     Returns:
         str: Nombre de la compañía
     """
-    return COMPANY_MAPPING.get(company_id, f"Compañía {company_id}")
+    tables = _tables
+    if tables.in_range(company_id) and tables.names[company_id] is not None:
+        return tables.names[company_id]
+    return tables.companies.get(company_id, f"Compañía {company_id}")
 
 def has_convenience_store(company_id: int) -> bool:
     """
@@ -161,7 +341,7 @@ def has_convenience_store(company_id: int) -> bool:
     Returns:
         bool: True si típicamente tiene tienda
     """
-    return company_id in BRANDS_WITH_STORES
+    return company_id in _tables.brands_with_stores
 
 def get_store_info(company_id: int, company_name: str, comuna: str, station_id: str) -> dict:
     """
@@ -176,36 +356,19 @@ def get_store_info(company_id: int, company_name: str, comuna: str, station_id:
     Returns:
         dict: Información de la tienda o None si no tiene
     """
-    if not has_convenience_store(company_id):
+    tables = _tables
+    if company_id not in tables.brands_with_stores:
         return None
-        
-    # Mapeo real de tiendas según compañías chilenas
-    if company_id == 5 or (company_name and "COPEC" in company_name):  # COPEC
-        tipo_tienda = "Pronto"
-        nombre_tienda = f"Pronto {comuna}"
-    elif company_id == 4 or (company_name and "SHELL" in company_name):  # SHELL
-        tipo_tienda = "Select"
-        nombre_tienda = f"Select {comuna}"
-    elif company_id == 3 or (company_name and "TERPEL" in company_name):  # TERPEL
-        tipo_tienda = "Tienda Terpel"
-        nombre_tienda = f"Tienda Terpel {comuna}"
-    elif company_id == 88 or (company_name and "ENEX" in company_name):  # ENEX
-        tipo_tienda = "Tienda ENEX"
-        nombre_tienda = f"Tienda ENEX {comuna}"
-    elif company_id == 2 or (company_name and "PETROBRAS" in company_name):  # PETROBRAS
-        tipo_tienda = "Tienda Petrobras"
-        nombre_tienda = f"Tienda Petrobras {comuna}"
-    elif company_name and "ARAMCO" in company_name:  # ARAMCO
-        tipo_tienda = "Select"
-        nombre_tienda = f"Select {comuna}"
+    
+    # Con el nombre canónico de la marca el tipo de tienda ya está en la tabla
+    if tables.in_range(company_id) and company_name == tables.names[company_id]:
+        tipo_tienda, prefijo = tables.store_types[company_id]
     else:
-        # Para marcas independientes o menores que tienen tienda
-        tipo_tienda = "Tienda Local"
-        nombre_tienda = f"Tienda {comuna}"
+        tipo_tienda, prefijo = tables.resolve_store_type(company_id, company_name)
     
     return {
         "codigo": station_id,
-        "nombre": nombre_tienda,
+        "nombre": f"{prefijo} {comuna}",
         "tipo": tipo_tienda
     }
 
@@ -0,0 +1,282 @@
+"""
+Módulo de métricas en formato de texto de Prometheus.
+Histogramas, contadores y gauges en memoria sin dependencias externas: cada
+observación es una búsqueda binaria en los buckets y una suma bajo un lock,
+así la instrumentación puede quedar activa en producción. Con varios workers
+cada proceso expone sus propias métricas.
+"""
+
+import bisect
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Buckets en segundos: de medio milisegundo (búsquedas) a decenas de segundos (descargas)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Metric:
+    """Base común: nombre, descripción, etiquetas y valores por combinación de etiquetas."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """
+        Args:
+            name: Nombre de la métrica (p. ej. `fuel_search_stage_seconds`)
+            documentation: Texto de ayuda (`# HELP`)
+            labelnames: Nombres de las etiquetas; los valores se pasan en el mismo orden
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _labels(self, valores: Tuple[str, ...], extra: str = "") -> str:
+        pares = [f'{nombre}="{_escape(str(valor))}"' for nombre, valor in zip(self.labelnames, valores)]
+        if extra:
+            pares.append(extra)
+        return "{" + ",".join(pares) + "}" if pares else ""
+
+    def _check(self, labels: Tuple[str, ...]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} espera las etiquetas {self.labelnames}")
+        return labels
+
+    def collect(self) -> List[str]:
+        """Líneas de texto de la métrica (HELP, TYPE y muestras)."""
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Contador monótono."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        """Suma `amount` al contador de las etiquetas dadas."""
+        clave = self._check(labels)
+        with self._lock:
+            self._values[clave] = self._values.get(clave, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        """Valor actual del contador."""
+        return self._values.get(self._check(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            valores = sorted(self._values.items())
+        return [f"{self.name}{self._labels(clave)} {_format(valor)}" for clave, valor in valores]
+
+
+class Gauge(_Metric):
+    """Valor que sube y baja; normalmente se actualiza justo antes de exponer las métricas."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: Optional[float], *labels: str) -> None:
+        """Fija el valor (None lo quita de la salida)."""
+        clave = self._check(labels)
+        with self._lock:
+            if value is None:
+                self._values.pop(clave, None)
+            else:
+                self._values[clave] = float(value)
+
+    def value(self, *labels: str) -> Optional[float]:
+        """Valor actual o None si no está definido."""
+        return self._values.get(self._check(labels))
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            valores = sorted(self._values.items())
+        return [f"{self.name}{self._labels(clave)} {_format(valor)}" for clave, valor in valores]
+
+
+class Histogram(_Metric):
+    """Histograma acumulativo con buckets fijos, suma y cantidad de observaciones."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Args:
+            name: Nombre de la métrica
+            documentation: Texto de ayuda
+            labelnames: Nombres de las etiquetas
+            buckets: Límites superiores de los buckets, en orden ascendente
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # etiquetas -> [conteos por bucket (+Inf al final), suma]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        """Registra una observación."""
+        clave = self._check(labels)
+        posicion = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            estado = self._values.get(clave)
+            if estado is None:
+                estado = self._values[clave] = [[0] * (len(self.buckets) + 1), 0.0]
+            estado[0][posicion] += 1
+            estado[1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        """Context manager que observa la duración del bloque."""
+        return _Timer(self, labels)
+
+    def count(self, *labels: str) -> int:
+        """Cantidad de observaciones de las etiquetas dadas."""
+        estado = self._values.get(self._check(labels))
+        return sum(estado[0]) if estado else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            valores = sorted((clave, (list(estado[0]), estado[1])) for clave, estado in self._values.items())
+        lineas = []
+        for clave, (conteos, suma) in valores:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float("inf"),), conteos):
+                acumulado += conteo
+                le = 'le="{}"'.format(_format(limite))
+                lineas.append(f"{self.name}_bucket{self._labels(clave, le)} {acumulado}")
+            lineas.append(f"{self.name}_sum{self._labels(clave)} {_format(suma)}")
+            lineas.append(f"{self.name}_count{self._labels(clave)} {acumulado}")
+        return lineas
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_inicio")
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._histogram.observe(time.perf_counter() - self._inicio, *self._labels)
+
+
+class MetricsRegistry:
+    """Conjunto de métricas que se exponen juntas."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Agrega una métrica y la retorna (para definirla en una sola línea)."""
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Todas las métricas en formato de texto de Prometheus (versión 0.0.4)."""
+        lineas = []
+        for metric in self._metrics:
+            lineas.extend(metric.collect())
+        return "\n".join(lineas) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que observa la latencia de cada solicitud HTTP por ruta
+    (la plantilla de la ruta, no la URL, para acotar las etiquetas).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        estado = {"status": "500"}
+
+        async def send_con_estado(message):
+            if message["type"] == "http.response.start":
+                estado["status"] = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_con_estado)
+        finally:
+            route = scope.get("route")
+            ruta = getattr(route, "path", None) or "sin_ruta"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - inicio, scope["method"], ruta, estado["status"])
+
+
+def _escape(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(valor: float) -> str:
+    if valor != valor:
+        return "NaN"
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if valor != int(valor) else str(int(valor))
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upstream y snapshot
+UPSTREAM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "fuel_upstream_request_seconds",
+    "Duración de las solicitudes al upstream (en streaming incluye la descarga completa)",
+    ("endpoint", "outcome")))
+PARSE_SECONDS = REGISTRY.register(Histogram(
+    "fuel_parse_seconds", "Tiempo de parseo del listado de estaciones"))
+INDEX_BUILD_SECONDS = REGISTRY.register(Histogram(
+    "fuel_index_build_seconds", "Tiempo de construcción del store columnar y los índices por snapshot",
+    ("stage",)))
+UPSTREAM_COALESCED = REGISTRY.register(Counter(
+    "fuel_upstream_coalesced_total", "Llamadas al upstream resueltas con una solicitud ya en curso",
+    ("endpoint",)))
+UPSTREAM_UP = REGISTRY.register(Gauge(
+    "fuel_upstream_up", "1 si la última solicitud al upstream fue exitosa"))
+UPSTREAM_RETRIES = REGISTRY.register(Counter(
+    "fuel_upstream_retries_total", "Reintentos de solicitudes al upstream", ("endpoint",)))
+UPSTREAM_REJECTED = REGISTRY.register(Counter(
+    "fuel_upstream_rejected_total", "Llamadas al upstream rechazadas por el circuit breaker", ("endpoint",)))
+UPSTREAM_CIRCUIT_OPEN = REGISTRY.register(Gauge(
+    "fuel_upstream_circuit_open", "1 si el circuito hacia el upstream está abierto o semiabierto"))
+UPSTREAM_READ_TIMEOUT_SECONDS = REGISTRY.register(Gauge(
+    "fuel_upstream_read_timeout_seconds", "Timeout de lectura adaptativo vigente", ("endpoint",)))
+SNAPSHOT_REFRESHES = REGISTRY.register(Counter(
+    "fuel_snapshot_refreshes_total", "Refrescos del snapshot de estaciones por resultado", ("result",)))
+SNAPSHOT_AGE_SECONDS = REGISTRY.register(Gauge(
+    "fuel_snapshot_age_seconds", "Antigüedad del snapshot de estaciones servido"))
+SNAPSHOT_VERSION = REGISTRY.register(Gauge(
+    "fuel_snapshot_version", "Versión del snapshot de estaciones servido"))
+SNAPSHOT_STATIONS = REGISTRY.register(Gauge(
+    "fuel_snapshot_stations", "Estaciones en el snapshot servido"))
+
+# Búsquedas y respuestas
+SEARCH_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "fuel_search_stage_seconds", "Latencia de cada etapa de una búsqueda", ("stage",)))
+SERIALIZE_SECONDS = REGISTRY.register(Histogram(
+    "fuel_serialize_seconds", "Tiempo de serialización JSON de las respuestas"))
+CACHE_HIT_RATIO = REGISTRY.register(Gauge(
+    "fuel_cache_hit_ratio", "Proporción de aciertos de cada caché", ("cache",)))
+CACHE_ENTRIES = REGISTRY.register(Gauge(
+    "fuel_cache_entries", "Entradas de cada caché", ("cache",)))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "fuel_http_request_seconds", "Latencia de las solicitudes HTTP a la API", ("method", "route", "status")))
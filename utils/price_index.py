@@ -0,0 +1,156 @@
+"""
+Módulo de índice de precios.
+Mantiene por producto las filas del store ordenadas por (precio, fila), así
+la búsqueda de las k estaciones más baratas del país es un corte de arreglo.
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.mappings import PRODUCT_MAPPING
+
+# La clave combinada es precio << ROW_BITS | fila: ordenar por ella equivale a ordenar
+# por precio y desempatar por fila, como un ordenamiento estable
+ROW_BITS = 32
+MAX_PRICE = 2 ** (63 - ROW_BITS) - 1
+
+
+class PriceIndex:
+    """
+    Filas de un producto ordenadas por precio, con una variante sólo con tienda.
+
+    Es inmutable: `updated()` retorna un índice nuevo, así el snapshot anterior
+    puede seguir respondiendo con el suyo. Sus dos arreglos se guardan con el
+    snapshot y se pueden mapear desde disco.
+    """
+
+    def __init__(self, keys: np.ndarray, store_keys: np.ndarray):
+        """
+        Args:
+            keys: Claves combinadas ordenadas de todas las filas con precio
+            store_keys: Claves combinadas ordenadas de las filas con tienda
+        """
+        self._keys = keys
+        self._store_keys = store_keys
+
+    @classmethod
+    def build(cls, store, product: str) -> Optional["PriceIndex"]:
+        """
+        Construye el índice de un producto.
+
+        Args:
+            store: StationStore del snapshot
+            product: Producto normalizado
+
+        Returns:
+            PriceIndex o None si algún precio no cabe en la clave combinada
+        """
+        filas = np.flatnonzero(store.product_mask(product))
+        keys = _keys(store.prices[product][filas], filas)
+        if keys is None:
+            return None
+        keys.sort()
+        return cls(keys, keys[store.has_store[_rows(keys)]])
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "PriceIndex":
+        """
+        Reconstruye un índice desde los arreglos de `to_arrays()` (pueden ser mapeados desde disco).
+
+        Args:
+            arrays: Dict nombre -> arreglo
+
+        Returns:
+            PriceIndex
+        """
+        return cls(arrays["keys"], arrays["store_keys"])
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Arreglos que describen completamente el índice."""
+        return {"keys": self._keys, "store_keys": self._store_keys}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def cheapest(self, k: int, store_required: bool = False) -> List[int]:
+        """
+        Las k filas más baratas, ordenadas por precio ascendente.
+
+        Args:
+            k: Cantidad de filas
+            store_required: Si se requiere tienda
+
+        Returns:
+            Lista de filas del store
+        """
+        keys = self._store_keys if store_required else self._keys
+        return _rows(keys[:max(k, 0)]).tolist()
+
+    def updated(self, previous_store, store, product: str) -> Optional["PriceIndex"]:
+        """
+        Índice para un store nuevo con las mismas filas del producto y sólo precios distintos:
+        se quitan y reinsertan las filas cuyo precio cambió, sin volver a ordenar.
+
+        Args:
+            previous_store: Store con el que se construyó este índice
+            store: Store nuevo
+            product: Producto normalizado
+
+        Returns:
+            PriceIndex nuevo o None si no se puede actualizar (hay que reconstruir)
+        """
+        filas = np.flatnonzero(store.product_mask(product))
+        cambiadas = filas[previous_store.prices[product][filas] != store.prices[product][filas]]
+        if not len(cambiadas):
+            return self
+        nuevas = _keys(store.prices[product][cambiadas], cambiadas)
+        if nuevas is None:
+            return None
+        nuevas.sort()
+
+        def reemplazar(keys: np.ndarray, insertar: np.ndarray) -> np.ndarray:
+            restantes = keys[~np.isin(_rows(keys), cambiadas)]
+            return np.insert(restantes, np.searchsorted(restantes, insertar), insertar)
+
+        return PriceIndex(reemplazar(self._keys, nuevas),
+                          reemplazar(self._store_keys, nuevas[store.has_store[_rows(nuevas)]]))
+
+
+def build_price_indexes(store, previous_indexes: Optional[Dict[str, PriceIndex]] = None,
+                        previous_store=None, diff=None) -> Dict[str, Optional[PriceIndex]]:
+    """
+    Construye (o actualiza desde el snapshot anterior) el índice de precios de cada producto.
+
+    Args:
+        store: StationStore del snapshot
+        previous_indexes: Índices de precios del snapshot anterior (opcional)
+        previous_store: Store del snapshot anterior
+        diff: StoreDiff respecto del snapshot anterior
+
+    Returns:
+        Dict producto -> PriceIndex (None si el producto tiene precios fuera de rango)
+    """
+    indices = {}
+    for product in PRODUCT_MAPPING:
+        anterior = previous_indexes.get(product) if previous_indexes is not None and diff is not None else None
+        if anterior is not None and product not in diff.layout_products:
+            if product not in diff.price_products:
+                indices[product] = anterior
+                continue
+            actualizado = anterior.updated(previous_store, store, product)
+            if actualizado is not None:
+                indices[product] = actualizado
+                continue
+        indices[product] = PriceIndex.build(store, product)
+    return indices
+
+
+def _keys(precios: np.ndarray, filas: np.ndarray) -> Optional[np.ndarray]:
+    if len(precios) and (precios.min() < 0 or precios.max() > MAX_PRICE):
+        return None
+    return (precios.astype(np.int64) << ROW_BITS) | filas.astype(np.int64)
+
+
+def _rows(keys: np.ndarray) -> np.ndarray:
+    return keys & ((1 << ROW_BITS) - 1)
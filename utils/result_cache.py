@@ -0,0 +1,119 @@
+"""
+Módulo de caché de resultados de búsqueda.
+LRU con TTL que se invalida completa cuando cambia la versión del snapshot.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class ResultCache:
+    """Caché LRU/TTL con contadores de aciertos, fallos y desalojos."""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0):
+        """
+        Args:
+            maxsize: Máximo de entradas (0 desactiva la caché)
+            ttl: Segundos de vida de cada entrada
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._version: Optional[int] = None
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, version: int) -> Optional[Any]:
+        """
+        Busca una entrada vigente para la versión de snapshot dada.
+
+        Args:
+            key: Clave de la búsqueda
+            version: Versión del snapshot con el que se respondería
+
+        Returns:
+            Valor cacheado o None
+        """
+        with self._lock:
+            entry = self._entries.get(key) if self._sync_version(version) else None
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any, version: int) -> None:
+        """Guarda un valor calculado con la versión de snapshot dada."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if not self._sync_version(version):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    @property
+    def version(self) -> Optional[int]:
+        """Versión de snapshot a la que corresponden las entradas."""
+        return self._version
+
+    def invalidate(self, version: int, predicate: Optional[Callable[[Hashable], bool]] = None) -> None:
+        """
+        Avanza a una versión nueva de snapshot descartando sólo las entradas afectadas.
+
+        Args:
+            version: Versión del snapshot nuevo
+            predicate: Función que indica si una clave quedó obsoleta (None = todas)
+        """
+        with self._lock:
+            if self._version is not None and version <= self._version:
+                return
+            if predicate is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if predicate(key)]:
+                    del self._entries[key]
+            self._version = version
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        """Descarta todas las entradas."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de la caché."""
+        total = self.hits + self.misses
+        return {
+            "entradas": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidaciones": self.invalidations,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0
+        }
+
+    def _sync_version(self, version: int) -> bool:
+        """Avanza a una versión nueva descartando todo; False si la versión es anterior a la vigente."""
+        if self._version is not None and version < self._version:
+            return False
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+        return True
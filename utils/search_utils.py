@@ -3,9 +3,94 @@ Módulo de utilidades para la lógica de búsqueda de estaciones.
 Contiene funciones para procesar y filtrar estaciones de combustible.
 """
 
-from typing import List, Dict, Any, Optional
-from utils.distance import calculate_distance
-from utils.mappings import get_company_name, has_convenience_store, get_store_info
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from utils.distance import calculate_distance, haversine_distances, nearest_indices
+from utils.mappings import get_company_name, has_convenience_store, get_store_info, PRODUCT_MAPPING
+from utils.spatial_index import GridIndex
+
+# Campos de una estación raw que usan las búsquedas
+STATION_FIELDS = ('id', 'marca', 'direccion', 'Direccion', 'comuna', 'Comuna',
+                  'region', 'Region', 'latitud', 'longitud')
+
+# Mínimo de estaciones cercanas entre las que `nearest&cheapest` elige las más baratas
+NEAREST_CHEAPEST_POOL = 15
+
+
+def nearest_pool_size(limit: Optional[int]) -> int:
+    """
+    Cantidad de estaciones cercanas entre las que `nearest&cheapest` elige las más baratas:
+    las 15 más cercanas, o `limit` si es mayor. No depende de `offset`, así todas las
+    páginas de una misma búsqueda se cortan del mismo grupo, sin repetir ni saltar estaciones.
+    
+    Args:
+        limit: Tamaño de página (None = una sola estación)
+        
+    Returns:
+        int: Tamaño del grupo de cercanas
+    """
+    return max(NEAREST_CHEAPEST_POOL, limit or 1)
+
+
+def compact_station(estacion: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reduce una estación raw a los campos que usan `process_station_data` y el store.
+    
+    Args:
+        estacion: Datos raw de la estación
+        
+    Returns:
+        Dict con los campos de búsqueda y combustibles con sólo id y precio
+    """
+    compacta = {campo: estacion[campo] for campo in STATION_FIELDS if campo in estacion}
+    compacta['combustibles'] = [
+        {'id': combustible.get('id'), 'precio': combustible.get('precio')}
+        for combustible in estacion.get('combustibles', [])
+    ]
+    return compacta
+
+
+def extract_coordinates(estacion: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    """
+    Obtiene las coordenadas numéricas de una estación.
+    
+    Args:
+        estacion: Datos raw de la estación
+        
+    Returns:
+        Tupla (latitud, longitud) o None si faltan o no son válidas
+    """
+    est_lat_str = estacion.get('latitud')
+    est_lng_str = estacion.get('longitud')
+    if not est_lat_str or not est_lng_str:
+        return None
+    
+    try:
+        return float(est_lat_str), float(est_lng_str)
+    except (ValueError, TypeError):
+        return None
+
+
+def extract_product_price(estacion: Dict[str, Any], id_producto: int) -> Optional[int]:
+    """
+    Obtiene el precio de un producto en una estación.
+    
+    Args:
+        estacion: Datos raw de la estación
+        id_producto: ID del producto
+        
+    Returns:
+        Precio entero o None si la estación no lo vende
+    """
+    for combustible in estacion.get('combustibles', []):
+        if combustible.get('id') == id_producto:
+            precio_str = combustible.get('precio')
+            if precio_str is not None:
+                try:
+                    return int(float(precio_str))
+                except (ValueError, TypeError):
+                    continue
+    return None
 
 
 def process_station_data(estacion: Dict[str, Any], lat: float, lng: float, 
@@ -24,39 +109,18 @@ def process_station_data(estacion: Dict[str, Any], lat: float, lng: float,
         Dict con datos procesados de la estación o None si no es válida
     """
     # Validar coordenadas
-    if not estacion.get('latitud') or not estacion.get('longitud'):
+    coordenadas = extract_coordinates(estacion)
+    if coordenadas is None:
         return None
         
     # Buscar el combustible específico
-    combustibles = estacion.get('combustibles', [])
-    precio_producto = None
-    
-    for combustible in combustibles:
-        if combustible.get('id') == id_producto:
-            precio_str = combustible.get('precio')
-            if precio_str is not None:
-                try:
-                    precio_producto = int(float(precio_str))
-                    break
-                except (ValueError, TypeError):
-                    continue
-    
+    precio_producto = extract_product_price(estacion, id_producto)
     if precio_producto is None:
         return None
     
     # Calcular distancia
-    try:
-        est_lat_str = estacion.get('latitud')
-        est_lng_str = estacion.get('longitud')
-        
-        if est_lat_str is None or est_lng_str is None:
-            return None
-            
-        est_lat = float(est_lat_str)
-        est_lng = float(est_lng_str)
-        distancia = calculate_distance(lat, lng, est_lat, est_lng)
-    except (ValueError, TypeError):
-        return None
+    est_lat, est_lng = coordenadas
+    distancia = calculate_distance(lat, lng, est_lat, est_lng)
     
     # Información de compañía y tienda
     id_compania = estacion.get('marca', 0)
@@ -149,6 +213,299 @@ def apply_search_logic(estaciones: List[Dict[str, Any]], product: str,
     return None
 
 
+def build_product_indexes(store, previous_indexes: Optional[Dict[str, GridIndex]] = None,
+                          diff=None) -> Dict[str, GridIndex]:
+    """
+    Construye un índice espacial por producto con las estaciones que lo venden.
+    
+    Args:
+        store: StationStore del snapshot
+        previous_indexes: Índices del snapshot anterior (opcional)
+        diff: StoreDiff respecto del snapshot anterior; los productos fuera de
+              `diff.layout_products` reutilizan su índice previo
+        
+    Returns:
+        Dict producto -> GridIndex cuyos ids son filas del store
+    """
+    indices = {}
+    for product in PRODUCT_MAPPING:
+        if previous_indexes is not None and diff is not None and product not in diff.layout_products:
+            indices[product] = previous_indexes[product]
+            continue
+        filas = np.flatnonzero(store.product_mask(product))
+        indices[product] = GridIndex(store.lat[filas], store.lng[filas], filas)
+    return indices
+
+
+def find_nearest_rows(indice: GridIndex, store, lat: float, lng: float, k: int,
+                      store_required: bool, radius_km: Optional[float] = None) -> List[int]:
+    """
+    Obtiene las k filas más cercanas que venden el producto usando el índice espacial.
+    
+    Args:
+        indice: Índice espacial del producto
+        store: StationStore del snapshot
+        lat: Latitud de búsqueda
+        lng: Longitud de búsqueda
+        k: Cantidad máxima de estaciones
+        store_required: Si se requiere tienda
+        radius_km: Radio máximo de búsqueda en km (None = sin límite)
+        
+    Returns:
+        Lista de filas del store ordenadas por distancia
+    """
+    predicado = None
+    if store_required:
+        predicado = lambda filas: store.has_store[filas]
+    
+    return [fila for _, fila in indice.nearest(lat, lng, k, predicado, max_distance=radius_km)]
+
+
+def build_cost_table(indice: GridIndex, store, product: str,
+                     store_required: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Precios alineados con los puntos del índice espacial y su mínimo por celda,
+    para las búsquedas por costo.
+    
+    Args:
+        indice: Índice espacial del producto
+        store: StationStore del snapshot
+        product: Producto normalizado
+        store_required: Si se requiere tienda (las demás estaciones quedan en inf)
+        
+    Returns:
+        Tupla (precios por punto, mínimo por celda)
+    """
+    filas = indice.to_arrays()["ids"]
+    precios = store.prices[product][filas].astype(np.float64)
+    if store_required:
+        precios = np.where(store.has_store[filas], precios, np.inf)
+    precios = np.where(np.isnan(precios), np.inf, precios)
+    return precios, indice.cell_minimums(precios)
+
+
+def find_best_cost_rows(indice: GridIndex, cost_table: Tuple[np.ndarray, np.ndarray], lat: float,
+                        lng: float, k: int, alpha: float, radius_km: Optional[float] = None) -> List[int]:
+    """
+    Obtiene las k filas de menor costo `precio + alpha * distancia_km` usando el índice espacial.
+    
+    Args:
+        indice: Índice espacial del producto
+        cost_table: Resultado de `build_cost_table`
+        lat: Latitud de búsqueda
+        lng: Longitud de búsqueda
+        k: Cantidad máxima de estaciones
+        alpha: Peso de cada km de distancia (0 = la más barata dentro del radio)
+        radius_km: Radio máximo de búsqueda en km (None = sin límite)
+        
+    Returns:
+        Lista de filas del store ordenadas por costo
+    """
+    precios, minimos = cost_table
+    return [fila for _, _, fila in indice.best_by_cost(lat, lng, k, precios, minimos, alpha, radius_km)]
+
+
+def select_search_rows(indice: GridIndex, store, lat: float, lng: float, product: str,
+                       nearest: bool, store_required: bool, cheapest: bool, k: int,
+                       radius_km: Optional[float] = None, price_index=None, alpha: Optional[float] = None,
+                       cost_table: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                       pool: Optional[int] = None) -> List[int]:
+    """
+    Selecciona las k primeras filas según los 4 casos de búsqueda, sin ordenar todas las estaciones.
+    
+    Args:
+        indice: Índice espacial del producto
+        store: StationStore del snapshot
+        lat: Latitud de búsqueda
+        lng: Longitud de búsqueda
+        product: Producto normalizado
+        nearest: Si buscar las más cercanas
+        store_required: Si se requiere tienda
+        cheapest: Si buscar las más baratas
+        k: Cantidad de filas a devolver
+        radius_km: Radio máximo de búsqueda en km (None = sin límite)
+        price_index: PriceIndex del producto para el caso más barato del país (opcional)
+        alpha: Si se indica, ordena por costo `precio + alpha * distancia_km`
+        cost_table: Resultado de `build_cost_table` (se calcula si falta)
+        pool: Cercanas entre las que `nearest&cheapest` elige (por defecto `nearest_pool_size(k)`)
+        
+    Returns:
+        Lista de filas del store en el orden de la respuesta
+    """
+    precios = store.prices[product]
+    
+    if alpha is not None or (cheapest and not nearest and radius_km is not None):
+        # Costo combinado, o la más barata dentro del radio (alpha = 0), por ramificación y poda
+        if cost_table is None:
+            cost_table = build_cost_table(indice, store, product, store_required)
+        return find_best_cost_rows(indice, cost_table, lat, lng, k, alpha or 0.0, radius_km)
+    elif nearest and cheapest:
+        # Caso 4: entre las más cercanas (al menos 15), las más baratas
+        pool = pool if pool is not None else nearest_pool_size(k)
+        cercanas = find_nearest_rows(indice, store, lat, lng, pool, store_required, radius_km)
+        return sorted(cercanas, key=lambda fila: precios[fila])[:k]
+    elif cheapest:
+        # Caso 2: menor precio en todo el país
+        if price_index is not None:
+            return price_index.cheapest(k, store_required)
+        return store.cheapest_rows(product, k, store_required)
+    else:
+        # Caso 1 (y sin criterios): más cercanas
+        return find_nearest_rows(indice, store, lat, lng, k, store_required, radius_km)
+
+
+def depends_on_origin(nearest: bool, cheapest: bool, radius_km: Optional[float] = None,
+                      alpha: Optional[float] = None) -> bool:
+    """
+    Indica si el resultado de una búsqueda depende del origen exacto.
+    
+    Sólo "la más barata del país" (sin cercanía, radio ni costo) no depende de él.
+    """
+    return nearest or not cheapest or radius_km is not None or alpha is not None
+
+
+def cell_center_radius(bounds: Tuple[float, float, float, float]) -> Tuple[float, float, float]:
+    """
+    Centro de una celda lat/lng y una cota de la distancia del centro a cualquier punto de ella.
+    
+    Args:
+        bounds: Tupla (lat_min, lat_max, lng_min, lng_max)
+        
+    Returns:
+        Tupla (lat_centro, lng_centro, radio_km)
+    """
+    lat_min, lat_max, lng_min, lng_max = bounds
+    lat, lng = (lat_min + lat_max) / 2, (lng_min + lng_max) / 2
+    esquinas = haversine_distances(lat, lng, (lat_min, lat_min, lat_max, lat_max), (lng_min, lng_max, lng_min, lng_max))
+    # Margen para redondeos: la cota sólo tiene que no quedarse corta
+    return lat, lng, float(esquinas.max()) * 1.01 + 1e-6
+
+
+def select_candidate_rows(indice: GridIndex, store, bounds: Tuple[float, float, float, float], product: str,
+                          nearest: bool, store_required: bool, cheapest: bool, k: int,
+                          radius_km: Optional[float] = None, price_index=None, alpha: Optional[float] = None,
+                          cost_table: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                          pool: Optional[int] = None) -> np.ndarray:
+    """
+    Filas candidatas válidas para cualquier origen dentro de una celda.
+    
+    Con el centro C de la celda y la cota r de la distancia de C a cualquier punto
+    de ella, la distancia real a cada estación difiere de la distancia a C en a lo
+    más r. Por eso basta con ampliar los umbrales de la búsqueda hecha desde C:
+    
+    - cercanía: estaciones a no más de d_k(C) + 2r de C (y a radius_km + r)
+    - costo: estaciones de costo desde C de no más de c_k + 2 * alpha * r, donde c_k es el
+      k-ésimo costo entre las que quedan dentro del radio desde cualquier punto de la celda
+    
+    `rank_candidate_rows` ordena luego las candidatas con el origen exacto. Sin depender
+    del origen (la más barata del país) las candidatas ya son la respuesta.
+    
+    Args:
+        indice: Índice espacial del producto
+        store: StationStore del snapshot
+        bounds: Límites de la celda (lat_min, lat_max, lng_min, lng_max)
+        product: Producto normalizado
+        nearest: Si buscar las más cercanas
+        store_required: Si se requiere tienda
+        cheapest: Si buscar las más baratas
+        k: Cantidad de filas de la respuesta
+        radius_km: Radio máximo de búsqueda en km (None = sin límite)
+        price_index: PriceIndex del producto (opcional)
+        alpha: Peso por km de la búsqueda por costo
+        cost_table: Resultado de `build_cost_table` (se calcula si falta)
+        pool: Cercanas entre las que `nearest&cheapest` elige (por defecto `nearest_pool_size(k)`)
+        
+    Returns:
+        np.ndarray con las filas candidatas
+    """
+    if not depends_on_origin(nearest, cheapest, radius_km, alpha):
+        return np.asarray(select_search_rows(indice, store, 0.0, 0.0, product, nearest, store_required,
+                                             cheapest, k, radius_km, price_index), dtype=np.int64)
+    
+    lat, lng, r = cell_center_radius(bounds)
+    if alpha is not None or (cheapest and not nearest and radius_km is not None):
+        if cost_table is None:
+            cost_table = build_cost_table(indice, store, product, store_required)
+        precios, minimos = cost_table
+        alpha = alpha or 0.0
+        # Las k mejores entre las que quedan dentro del radio desde cualquier punto de la celda
+        primeras = []
+        if radius_km is None or radius_km > r:
+            primeras = indice.best_by_cost(lat, lng, k, precios, minimos, alpha,
+                                           radius_km - r if radius_km is not None else None)
+        tope = primeras[-1][0] + 2 * alpha * r if len(primeras) == k else None
+        candidatas = indice.best_by_cost(lat, lng, len(indice), precios, minimos, alpha,
+                                         radius_km + r if radius_km is not None else None, tope)
+        return np.array([fila for _, _, fila in candidatas], dtype=np.int64)
+    
+    # Cercanía: el resultado para el origen exacto son sus m más cercanas filtradas por radio
+    m = (pool if pool is not None else nearest_pool_size(k)) if cheapest else k
+    predicado = (lambda filas: store.has_store[filas]) if store_required else None
+    limite = radius_km + r if radius_km is not None else None
+    primeras = indice.nearest(lat, lng, m, predicado, max_distance=limite)
+    if len(primeras) == m:
+        limite = min(primeras[-1][0] + 2 * r, limite if limite is not None else np.inf)
+        primeras = indice.within(lat, lng, limite, predicado)
+    return np.array([fila for _, fila in primeras], dtype=np.int64)
+
+
+def rank_candidate_rows(store, filas: np.ndarray, lat: float, lng: float, product: str, nearest: bool,
+                        cheapest: bool, k: int, radius_km: Optional[float] = None,
+                        alpha: Optional[float] = None, distances: Optional[np.ndarray] = None,
+                        pool: Optional[int] = None) -> List[int]:
+    """
+    Ordena las filas de `select_candidate_rows` para el origen exacto, con los mismos
+    criterios que `select_search_rows`.
+    
+    En las búsquedas por cercanía sin distancias dadas, las candidatas se preseleccionan
+    con la aproximación equirectangular y sólo las más cercanas se miden con Haversine.
+    
+    Args:
+        store: StationStore del snapshot
+        filas: Filas candidatas
+        lat: Latitud de búsqueda
+        lng: Longitud de búsqueda
+        product: Producto normalizado
+        nearest: Si buscar las más cercanas
+        cheapest: Si buscar las más baratas
+        k: Cantidad de filas a devolver
+        radius_km: Radio máximo de búsqueda en km (None = sin límite)
+        alpha: Peso por km de la búsqueda por costo
+        distances: Distancias del origen a cada candidata (p. ej. una fila de `haversine_matrix`);
+                   se calculan si faltan
+        pool: Cercanas entre las que `nearest&cheapest` elige (por defecto `nearest_pool_size(k)`)
+        
+    Returns:
+        Lista de filas del store en el orden de la respuesta
+    """
+    if not depends_on_origin(nearest, cheapest, radius_km, alpha):
+        return filas[:k].tolist()
+    
+    por_costo = alpha is not None or (cheapest and not nearest and radius_km is not None)
+    m = (pool if pool is not None else nearest_pool_size(k)) if cheapest else k
+    if distances is None and not por_costo and len(filas) > m:
+        # Las m más cercanas dentro del radio están entre las m más cercanas sin radio;
+        # con las filas en orden ascendente los empates se resuelven por fila
+        filas = np.sort(filas)
+        filas = filas[nearest_indices(lat, lng, store.lat[filas], store.lng[filas], m, prefilter=True)]
+    distancias = distances if distances is not None else haversine_distances(lat, lng, store.lat[filas],
+                                                                              store.lng[filas])
+    if radius_km is not None:
+        dentro = distancias <= radius_km
+        filas, distancias = filas[dentro], distancias[dentro]
+    precios = store.prices[product][filas]
+    
+    if por_costo:
+        # Empates por distancia y luego por fila, como `GridIndex.best_by_cost`
+        orden = np.lexsort((filas, distancias, precios + (alpha or 0.0) * distancias))
+        return filas[orden[:k]].tolist()
+    
+    orden = np.lexsort((filas, distancias))[:m]
+    if cheapest:
+        orden = orden[np.argsort(precios[orden], kind="stable")[:k]]
+    return filas[orden].tolist()
+
+
 def build_error_response(message: str) -> Dict[str, str]:
     """
     Construye una respuesta de error estándar.
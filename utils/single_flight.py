@@ -0,0 +1,107 @@
+"""
+Módulo de coalescencia de llamadas (single-flight).
+Las llamadas concurrentes con la misma clave comparten una sola ejecución y su
+resultado (o su excepción), sean de hilos del pool o de corrutinas asyncio.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+
+class SingleFlight:
+    """
+    Registro de llamadas en curso por clave.
+
+    La primera llamada (líder) ejecuta la función; las que llegan mientras tanto
+    esperan su resultado. Hilos y corrutinas comparten el mismo registro, así una
+    corrutina puede esperar una descarga iniciada por un hilo y viceversa. El
+    resultado se comparte tal cual: los llamadores no deben modificarlo.
+
+    Un llamador síncrono no debe esperar desde el hilo del event loop una llamada
+    cuya líder es una corrutina de ese mismo loop.
+    """
+
+    def __init__(self, on_shared: Optional[Callable[[Hashable], None]] = None):
+        """
+        Args:
+            on_shared: Función que se llama con la clave cada vez que un llamador
+                reutiliza una llamada en curso (p. ej. para métricas)
+        """
+        self._calls: Dict[Hashable, Future] = {}
+        self._tasks: Set[asyncio.Task] = set()  # referencias fuertes a las corrutinas líderes
+        self._lock = threading.Lock()
+        self._on_shared = on_shared
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Ejecuta `fn` salvo que ya haya una llamada en curso con la misma clave.
+
+        Args:
+            key: Clave de la llamada
+            fn: Función a ejecutar
+
+        Returns:
+            Resultado de `fn` (propio o compartido)
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            self._forget(key, future)
+        return future.result()
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Versión asíncrona de `do()`: `fn` retorna una corrutina.
+
+        Si el líder se cancela, la llamada sigue en curso para quienes la esperan.
+
+        Args:
+            key: Clave de la llamada
+            fn: Función que retorna la corrutina a ejecutar
+
+        Returns:
+            Resultado de la corrutina (propio o compartido)
+        """
+        future, leader = self._join(key)
+        if leader:
+            tarea = asyncio.ensure_future(fn())
+            self._tasks.add(tarea)
+            tarea.add_done_callback(lambda t: self._resolve(key, future, t))
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def inflight(self) -> int:
+        """Cantidad de llamadas en curso."""
+        return len(self._calls)
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                if self._on_shared is not None:
+                    self._on_shared(key)
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _resolve(self, key: Hashable, future: Future, tarea: asyncio.Task) -> None:
+        self._tasks.discard(tarea)
+        if tarea.cancelled():
+            # Los demás llamadores reciben un error común, no la cancelación de otro
+            future.set_exception(RuntimeError("La llamada compartida fue cancelada"))
+        elif tarea.exception() is not None:
+            future.set_exception(tarea.exception())
+        else:
+            future.set_result(tarea.result())
+        self._forget(key, future)
+
+    def _forget(self, key: Hashable, future: Future) -> None:
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
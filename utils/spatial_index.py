@@ -0,0 +1,291 @@
+"""
+Módulo de índice espacial.
+Grilla lat/lng para responder consultas de las k estaciones más cercanas
+sin recorrer todas las estaciones del país.
+"""
+
+import heapq
+import math
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.distance import R, haversine_distances
+
+
+class GridIndex:
+    """
+    Índice de grilla regular en grados.
+
+    Los puntos se ordenan por celda (formato CSR: `order` + límites por celda),
+    así el índice completo son unos pocos arreglos que se pueden guardar y
+    mapear desde disco. Las consultas usan esos arreglos directamente (sin
+    copiarlos a listas de Python): recorren anillos de celdas alrededor del
+    origen y se detienen cuando la cota inferior de distancia del siguiente
+    anillo supera al k-ésimo mejor.
+    """
+
+    def __init__(self, lats: Sequence[float], lngs: Sequence[float],
+                 ids: Optional[Sequence[int]] = None, cell_deg: float = 0.1):
+        """
+        Args:
+            lats: Latitudes de los puntos
+            lngs: Longitudes de los puntos
+            ids: Identificador de cada punto (por defecto su posición)
+            cell_deg: Tamaño de la celda en grados
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        ids = np.asarray(ids if ids is not None else np.arange(len(lats)), dtype=np.int64)
+
+        rows = np.floor(lats / cell_deg).astype(np.int64)
+        cols = np.floor(lngs / cell_deg).astype(np.int64)
+        order = np.lexsort((cols, rows))  # estable: dentro de una celda se conserva el orden de entrada
+        cambios = np.flatnonzero((np.diff(rows[order]) != 0) | (np.diff(cols[order]) != 0)) + 1
+        starts = np.concatenate(([0], cambios)) if len(order) else np.empty(0, dtype=np.int64)
+
+        self._init_arrays({
+            "lats": lats, "lngs": lngs, "ids": ids, "order": order.astype(np.int64),
+            "cell_rows": rows[order][starts], "cell_cols": cols[order][starts],
+            "cell_bounds": np.append(starts, len(order)).astype(np.int64),
+            "cell_deg": np.array(cell_deg)
+        })
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "GridIndex":
+        """
+        Reconstruye un índice desde los arreglos de `to_arrays()` (pueden ser mapeados desde disco).
+
+        Args:
+            arrays: Dict nombre -> arreglo
+
+        Returns:
+            GridIndex
+        """
+        index = cls.__new__(cls)
+        index._init_arrays(arrays)
+        return index
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Arreglos que describen completamente el índice."""
+        return dict(self._arrays)
+
+    def _init_arrays(self, arrays: Dict[str, np.ndarray]) -> None:
+        self._arrays = arrays
+        self.cell_deg = float(arrays["cell_deg"])
+        self._lats = arrays["lats"]
+        self._lngs = arrays["lngs"]
+        self._order = arrays["order"]
+        self._ids = arrays["ids"]
+        self._bounds = arrays["cell_bounds"]
+        rows = arrays["cell_rows"]
+        cols = arrays["cell_cols"]
+        self._n_cells = len(rows)
+        if self._n_cells:
+            self._row_range = (int(rows.min()), int(rows.max()))
+            self._col_range = (int(cols.min()), int(cols.max()))
+            # Clave lineal (fila, columna) de cada celda: crece con el número de celda porque
+            # las celdas están ordenadas por fila y luego por columna, así se busca con searchsorted.
+            # Es el único arreglo derivado y tiene un elemento por celda ocupada.
+            self._width = self._col_range[1] - self._col_range[0] + 1
+            self._cell_keys = (rows - self._row_range[0]) * self._width + (cols - self._col_range[0])
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def within(self, lat: float, lng: float, radius: float,
+               predicate: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> List[Tuple[float, int]]:
+        """
+        Busca todos los puntos dentro de un radio, ordenados por distancia.
+
+        Args:
+            lat: Latitud de origen
+            lng: Longitud de origen
+            radius: Radio en km
+            predicate: Filtro opcional: recibe un arreglo de ids y devuelve una máscara booleana
+
+        Returns:
+            Lista de (distancia_km, id)
+        """
+        return self.nearest(lat, lng, len(self), predicate, max_distance=radius)
+
+    def _cell_of(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def _ring(self, row: int, col: int, r: int) -> np.ndarray:
+        """Números de las celdas ocupadas a distancia de Chebyshev r de (row, col)."""
+        row_min, row_max = self._row_range
+        col_min, col_max = self._col_range
+        filas, columnas = [], []
+        extremos = [rr for rr in {row - r, row + r} if row_min <= rr <= row_max]
+        if extremos:
+            tramo = np.arange(max(col - r, col_min), min(col + r, col_max) + 1)
+            filas.extend(np.full(len(tramo), rr) for rr in extremos)
+            columnas.extend(tramo for _ in extremos)
+        lados = [c for c in {col - r, col + r} if r > 0 and col_min <= c <= col_max]
+        if lados:
+            tramo = np.arange(max(row - r + 1, row_min), min(row + r - 1, row_max) + 1)
+            filas.extend(tramo for _ in lados)
+            columnas.extend(np.full(len(tramo), c) for c in lados)
+        if not filas:
+            return np.empty(0, dtype=np.intp)
+
+        claves = (np.concatenate(filas) - row_min) * self._width + (np.concatenate(columnas) - col_min)
+        celdas = np.minimum(np.searchsorted(self._cell_keys, claves), self._n_cells - 1)
+        return celdas[self._cell_keys[celdas] == claves]
+
+    def _cell_positions(self, cells: np.ndarray) -> np.ndarray:
+        """Posiciones de los puntos de las celdas dadas, concatenando sus tramos de `order`."""
+        inicios = self._bounds[cells]
+        largos = self._bounds[cells + 1] - inicios
+        # Índice de cada punto: inicio de su celda + su desplazamiento dentro de ella
+        desplazamientos = np.arange(int(largos.sum())) - np.repeat(np.cumsum(largos) - largos, largos)
+        return self._order[np.repeat(inicios, largos) + desplazamientos]
+
+    def _ring_lower_bound(self, lat: float, lng: float, row: int, col: int, r: int) -> float:
+        """Distancia mínima (km) desde el origen a cualquier punto del anillo r."""
+        if r == 0:
+            return 0.0
+        gap_lat = min(lat - (row - r + 1) * self.cell_deg, (row + r) * self.cell_deg - lat)
+        gap_lng = min(lng - (col - r + 1) * self.cell_deg, (col + r) * self.cell_deg - lng)
+
+        dist_lat = R * math.radians(gap_lat)
+        # Distancia de un punto a un meridiano separado gap_lng grados
+        sin_gap = math.sin(math.radians(min(gap_lng, 90.0)))
+        dist_lng = R * math.asin(min(1.0, math.cos(math.radians(lat)) * sin_gap))
+        return min(dist_lat, dist_lng)
+
+    def _max_ring(self, row: int, col: int) -> int:
+        row_min, row_max = self._row_range
+        col_min, col_max = self._col_range
+        return max(abs(row - row_min), abs(row - row_max), abs(col - col_min), abs(col - col_max))
+
+    def nearest(self, lat: float, lng: float, k: int = 1,
+                predicate: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+                max_distance: Optional[float] = None) -> List[Tuple[float, int]]:
+        """
+        Busca los k puntos más cercanos a un origen.
+
+        Args:
+            lat: Latitud de origen
+            lng: Longitud de origen
+            k: Cantidad de resultados
+            predicate: Filtro opcional: recibe un arreglo de ids y devuelve una máscara booleana
+            max_distance: Radio máximo en km (None = sin límite)
+
+        Returns:
+            Lista de (distancia_km, id) ordenada por distancia ascendente
+        """
+        if not self._n_cells or k <= 0:
+            return []
+
+        row, col = self._cell_of(lat, lng)
+        mejores: List[Tuple[float, int]] = []  # heap de (-distancia, -pos)
+        max_ring = self._max_ring(row, col)
+
+        for r in range(max_ring + 1):
+            cota = self._ring_lower_bound(lat, lng, row, col, r)
+            if len(mejores) == k and cota > -mejores[0][0]:
+                break
+            if max_distance is not None and cota > max_distance:
+                break
+            posiciones = self._cell_positions(self._ring(row, col, r))
+            if predicate is not None and len(posiciones):
+                posiciones = posiciones[predicate(self._ids[posiciones])]
+            if not len(posiciones):
+                continue
+            distancias = haversine_distances(lat, lng, self._lats[posiciones], self._lngs[posiciones])
+            if max_distance is not None:
+                dentro = distancias <= max_distance
+                posiciones, distancias = posiciones[dentro], distancias[dentro]
+            for pos, dist in zip(posiciones.tolist(), distancias.tolist()):
+                entry = (-dist, -pos)
+                if len(mejores) < k:
+                    heapq.heappush(mejores, entry)
+                elif entry > mejores[0]:
+                    heapq.heapreplace(mejores, entry)
+
+        return [(-neg_dist, int(self._ids[-neg_pos])) for neg_dist, neg_pos in sorted(mejores, reverse=True)]
+
+    def cell_minimums(self, values: np.ndarray) -> np.ndarray:
+        """
+        Mínimo de un valor por punto (p. ej. precio) dentro de cada celda.
+
+        Args:
+            values: Valor de cada punto, alineado con `lats`/`lngs` (inf = excluido)
+
+        Returns:
+            np.ndarray con el mínimo de cada celda
+        """
+        if not self._n_cells:
+            return np.empty(0, dtype=np.float64)
+        return np.minimum.reduceat(np.asarray(values, dtype=np.float64)[self._order], self._bounds[:-1])
+
+    def best_by_cost(self, lat: float, lng: float, k: int, values: np.ndarray, cell_minimums: np.ndarray,
+                     alpha: float, max_distance: Optional[float] = None,
+                     max_cost: Optional[float] = None) -> List[Tuple[float, float, int]]:
+        """
+        Los k puntos de menor costo `valor + alpha * distancia_km`, por ramificación y poda.
+
+        Cada celda se descarta sin calcular distancias si su valor mínimo más alpha por la
+        cota de distancia de su anillo ya supera al k-ésimo mejor costo, y la búsqueda se
+        detiene cuando ningún anillo restante puede mejorar el resultado. Los empates se
+        resuelven por distancia y luego por posición.
+
+        Args:
+            lat: Latitud de origen
+            lng: Longitud de origen
+            k: Cantidad de resultados
+            values: Valor de cada punto (inf = excluido)
+            cell_minimums: Resultado de `cell_minimums(values)`
+            alpha: Peso de cada km de distancia en el costo (>= 0)
+            max_distance: Radio máximo en km (None = sin límite)
+            max_cost: Costo máximo (None = sin límite)
+
+        Returns:
+            Lista de (costo, distancia_km, id) ordenada por costo ascendente
+        """
+        if not self._n_cells or k <= 0:
+            return []
+        minimo_global = float(cell_minimums.min())
+        if not math.isfinite(minimo_global):
+            return []
+        tope = max_cost if max_cost is not None else math.inf
+
+        row, col = self._cell_of(lat, lng)
+        mejores: List[Tuple[float, float, int]] = []  # heap de (-costo, -distancia, -pos)
+
+        for r in range(self._max_ring(row, col) + 1):
+            cota = self._ring_lower_bound(lat, lng, row, col, r)
+            if max_distance is not None and cota > max_distance:
+                break
+            if len(mejores) == k and minimo_global + alpha * cota > -mejores[0][0]:
+                break
+            if minimo_global + alpha * cota > tope:
+                break
+
+            celdas = self._ring(row, col, r)
+            cotas = cell_minimums[celdas] + alpha * cota
+            utiles = np.isfinite(cotas) & (cotas <= tope)
+            if len(mejores) == k:
+                utiles &= cotas <= -mejores[0][0]
+            posiciones = self._cell_positions(celdas[utiles])
+            if not len(posiciones):
+                continue
+
+            valores = values[posiciones]
+            distancias = haversine_distances(lat, lng, self._lats[posiciones], self._lngs[posiciones])
+            costos = valores + alpha * distancias
+            validos = np.isfinite(valores) & (costos <= tope)
+            if max_distance is not None:
+                validos &= distancias <= max_distance
+            for pos, dist, costo in zip(posiciones[validos].tolist(), distancias[validos].tolist(),
+                                        costos[validos].tolist()):
+                entry = (-costo, -dist, -pos)
+                if len(mejores) < k:
+                    heapq.heappush(mejores, entry)
+                elif entry > mejores[0]:
+                    heapq.heapreplace(mejores, entry)
+
+        return [(-neg_costo, -neg_dist, int(self._ids[-neg_pos]))
+                for neg_costo, neg_dist, neg_pos in sorted(mejores, reverse=True)]
@@ -0,0 +1,197 @@
+"""
+Módulo del modelo compacto de estación.
+Cada estación del snapshot se normaliza una sola vez a un objeto con __slots__
+(compañía, precios por producto e info de tienda ya resueltos). Las búsquedas
+responden referencias a estos objetos junto a la distancia al origen, y el
+dict de salida sólo se arma al serializar.
+"""
+
+from collections.abc import Mapping
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from utils.distance import haversine_distances
+from utils.mappings import PRODUCT_MAPPING, get_company_name, get_store_info, has_convenience_store
+from utils.search_utils import extract_coordinates, extract_product_price
+
+
+class Station:
+    """Estación normalizada de un snapshot (inmutable por convención)."""
+
+    __slots__ = ("id", "compania", "direccion", "comuna", "region", "latitud", "longitud",
+                 "precios", "tiene_tienda", "tienda")
+
+    def __init__(self, id: str, compania: str, direccion: Any, comuna: Any, region: Any,
+                 latitud: float, longitud: float, precios: Dict[str, int], tiene_tienda: bool,
+                 tienda: Optional[Dict[str, str]]):
+        self.id = id
+        self.compania = compania
+        self.direccion = direccion
+        self.comuna = comuna
+        self.region = region
+        self.latitud = latitud
+        self.longitud = longitud
+        self.precios = precios
+        self.tiene_tienda = tiene_tienda
+        self.tienda = tienda
+
+    @classmethod
+    def from_raw(cls, estacion: Dict[str, Any]) -> Optional["Station"]:
+        """
+        Normaliza una estación raw de busqueda_estacion_filtro.
+
+        Args:
+            estacion: Datos raw (o compactos) de la estación
+
+        Returns:
+            Station o None si no tiene coordenadas válidas
+        """
+        coordenadas = extract_coordinates(estacion)
+        if coordenadas is None:
+            return None
+
+        id_compania = estacion.get('marca', 0)
+        nombre_compania = get_company_name(id_compania)
+        tiene_tienda = has_convenience_store(id_compania)
+        tienda = None
+        if tiene_tienda:
+            tienda = get_store_info(id_compania, nombre_compania, estacion.get('comuna', 'Local'),
+                                    str(estacion.get('id', '0000')))
+
+        precios = {}
+        for product, id_producto in PRODUCT_MAPPING.items():
+            precio = extract_product_price(estacion, id_producto)
+            if precio is not None:
+                precios[product] = precio
+
+        return cls(
+            id=str(estacion.get('id', 'N/A')),
+            compania=nombre_compania,
+            direccion=estacion.get('direccion', estacion.get('Direccion', 'N/A')),
+            comuna=estacion.get('comuna', estacion.get('Comuna', 'N/A')),
+            region=estacion.get('region', estacion.get('Region', 'N/A')),
+            latitud=coordenadas[0],
+            longitud=coordenadas[1],
+            precios=precios,
+            tiene_tienda=tiene_tienda,
+            tienda=tienda
+        )
+
+
+class StationTable:
+    """Objetos Station de un snapshot por fila del store, creados en el primer acceso a cada fila."""
+
+    def __init__(self, store, estaciones: Sequence[Dict[str, Any]]):
+        """
+        Args:
+            store: StationStore del snapshot
+            estaciones: Estaciones raw del snapshot (pueden ser perezosas)
+        """
+        self._store = store
+        self._estaciones = estaciones
+        self._stations: List[Optional[Station]] = [None] * len(store.ids)
+
+    def __len__(self) -> int:
+        return len(self._stations)
+
+    def __getitem__(self, fila: int) -> Station:
+        station = self._stations[fila]
+        if station is None:
+            station = self._stations[fila] = Station.from_raw(self._estaciones[int(self._store.source[fila])])
+        return station
+
+
+class StationResult(Mapping):
+    """
+    Resultado de búsqueda: referencia a una Station más la distancia al origen.
+
+    Se comporta como el dict que retornaba `process_station_data` (mismas claves
+    y orden) y se convierte a dict recién al serializar la respuesta.
+    """
+
+    __slots__ = ("station", "product", "distancia", "costo")
+
+    def __init__(self, station: Station, product: str, distancia: float, costo: Optional[float] = None):
+        """
+        Args:
+            station: Estación del snapshot
+            product: Producto tal como se pidió (define la clave `precios{product}`)
+            distancia: Distancia lineal al origen en km
+            costo: Costo combinado precio + alpha * distancia (sólo en búsquedas por costo)
+        """
+        self.station = station
+        self.product = product
+        self.distancia = distancia
+        self.costo = costo
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Dict de respuesta con el formato histórico de la API."""
+        station = self.station
+        resultado = {
+            "id": station.id,
+            "compania": station.compania,
+            "direccion": station.direccion,
+            "comuna": station.comuna,
+            "region": station.region,
+            "latitud": station.latitud,
+            "longitud": station.longitud,
+            "distancia(lineal)": round(self.distancia, 2),
+            f"precios{self.product}": station.precios.get(self.product.lower()),
+            "tiene_tienda": station.tiene_tienda
+        }
+        if station.tienda:
+            resultado["tienda"] = station.tienda
+        if self.costo is not None:
+            resultado["costo"] = round(self.costo, 2)
+        return resultado
+
+    def __getitem__(self, clave: str) -> Any:
+        return self.to_dict()[clave]
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self) -> int:
+        return len(self.to_dict())
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __repr__(self) -> str:
+        return f"StationResult({self.to_dict()!r})"
+
+
+def build_station_results(store, stations: StationTable, filas: List[int], lat: float,
+                          lng: float, product: str, alpha: Optional[float] = None) -> List[StationResult]:
+    """
+    Genera la respuesta de las filas seleccionadas del store.
+
+    Args:
+        store: StationStore del snapshot
+        stations: StationTable del snapshot
+        filas: Filas del store a incluir, en orden
+        lat: Latitud de búsqueda
+        lng: Longitud de búsqueda
+        product: Producto solicitado
+        alpha: Peso por km de la búsqueda por costo (agrega `costo` a cada resultado)
+
+    Returns:
+        Lista de StationResult
+    """
+    if not len(filas):
+        return []
+    posiciones = np.asarray(filas, dtype=np.int64)
+    distancias = haversine_distances(lat, lng, store.lat[posiciones], store.lng[posiciones])
+    product_key = product.lower()
+
+    costos = [None] * len(posiciones)
+    if alpha is not None:
+        costos = (store.prices[product_key][posiciones] + alpha * distancias).tolist()
+
+    resultado = []
+    for fila, distancia, costo in zip(posiciones.tolist(), distancias.tolist(), costos):
+        station = stations[fila]
+        if station is not None and product_key in station.precios:
+            resultado.append(StationResult(station, product, distancia, costo))
+    return resultado
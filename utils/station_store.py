@@ -0,0 +1,219 @@
+"""
+Módulo de almacenamiento columnar de estaciones.
+Normaliza una sola vez el snapshot raw en arreglos NumPy para que las
+búsquedas se resuelvan con máscaras y reducciones vectorizadas.
+"""
+
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+
+from utils.mappings import PRODUCT_MAPPING, brand_tables
+from utils.search_utils import extract_coordinates
+
+
+class StationStore:
+    """
+    Columnas de un snapshot de estaciones.
+
+    Sólo incluye estaciones con coordenadas válidas. Cada fila conserva en
+    `source` la posición de la estación en la lista raw original.
+    """
+
+    def __init__(self, estaciones: List[Dict[str, Any]]):
+        """
+        Args:
+            estaciones: Lista raw de estaciones de busqueda_estacion_filtro
+        """
+        producto_por_id = {id_producto: product for product, id_producto in PRODUCT_MAPPING.items()}
+        lats, lngs, marcas, fuentes, ids = [], [], [], [], []
+        precios: Dict[str, List[float]] = {product: [] for product in PRODUCT_MAPPING}
+
+        for posicion, estacion in enumerate(estaciones):
+            coordenadas = extract_coordinates(estacion)
+            if coordenadas is None:
+                continue
+
+            marca = estacion.get('marca', 0)
+            lats.append(coordenadas[0])
+            lngs.append(coordenadas[1])
+            marcas.append(marca if isinstance(marca, int) else 0)
+            fuentes.append(posicion)
+            ids.append(str(estacion.get('id', 'N/A')))
+
+            fila = dict.fromkeys(PRODUCT_MAPPING, np.nan)
+            for combustible in estacion.get('combustibles', []):
+                product = producto_por_id.get(combustible.get('id'))
+                if product is None or not np.isnan(fila[product]):
+                    continue
+                precio = _parse_price(combustible.get('precio'))
+                if precio is not None:
+                    fila[product] = precio
+            for product, precio in fila.items():
+                precios[product].append(precio)
+
+        self.lat = np.array(lats, dtype=np.float64)
+        self.lng = np.array(lngs, dtype=np.float64)
+        self.brand = np.array(marcas, dtype=np.int32)
+        # Tienda por marca resuelta con la tabla densa de marcas, en una sola operación
+        self.has_store = brand_tables().store_mask(self.brand)
+        self.source = np.array(fuentes, dtype=np.int32)
+        self.ids = np.array(ids, dtype=np.str_)
+        self.prices = {product: np.array(valores, dtype=np.float64) for product, valores in precios.items()}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "StationStore":
+        """
+        Reconstruye un store desde los arreglos de `to_arrays()` (pueden ser mapeados desde disco).
+
+        Args:
+            arrays: Dict nombre -> arreglo
+
+        Returns:
+            StationStore
+        """
+        store = cls.__new__(cls)
+        store.lat = arrays["lat"]
+        store.lng = arrays["lng"]
+        store.brand = arrays["brand"]
+        store.has_store = arrays["has_store"]
+        store.source = arrays["source"]
+        store.ids = arrays["ids"]
+        store.prices = {product: arrays[f"price_{product}"] for product in PRODUCT_MAPPING}
+        return store
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Columnas del store como arreglos NumPy con nombre."""
+        arrays = {
+            "lat": self.lat, "lng": self.lng, "brand": self.brand, "has_store": self.has_store,
+            "source": self.source, "ids": self.ids
+        }
+        for product, precios in self.prices.items():
+            arrays[f"price_{product}"] = precios
+        return arrays
+
+    def __len__(self) -> int:
+        return len(self.source)
+
+    def product_mask(self, product: str, store_required: bool = False) -> np.ndarray:
+        """
+        Máscara de filas que venden el producto (y tienen tienda si se requiere).
+
+        Args:
+            product: Producto normalizado ("93", "diesel", ...)
+            store_required: Si se requiere tienda
+
+        Returns:
+            Arreglo booleano del largo del store
+        """
+        mask = ~np.isnan(self.prices[product])
+        if store_required:
+            mask &= self.has_store
+        return mask
+
+    def cheapest_row(self, product: str, store_required: bool = False) -> Optional[int]:
+        """
+        Fila con el menor precio del producto (la primera en caso de empate).
+
+        Returns:
+            Índice de fila o None si ninguna estación cumple
+        """
+        filas = self.cheapest_rows(product, 1, store_required)
+        return filas[0] if filas else None
+
+    def cheapest_rows(self, product: str, k: int, store_required: bool = False) -> List[int]:
+        """
+        Las k filas más baratas del producto por selección parcial (sin ordenar todo el país).
+        Los empates se resuelven por orden de fila, igual que un ordenamiento estable.
+
+        Args:
+            product: Producto normalizado
+            k: Cantidad de filas
+            store_required: Si se requiere tienda
+
+        Returns:
+            Lista de filas ordenadas por precio ascendente
+        """
+        mask = self.product_mask(product, store_required)
+        k = min(k, int(mask.sum()))
+        if k <= 0:
+            return []
+        precios = np.where(mask, self.prices[product], np.inf)
+        umbral = np.partition(precios, k - 1)[k - 1]
+        candidatos = np.flatnonzero(precios <= umbral)
+        orden = np.argsort(precios[candidatos], kind="stable")[:k]
+        return candidatos[orden].tolist()
+
+
+class StoreDiff:
+    """Diferencias entre dos stores consecutivos."""
+
+    def __init__(self):
+        self.added: Set[str] = set()
+        self.removed: Set[str] = set()
+        self.changed: Set[str] = set()
+        # Productos cuyo índice espacial cambió (filas, coordenadas o tienda)
+        self.layout_products: Set[str] = set()
+        # Productos con al menos un precio distinto
+        self.price_products: Set[str] = set()
+
+    @property
+    def empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
+    def summary(self) -> Dict[str, int]:
+        """Conteos del diff por tipo de cambio."""
+        return {"agregadas": len(self.added), "eliminadas": len(self.removed), "modificadas": len(self.changed)}
+
+
+def diff_stores(anterior: StationStore, nuevo: StationStore) -> StoreDiff:
+    """
+    Compara dos stores estación por estación (por id) y por producto (por fila).
+    
+    Args:
+        anterior: Store del snapshot previo
+        nuevo: Store del snapshot nuevo
+        
+    Returns:
+        StoreDiff con estaciones agregadas/eliminadas/modificadas y productos afectados
+    """
+    diff = StoreDiff()
+    filas_anteriores = {station_id: fila for fila, station_id in enumerate(anterior.ids.tolist())}
+    filas_nuevas = {station_id: fila for fila, station_id in enumerate(nuevo.ids.tolist())}
+    diff.added = set(filas_nuevas) - set(filas_anteriores)
+    diff.removed = set(filas_anteriores) - set(filas_nuevas)
+
+    comunes = [station_id for station_id in filas_nuevas if station_id in filas_anteriores]
+    viejas = np.array([filas_anteriores[station_id] for station_id in comunes], dtype=np.intp)
+    nuevas = np.array([filas_nuevas[station_id] for station_id in comunes], dtype=np.intp)
+    distinto = ((anterior.lat[viejas] != nuevo.lat[nuevas]) | (anterior.lng[viejas] != nuevo.lng[nuevas])
+                | (anterior.brand[viejas] != nuevo.brand[nuevas]))
+    for product in PRODUCT_MAPPING:
+        distinto |= ~_equal_with_nan(anterior.prices[product][viejas], nuevo.prices[product][nuevas])
+    diff.changed = {comunes[i] for i in np.flatnonzero(distinto)}
+
+    for product in PRODUCT_MAPPING:
+        filas_a = np.flatnonzero(anterior.product_mask(product))
+        filas_n = np.flatnonzero(nuevo.product_mask(product))
+        if not (np.array_equal(filas_a, filas_n)
+                and np.array_equal(anterior.lat[filas_a], nuevo.lat[filas_n])
+                and np.array_equal(anterior.lng[filas_a], nuevo.lng[filas_n])
+                and np.array_equal(anterior.has_store[filas_a], nuevo.has_store[filas_n])):
+            diff.layout_products.add(product)
+        elif not np.array_equal(anterior.prices[product][filas_a], nuevo.prices[product][filas_n]):
+            diff.price_products.add(product)
+    return diff
+
+
+def _equal_with_nan(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a == b) | (np.isnan(a) & np.isnan(b))
+
+
+def _parse_price(precio_str: Any) -> Optional[float]:
+    """Convierte el precio raw al entero que usa la API, como float."""
+    if precio_str is None:
+        return None
+    try:
+        return float(int(float(precio_str)))
+    except (ValueError, TypeError, OverflowError):
+        return None